@@ -1,6 +1 @@
-from . import state
-from . import tools
-from . import chain
-from . import utils
-from . import server
-
+# Note: Importing the package does not start the server, see server.py.
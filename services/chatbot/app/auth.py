@@ -0,0 +1,240 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from typing import Any, Optional
+
+import jwt
+from cryptography import x509
+from cryptography.hazmat.primitives import serialization
+
+from app import metrics
+from app.cache.lru import TtlLru
+
+logger = logging.getLogger(__name__)
+
+# Note: The backend signs context tokens with the integrations certificate key
+# (see BotToolsContextHandler), so the certificate itself is enough to verify them.
+KEYS_PATH = os.getenv("BOT_JWT_KEYS_PATH", None)
+# auto: verify if the BOT_JWT_KEYS_PATH file exists, true: refuse to start without keys,
+# false: accept tokens without verifying their signatures, for local development only.
+# Note: auto until the deployments mount the integrations certificate, then true.
+VERIFY = os.getenv("BOT_JWT_VERIFY", "auto").lower()
+KEYS_REFRESH_INTERVAL = float(os.getenv("BOT_JWT_KEYS_REFRESH_INTERVAL", "60"))
+ALGORITHMS = [a.strip() for a in os.getenv("BOT_JWT_ALGORITHMS", "ES384").split(",") if a.strip()]
+AUDIENCE = os.getenv("BOT_JWT_AUDIENCE", None)
+ISSUER = os.getenv("BOT_JWT_ISSUER", None)
+CACHE_MAX_ENTRIES = int(os.getenv("BOT_JWT_CACHE_MAX_ENTRIES", "1000"))
+
+_PEM_BLOCK = re.compile(
+    rb"-----BEGIN ([A-Z ]+)-----\r?\n.+?\r?\n-----END \1-----",
+    re.DOTALL
+)
+
+
+def _load_pem(data: bytes) -> list[tuple[Optional[str], Any]]:
+    keys = []
+    for match in _PEM_BLOCK.finditer(data):
+        block, kind = match.group(0), match.group(1)
+        if kind == b"CERTIFICATE":
+            keys.append((None, x509.load_pem_x509_certificate(block).public_key()))
+        elif kind == b"PUBLIC KEY":
+            keys.append((None, serialization.load_pem_public_key(block)))
+        # Private keys and anything else are ignored
+    return keys
+
+
+def _load_jwks(data: bytes) -> list[tuple[Optional[str], Any]]:
+    jwks = json.loads(data)
+    return [(key.key_id, key.key) for key in jwt.PyJWKSet.from_dict(jwks).keys]
+
+
+def load_keys(path: str) -> list[tuple[Optional[str], Any]]:
+    """Reads verification keys from a JWKS (JSON) or PEM file.
+
+    A PEM file may contain several certificates or public keys.
+    Returns a list of (kid, key); PEM keys have no kid.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    keys = _load_jwks(data) if data.lstrip().startswith(b"{") else _load_pem(data)
+    if not keys:
+        raise ValueError(f"No verification keys found in {path}")
+    return keys
+
+
+class KeySet:
+    """Verification keys read from a file, reloaded when the file changes.
+
+    Keys are rotated by replacing the file: put the new key next to the old one,
+    switch the signer, then remove the old key.
+    A reload that fails keeps the previous keys.
+
+    Args:
+        path: PEM or JWKS file.
+        refresh_interval: Seconds between file checks in the background. 0 disables them.
+    """
+
+    def __init__(self, path: str, *, refresh_interval: float = 0):
+        self.path = path
+        self.refresh_interval = refresh_interval
+        self.keys: list[tuple[Optional[str], Any]] = []
+        self.on_change = None
+        self._mtime = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.refresh()
+
+    def refresh(self) -> bool:
+        """Reloads the keys if the file changed. Returns True if they were reloaded."""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+            if mtime == self._mtime:
+                return False
+            keys = load_keys(self.path)
+        except Exception:
+            if not self.keys:
+                raise
+            logger.exception("Failed to reload JWT keys from %s, keeping the previous ones", self.path)
+            return False
+        self.keys, self._mtime = keys, mtime
+        metrics.AUTH_KEY_RELOADS.inc()
+        if self.on_change is not None:
+            self.on_change()
+        return True
+
+    def find(self, kid: Optional[str]) -> list[Any]:
+        """Keys to try for a token: the one with the matching kid, or all of them."""
+        keys = self.keys
+        if kid is not None:
+            matching = [key for key_id, key in keys if key_id == kid]
+            if matching:
+                return matching
+        return [key for _, key in keys]
+
+    def start(self):
+        if self.refresh_interval <= 0 or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target = self._run, name = "jwt-keys-refresh", daemon = True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.refresh_interval):
+            self.refresh()
+
+
+class TokenVerifier:
+    """Verifies JWT signatures and caches the claims of verified tokens until they expire.
+
+    Tokens are keyed by their hash, so the cache doesn't keep the tokens themselves.
+    Failed verifications are not cached. The cache is cleared when the keys change.
+
+    Args:
+        keys: Verification keys. None disables signature verification (local development only).
+        algorithms: Accepted signing algorithms.
+        audience: Expected `aud`, not checked if None.
+        issuer: Expected `iss`, not checked if None.
+        max_entries: Max number of cached tokens.
+    """
+
+    def __init__(
+        self,
+        keys: Optional[KeySet],
+        *,
+        algorithms: list[str],
+        audience: Optional[str] = None,
+        issuer: Optional[str] = None,
+        max_entries: int = 1000
+    ):
+        self.keys = keys
+        self.algorithms = algorithms
+        self.audience = audience
+        self.issuer = issuer
+        self.verified = TtlLru(max_entries = max_entries)
+        if keys is not None:
+            keys.on_change = self.verified.clear
+
+    def verify(self, token: str) -> dict[str, Any]:
+        """Returns the claims of the token. Raises jwt.InvalidTokenError if it isn't valid."""
+        if self.keys is None:
+            return jwt.decode(token, options = {"verify_signature": False})
+
+        key = hashlib.sha256(token.encode("utf-8")).digest()
+        claims = self.verified.get(key)
+        if claims is not None:
+            # The cache expiration is monotonic, recheck exp against the wall clock
+            if claims.get("exp", None) is None or claims["exp"] > time.time():
+                metrics.AUTH_TOKENS.inc("cache_hit")
+                return claims
+            self.verified.pop(key)
+
+        try:
+            with metrics.AUTH_VERIFICATION_SECONDS.time():
+                claims = self._verify(token)
+        except jwt.InvalidTokenError:
+            metrics.AUTH_TOKENS.inc("failed")
+            raise
+        metrics.AUTH_TOKENS.inc("verified")
+
+        expires_at = claims.get("exp", None)
+        if expires_at is not None:
+            ttl = expires_at - time.time()
+            if ttl > 0:
+                self.verified.set(key, claims, ttl = ttl)
+        return claims
+
+    def _verify(self, token: str) -> dict[str, Any]:
+        kid = jwt.get_unverified_header(token).get("kid", None)
+        error = None
+        for key in self.keys.find(kid):
+            try:
+                return jwt.decode(
+                    token,
+                    key = key,
+                    algorithms = self.algorithms,
+                    audience = self.audience,
+                    issuer = self.issuer,
+                    options = {
+                        "require": ["exp"],
+                        "verify_aud": self.audience is not None,
+                        "verify_iss": self.issuer is not None,
+                    }
+                )
+            except jwt.InvalidSignatureError as e:
+                # Try the next key
+                error = e
+        raise error or jwt.InvalidSignatureError("No verification key")
+
+
+def create_verifier() -> TokenVerifier:
+    if VERIFY == "false":
+        logger.warning("BOT_JWT_VERIFY is false: JWT signatures are NOT verified")
+        keys = None
+    elif KEYS_PATH is None or (VERIFY != "true" and not os.path.exists(KEYS_PATH)):
+        if VERIFY == "true":
+            raise RuntimeError("BOT_JWT_KEYS_PATH is not set. Set BOT_JWT_VERIFY=false to skip verification in local development.")
+        logger.error(
+            "No JWT keys at BOT_JWT_KEYS_PATH (%s): JWT signatures are NOT verified, any caller can act as any conversation. "
+            "Mount the integrations certificate there, see the README.",
+            KEYS_PATH
+        )
+        keys = None
+    else:
+        keys = KeySet(KEYS_PATH, refresh_interval = KEYS_REFRESH_INTERVAL)
+    return TokenVerifier(
+        keys,
+        algorithms = ALGORITHMS,
+        audience = AUDIENCE,
+        issuer = ISSUER,
+        max_entries = CACHE_MAX_ENTRIES
+    )
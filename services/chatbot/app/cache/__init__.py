@@ -0,0 +1,17 @@
+import os
+
+from .lru import TtlLru
+from .llm import ModelCache, SqliteCacheTier, cache_key, normalize_prompt
+
+def create_model_cache(
+    enabled: bool = os.getenv("BOT_LLM_CACHE", default = "true").lower() == "true",
+    *,
+    max_entries: int = int(os.getenv("BOT_LLM_CACHE_MAX_ENTRIES", default = 10000)),
+    ttl: float = float(os.getenv("BOT_LLM_CACHE_TTL", default = 24 * 60 * 60)),
+    sqlite_path: str = os.getenv("BOT_LLM_CACHE_SQLITE_PATH", default = ""),
+    sqlite_max_bytes: int = int(os.getenv("BOT_LLM_CACHE_SQLITE_MAX_BYTES", default = 64 * 1024 * 1024))
+) -> ModelCache:
+    if not enabled:
+        return None
+    disk = SqliteCacheTier(sqlite_path, max_bytes = sqlite_max_bytes, ttl = ttl) if sqlite_path else None
+    return ModelCache(max_entries = max_entries, ttl = ttl, disk = disk)
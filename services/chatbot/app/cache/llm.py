@@ -0,0 +1,239 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Optional
+
+from langchain_core.caches import BaseCache, RETURN_VAL_TYPE
+from langchain_core.load import dumps, loads
+
+from .. import metrics
+from .lru import TtlLru
+
+_WHITESPACE = re.compile(r"\s+")
+
+def _normalize_text(text: str) -> str:
+    return _WHITESPACE.sub(" ", text).strip().casefold()
+
+def normalize_prompt(prompt: str) -> str:
+    """Normalizes a serialized list of messages into a cache key part.
+
+    Message ids and response metadata are dropped and the text content is
+    whitespace and case normalized, so the same phrase sent in different
+    conversations maps to the same key.
+    """
+    try:
+        messages = json.loads(prompt)
+    except ValueError:
+        return _normalize_text(prompt)
+    if isinstance(messages, list):
+        for message in messages:
+            kwargs = message.get("kwargs") if isinstance(message, dict) else None
+            if not isinstance(kwargs, dict):
+                continue
+            kwargs.pop("id", None)
+            kwargs.pop("response_metadata", None)
+            kwargs.pop("usage_metadata", None)
+            if isinstance(kwargs.get("content"), str):
+                kwargs["content"] = _normalize_text(kwargs["content"])
+    return json.dumps(messages, sort_keys=True, ensure_ascii=False)
+
+def cache_key(prompt: str, llm_string: str) -> str:
+    # Note: llm_string covers the model name and invocation parameters
+    normalized = normalize_prompt(prompt) + "\0" + llm_string
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+class SqliteCacheTier:
+    """On-disk cache tier with TTL and size-based LRU eviction."""
+
+    def __init__(self, path: str, *, max_bytes: int, ttl: float = 0):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok = True)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread = False, isolation_level = None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS llm_cache_created ON llm_cache (created);
+            CREATE INDEX IF NOT EXISTS llm_cache_accessed ON llm_cache (accessed);
+        """)
+        self._size, = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, created = row
+            if self.ttl and created + self.ttl < now:
+                self._delete(key)
+                return None
+            self._conn.execute("UPDATE llm_cache SET accessed = ? WHERE key = ?", (now, key))
+        return value
+
+    def set(self, key: str, value: str):
+        now = time.time()
+        size = len(value.encode("utf-8"))
+        with self._lock:
+            self._delete(key)
+            self._conn.execute(
+                "INSERT INTO llm_cache (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, now, now)
+            )
+            self._size += size
+            self._evict(now)
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_cache")
+            self._size = 0
+
+    def _delete(self, key):
+        row = self._conn.execute("SELECT size FROM llm_cache WHERE key = ?", (key,)).fetchone()
+        if row is not None:
+            self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+            self._size -= row[0]
+
+    def _evict(self, now):
+        if self.ttl:
+            expired, = self._conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM llm_cache WHERE created < ?", (now - self.ttl,)
+            ).fetchone()
+            if expired:
+                self._conn.execute("DELETE FROM llm_cache WHERE created < ?", (now - self.ttl,))
+                self._size -= expired
+        while self._size > self.max_bytes:
+            rows = self._conn.execute(
+                "SELECT key, size FROM llm_cache ORDER BY accessed LIMIT 64"
+            ).fetchall()
+            if not rows:
+                self._size = 0
+                break
+            for key, size in rows:
+                if self._size <= self.max_bytes:
+                    break
+                self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self._size -= size
+
+
+class ModelCache(BaseCache):
+    """Memoization cache for non-tool model calls.
+
+    Pass it as `cache=` to a chat model. Lookups go through an in-memory LRU
+    and then through the optional on-disk tier. Disk hits are promoted to memory.
+
+    Args:
+        max_entries: Max number of entries in memory.
+        ttl: Seconds an entry lives in both tiers. 0 disables expiration.
+        disk: Optional on-disk tier.
+    """
+
+    def __init__(
+        self,
+        *,
+        max_entries: int = 10000,
+        ttl: float = 0,
+        disk: Optional[SqliteCacheTier] = None
+    ):
+        self.memory = TtlLru(max_entries = max_entries, ttl = ttl)
+        self.disk = disk
+
+    @staticmethod
+    def _copy(generations: RETURN_VAL_TYPE) -> list:
+        # Callers mutate returned messages, e.g. assign ids
+        return [generation.model_copy(deep = True) for generation in generations]
+
+    @staticmethod
+    def _served(generations: list) -> list:
+        # Note: Token counters skip these, see metrics.TokenUsage
+        for generation in generations:
+            generation.generation_info = {**(generation.generation_info or {}), metrics.FROM_CACHE: True}
+        return generations
+
+    def _lookup_memory(self, key: str) -> Optional[list]:
+        value = self.memory.get(key)
+        if value is None:
+            return None
+        metrics.LLM_CACHE_LOOKUPS.inc("memory_hit")
+        return self._served(self._copy(value))
+
+    def _lookup_disk(self, key: str) -> Optional[list]:
+        value = self.disk.get(key) if self.disk is not None else None
+        if value is None:
+            metrics.LLM_CACHE_LOOKUPS.inc("miss")
+            return None
+        metrics.LLM_CACHE_LOOKUPS.inc("disk_hit")
+        generations = loads(value)
+        self.memory.set(key, self._copy(generations))
+        return self._served(generations)
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        key = cache_key(prompt, llm_string)
+        result = self._lookup_memory(key)
+        if result is None:
+            result = self._lookup_disk(key)
+        return result
+
+    def contains(self, prompt: str, llm_string: str) -> bool:
+        """Checks for an entry without counting a hit or a miss, e.g. before a call is scheduled."""
+        key = cache_key(prompt, llm_string)
+        return self.memory.get(key) is not None or (self.disk is not None and self.disk.get(key) is not None)
+
+    async def acontains(self, prompt: str, llm_string: str) -> bool:
+        key = cache_key(prompt, llm_string)
+        if self.memory.get(key) is not None:
+            return True
+        if self.disk is None:
+            return False
+        return await asyncio.get_running_loop().run_in_executor(None, self.disk.get, key) is not None
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        key = cache_key(prompt, llm_string)
+        generations = self._copy(return_val)
+        for generation in generations:
+            message = getattr(generation, "message", None)
+            if message is not None:
+                # Otherwise every hit would return a message with the same id
+                message.id = None
+        self.memory.set(key, generations)
+        if self.disk is not None:
+            self.disk.set(key, dumps(generations))
+
+    def clear(self, **kwargs: Any) -> None:
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    async def alookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        # Memory hits are served right on the event loop
+        key = cache_key(prompt, llm_string)
+        result = self._lookup_memory(key)
+        if result is None:
+            if self.disk is None:
+                metrics.LLM_CACHE_LOOKUPS.inc("miss")
+                return None
+            result = await asyncio.get_running_loop().run_in_executor(None, self._lookup_disk, key)
+        return result
+
+    async def aupdate(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        if self.disk is None:
+            return self.update(prompt, llm_string, return_val)
+        await asyncio.get_running_loop().run_in_executor(None, self.update, prompt, llm_string, return_val)
@@ -1,3 +1,5 @@
+import asyncio
+import logging
 import os
 
 from enum import StrEnum, auto
@@ -7,7 +9,7 @@ import pydantic
 assert(pydantic.VERSION.startswith("2."))
 
 from langchain_core.runnables import RunnableLambda
-from langchain_core.runnables.config import RunnableConfig
+from langchain_core.runnables.config import RunnableConfig, merge_configs
 from langchain_core.messages import (
     HumanMessage,
     SystemMessage,
@@ -17,23 +19,123 @@ from langchain_core.messages import (
 from langchain_anthropic import ChatAnthropic
 
 from langgraph.graph import StateGraph, START, END
-from langgraph.checkpoint.memory import MemorySaver
 from langgraph.prebuilt import ToolNode
 
-from langfuse.decorators import langfuse_context, observe
-
+from . import cache
+from . import checkpoint
+from . import metrics
+from . import model_router
+from . import tracing
+from .context import count_tokens, fit_budget, split_window
+from .llm_scheduler import LlmScheduler, Priority, ScheduledModel, scheduler as default_scheduler
+from .mailbox import KeyedLocks, Mailboxes
+from .prompt_cache import (
+    HEADERS as PROMPT_CACHING_HEADERS,
+    cacheable_system_message,
+    cacheable_tools
+)
+from .message_log import MessageLog, SEQ
 from .state import State
+from .streaming import ReplyStreamer, REPLY_STREAMED, into_message
+from .tools.resolver_rules import SearchTypeRules
 from .tools import (
     all as all_tools,
     _reply as call_reply,
+    _areply as call_areply,
+    reply_updates_supported,
     save_tool_results_to_state as update_state
 )
 
+logger = logging.getLogger(__name__)
+
 MAX_MESSAGES_TO_TRIGGER_SUMMARIZATION = int(os.getenv(
     "BOT_MESSAGES_COUNT_TO_TRIGGER_SUMMARIZATION",
     default = 1000
 ))
 
+# Conversation is summarized once its messages take more tokens than this
+MAX_CONTEXT_TOKENS = int(os.getenv("BOT_CONTEXT_MAX_TOKENS", default = 6000))
+# Recent turns kept as is after summarization, the rest is folded into the summary
+KEEP_CONTEXT_TOKENS = int(os.getenv("BOT_CONTEXT_KEEP_TOKENS", default = 2000))
+
+# Summarize after the turn is returned to the user instead of within the turn.
+# Note: Only async calls return before the summary, sync calls have no event loop
+# to hand it off to, they summarize after the graph run but before returning.
+BACKGROUND_SUMMARIZATION = os.getenv(
+    "BOT_BACKGROUND_SUMMARIZATION",
+    default = "false"
+).lower() == "true"
+
+# Classify all pending user messages with a single model call
+BATCHED_SEARCH_TYPE_RESOLVER = os.getenv(
+    "BOT_BATCHED_SEARCH_TYPE_RESOLVER",
+    default = "false"
+).lower() == "true"
+
+# Resolve explicit search area phrases without the model
+SEARCH_TYPE_FAST_PATH = os.getenv(
+    "BOT_SEARCH_TYPE_FAST_PATH",
+    default = "true"
+).lower() == "true"
+# Optional JSON file with the fast path patterns, see resolver_rules.DEFAULT_RULES
+SEARCH_TYPE_RULES_PATH = os.getenv("BOT_SEARCH_TYPE_RULES_PATH", default = "")
+
+# Forward agent's text to the user while it is being generated.
+# Requires the backend to support reply updates.
+STREAM_REPLIES = os.getenv("BOT_STREAM_REPLIES", default = "false").lower() == "true"
+STREAM_FLUSH_INTERVAL = float(os.getenv("BOT_STREAM_FLUSH_INTERVAL", default = 0.5))
+STREAM_FLUSH_SIZE = int(os.getenv("BOT_STREAM_FLUSH_SIZE", default = 200))
+
+# Tool calling agent responses are cached only if explicitly requested
+CACHE_AGENT_CALLS = os.getenv("BOT_LLM_CACHE_AGENT", default = "false").lower() == "true"
+
+# Mark tool schemas, system prompts and the summary as cacheable by the provider
+PROMPT_CACHING = os.getenv("BOT_PROMPT_CACHING", default = "true").lower() == "true"
+
+class ResponseMode(StrEnum):
+    # The whole state
+    Full = auto()
+    # Messages added in this turn and changed state fields
+    Delta = auto()
+    # Status and ids of the messages added in this turn
+    Status = auto()
+
+# Note: Replies are delivered through the backend API, the response is not required.
+# Can be overridden per request with the "response_mode" configurable.
+RESPONSE_MODE_KEY = "response_mode"
+RESPONSE_MODE = ResponseMode(os.getenv("BOT_RESPONSE_MODE", default = ResponseMode.Full))
+
+def _response_mode(config: RunnableConfig) -> ResponseMode:
+    return ResponseMode(config.get("configurable", {}).get(RESPONSE_MODE_KEY, RESPONSE_MODE))
+
+def _turn_response(mode: ResponseMode, before: dict, result: dict) -> dict:
+    if mode == ResponseMode.Full:
+        return result
+    previous = before.get("messages", None)
+    since = previous[-1].response_metadata.get(SEQ, None) if previous else None
+    messages = result["messages"]
+    messages = messages if isinstance(messages, MessageLog) else MessageLog(messages)
+    added = messages.since(since)
+    if mode == ResponseMode.Status:
+        return {
+            "status": "ok",
+            "message_ids": [message.id for message in added]
+        }
+    delta = {
+        name: value
+        for name, value in result.items()
+        if name != "messages" and before.get(name, None) != value
+    }
+    delta["messages"] = added
+    return delta
+
+def _resolver_rules():
+    if not SEARCH_TYPE_FAST_PATH:
+        return None
+    if SEARCH_TYPE_RULES_PATH:
+        return SearchTypeRules.from_file(SEARCH_TYPE_RULES_PATH)
+    return SearchTypeRules()
+
 class Node(StrEnum):
     Agent = auto()
     Tools = auto()
@@ -42,30 +144,45 @@ class Node(StrEnum):
     FinalAnswer = auto()
     AskHuman = auto()
 
-@observe()
+def _answers(content):
+    if content is None:
+        return
+    if isinstance(content, list):
+        for line in content:
+            yield from _answers(line)
+        return
+    if isinstance(content, str):
+        yield content
+        return
+    tracing.annotate(
+        level="WARNING",
+        status_message=f"Unexpected content type: {str(type(content))}"
+    )
+    return
+
 def final_answer(state: State, config: RunnableConfig):
     """Sends a final answer to the user.
     """
-    def _try_add_answer(content):
-        if content is None:
-            return
-        if isinstance(content, list):
-            for line in content:
-                _try_add_answer(line)
-            return
-        if isinstance(content, str):
-            call_reply(content, config)
-            return
-        langfuse_context.update_current_observation(
-            level="WARNING",
-            status_message=f"Unexpected content type: {str(type(content))}"
-        )
-        return
     Ok = {"messages":[]}
     messages = state.messages
     if len(messages) > 0:
         last_message = messages[-1]
-        _try_add_answer(last_message.content)
+        for answer in _answers(last_message.content):
+            call_reply(answer, config)
+
+    return Ok
+
+async def afinal_answer(state: State, config: RunnableConfig):
+    """Sends a final answer to the user.
+    """
+    Ok = {"messages":[]}
+    messages = state.messages
+    if len(messages) > 0:
+        last_message = messages[-1]
+        if last_message.response_metadata.get(REPLY_STREAMED, False):
+            return Ok
+        for answer in _answers(last_message.content):
+            await call_areply(answer, config)
 
     return Ok
 
@@ -73,25 +190,84 @@ def final_answer(state: State, config: RunnableConfig):
 def ask_human(state):
     pass
 
+# Background summaries of all chains, see drain
+background_tasks: set[asyncio.Task] = set()
+
+async def drain(timeout: float):
+    """Waits for the background summaries, e.g. before the threads are handed off on shutdown."""
+    tasks = [task for task in background_tasks if not task.done()]
+    if tasks:
+        await asyncio.wait(tasks, timeout = timeout)
+
+
 def create(*,
     claude_api_key,
+    checkpointer = None,
+    llm_cache = None,
+    chat_model = ChatAnthropic,
+    background_summarization = None,
+    scheduler: LlmScheduler = None,
 #    prompt = None
 ):
-    memory = MemorySaver()
-    llm_no_tools = ChatAnthropic(
-        model="claude-3-haiku-20240307",
-        api_key = claude_api_key
-    )
+    """
+    Args:
+        chat_model: Chat model class or factory, e.g. a fake model for offline runs.
+        background_summarization: Overrides BOT_BACKGROUND_SUMMARIZATION.
+        scheduler: Rate limit scheduler of all model calls, the process wide one by default.
+    """
+    memory = checkpointer if checkpointer is not None else checkpoint.create()
+    llm_cache = llm_cache if llm_cache is not None else cache.create_model_cache()
+    if background_summarization is None:
+        background_summarization = BACKGROUND_SUMMARIZATION
+    scheduler = scheduler if scheduler is not None else default_scheduler
+    # Note: Prompt cache token counts are in chatbot_llm_tokens_total, see metrics.TokenUsage
+    prompt_caching_options = dict(default_headers = PROMPT_CACHING_HEADERS) if PROMPT_CACHING else {}
+
+    def scheduled(caller: str, priority: Priority, model_cache, bind = None):
+        def build(model: str, api_url):
+            llm = chat_model(
+                model = model,
+                api_key = claude_api_key,
+                cache = model_cache,
+                # Rate limited calls are retried by the scheduler
+                max_retries = 0,
+                **(dict(base_url = api_url) if api_url else {}),
+                **prompt_caching_options
+            )
+            if bind is not None:
+                llm = bind(llm)
+            # Note: Callbacks of the bindings count tokens per caller.
+            # All calls go through the scheduler with the priority of the caller.
+            return ScheduledModel(
+                llm.with_config(callbacks = [metrics.TokenUsage(caller)]),
+                scheduler,
+                priority
+            )
+        # Model of the call site, hedged and failed over (see model_router)
+        return model_router.create(caller, build)
+
+    summarizer = scheduled("summarizer", Priority.Summarizer, llm_cache)
 
-    tools = all_tools(classifier_model = llm_no_tools)
-    llm = ChatAnthropic(
-        model="claude-3-haiku-20240307",
-        api_key = claude_api_key
-    ).bind_tools(tools)
+    tools = all_tools(
+        classifier_model = scheduled("resolver", Priority.Resolver, llm_cache),
+        batched_resolver = BATCHED_SEARCH_TYPE_RESOLVER,
+        resolver_rules = _resolver_rules(),
+        prompt_caching = PROMPT_CACHING
+    )
+    llm = scheduled(
+        "agent",
+        Priority.Agent,
+        llm_cache if CACHE_AGENT_CALLS else False,
+        bind = lambda llm: llm.bind_tools(cacheable_tools(tools) if PROMPT_CACHING else tools)
+    )
 
     tool_node = ToolNode(tools)
 
-    def call_model(state: State):
+    def agent_input(state: State):
+        # Note: The conversation is summarized after the turn, a turn with many tool
+        # calls could still outgrow the budget. Only the prompt is trimmed, the state
+        # keeps all messages for the summary.
+        messages = fit_budget(state.messages, MAX_CONTEXT_TOKENS)
         # Note:
         # Using guide at:
         # https://langchain-ai.github.io/langgraph/how-tos/memory/add-summary-conversation-history/
@@ -99,60 +275,115 @@ def create(*,
         summary = state.summary or ""
         if summary:
             system_message = f"Summary of conversation earlier: {summary}"
-            messages = [SystemMessage(content=system_message)] + state.messages
-        else:
-            messages = state.messages
-        response = llm.invoke(messages)
+            if PROMPT_CACHING:
+                # Note: The summary changes only when older turns are folded into it,
+                # so it stays a stable prefix for a number of turns.
+                return [cacheable_system_message(system_message)] + messages
+            return [SystemMessage(content=system_message)] + messages
+        return messages
+
+    def call_model(state: State):
+        response = llm.invoke(agent_input(state))
         return {
             "messages": [response]
         }
 
-    def summarize(state: State):
+    async def acall_model(state: State, config: RunnableConfig):
+        # Note: Streamed text is sent as one reply updated in place. Until a reply shows
+        # the backend supports that, answers are sent whole by the final answer node.
+        if not STREAM_REPLIES or not reply_updates_supported():
+            response = await llm.ainvoke(agent_input(state), config)
+            return {
+                "messages": [response]
+            }
+
+        streamer = ReplyStreamer(
+            config,
+            flush_interval = STREAM_FLUSH_INTERVAL,
+            flush_size = STREAM_FLUSH_SIZE
+        )
+        aggregate = None
+        async for chunk in llm.astream(agent_input(state), config):
+            aggregate = chunk if aggregate is None else aggregate + chunk
+            await streamer.feed(chunk)
+        response = into_message(aggregate)
+        if await streamer.finish(response):
+            response.response_metadata[REPLY_STREAMED] = True
+        return {
+            "messages": [response]
+        }
+
+    def summarize_input(state: State, evicted):
         summary = state.summary or ""
         if summary:
             # If a summary already exists, we use a different system prompt
             # to summarize it than if one didn't
             summary_message = (
                 f"This is summary of the conversation to date: {summary}\n\n"
-                "Extend the summary by taking into account the new messages above:"
+                "Extend the summary by taking into account the new messages above. "
+                "Keep it concise:"
             )
         else:
-            summary_message = "Create a summary of the conversation above:"
+            summary_message = "Create a concise summary of the conversation above:"
 
-        messages = [
+        return [
             SystemMessage(
                 content = get_buffer_string(
-                    state.messages
+                    evicted
                 )
             ),
             HumanMessage(content=summary_message)
         ]
-        response = llm_no_tools.invoke(messages)
-        # We now need to delete messages that we no longer want to show up
-        # Note: It deletes ALL messages and keeps the summary.
-        # Otherwise it requires to keep pairs of tools invocations and their results.
+
+    def summary_update(evicted, response):
+        # Only the messages folded into the summary are deleted.
+        # Note: split_window keeps pairs of tools invocations and their results together.
         # If pairs are not kept together it fails on the next llm invocation.
-        delete_messages = [RemoveMessage(id=m.id) for m in state.messages]
+        delete_messages = [RemoveMessage(id=m.id) for m in evicted]
         return {
             "summary": response.content,
             "messages": delete_messages
         }
 
+    def summarize(state: State):
+        evicted, _ = split_window(state.messages, KEEP_CONTEXT_TOKENS)
+        if not evicted:
+            return {"messages": []}
+        response = summarizer.invoke(summarize_input(state, evicted))
+        return summary_update(evicted, response)
+
+    async def asummarize(state: State):
+        evicted, _ = split_window(state.messages, KEEP_CONTEXT_TOKENS)
+        if not evicted:
+            return {"messages": []}
+        response = await summarizer.ainvoke(summarize_input(state, evicted))
+        return summary_update(evicted, response)
+
     def tools_or_final_answer(state: State) -> Literal[Node.Tools, Node.FinalAnswer]:
         last_message = state.messages[-1]
         return Node.Tools if last_message.tool_calls else Node.FinalAnswer
 
+    def should_summarize(state: State) -> bool:
+        return (
+            len(state.messages) >= MAX_MESSAGES_TO_TRIGGER_SUMMARIZATION
+            or count_tokens(state.messages) > MAX_CONTEXT_TOKENS
+        )
+
     def summarize_or_ask_human(state: State) -> Literal[Node.Summarize, Node.AskHuman]:
-        should_summarize = len(state.messages) >= MAX_MESSAGES_TO_TRIGGER_SUMMARIZATION
-        return Node.Summarize if should_summarize else Node.AskHuman
+        if background_summarization:
+            # See schedule_summary below
+            return Node.AskHuman
+        return Node.Summarize if should_summarize(state) else Node.AskHuman
 
     graph_builder = StateGraph(State)
 
-    graph_builder.add_node(Node.Agent, call_model)
+    # Note: Nodes with both sync and async implementations are wrapped
+    # in RunnableLambda so that graph.ainvoke never blocks the event loop.
+    graph_builder.add_node(Node.Agent, RunnableLambda(call_model, afunc = acall_model))
     graph_builder.add_node(Node.Tools, tool_node)
     graph_builder.add_node(Node.UpdateState, update_state)
-    graph_builder.add_node(Node.Summarize, summarize)
-    graph_builder.add_node(Node.FinalAnswer, final_answer)
+    graph_builder.add_node(Node.Summarize, RunnableLambda(summarize, afunc = asummarize))
+    graph_builder.add_node(Node.FinalAnswer, RunnableLambda(final_answer, afunc = afinal_answer))
     graph_builder.add_node(Node.AskHuman, ask_human)
 
     graph_builder.add_edge(START, Node.Agent)
@@ -175,13 +406,116 @@ def create(*,
         interrupt_before=[Node.AskHuman]
     )
 
-    def invoke_graph(input_text, config: RunnableConfig) -> State:
-        messages = {"messages": [HumanMessage(content=input_text)]}
-        if graph.get_state(config).next==(Node.AskHuman,):
-            # Update state & resume execution after human input
-            graph.update_state(config, messages, as_node=Node.AskHuman)
-            return graph.invoke(None, config)
-        # Invoke graph from the start
-        return graph.invoke(messages, config)
+    # Note: Background summaries are written to the thread state as if
+    # the Summarize node ran, so the thread keeps waiting for AskHuman.
+    summary_tasks: dict[str, asyncio.Task] = {}
+
+    def summarize_thread(config: RunnableConfig):
+        state = State(**graph.get_state(config).values)
+        if should_summarize(state):
+            update = summarize(state)
+            if update["messages"]:
+                graph.update_state(config, update, as_node=Node.Summarize)
+
+    async def asummarize_thread(config: RunnableConfig):
+        try:
+            with tracing.trace(Node.Summarize, thread_id=config["configurable"]["thread_id"]):
+                # Note: No other run of this thread can start until this task is done,
+                # see await_summary. So the state can't change in between.
+                state = State(**(await graph.aget_state(config)).values)
+                if should_summarize(state):
+                    with metrics.NODE_SECONDS.time(Node.Summarize):
+                        update = await asummarize(state)
+                    if update["messages"]:
+                        await graph.aupdate_state(config, update, as_node=Node.Summarize)
+        except Exception:
+            # Context is summarized again after the next turn
+            logger.exception("Background summarization failed.")
+
+    def schedule_summary(config: RunnableConfig, result):
+        if not should_summarize(State(**result)):
+            return
+        thread_id = config["configurable"]["thread_id"]
+        task = asyncio.create_task(asummarize_thread({"configurable": {"thread_id": thread_id}}))
+        summary_tasks[thread_id] = task
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+        def forget(_):
+            if summary_tasks.get(thread_id) is task:
+                del summary_tasks[thread_id]
+        task.add_done_callback(forget)
+
+    async def await_summary(config: RunnableConfig):
+        # A new message of the same thread waits for its summary to be merged
+        task = summary_tasks.get(config["configurable"]["thread_id"], None)
+        if task is not None and not task.done():
+            await asyncio.shield(task)
+
+    def run_turn(input_texts, config: RunnableConfig):
+        messages = {"messages": [HumanMessage(content=text) for text in input_texts]}
+        with tracing.trace("turn", thread_id=config["configurable"]["thread_id"]) as trace:
+            graph_metrics = metrics.GraphMetrics()
+            run_config = merge_configs(config, {"callbacks": [graph_metrics] + tracing.callbacks(trace)})
+            snapshot = graph.get_state(config)
+            if snapshot.next==(Node.AskHuman,):
+                # Update state & resume execution after human input
+                graph.update_state(config, messages, as_node=Node.AskHuman)
+                result = graph.invoke(None, run_config)
+            else:
+                # Invoke graph from the start
+                result = graph.invoke(messages, run_config)
+            graph_metrics.finish()
+        if background_summarization:
+            # Note: No event loop to run it in the background here, the caller waits
+            # for the summary. It is still out of the graph run, like schedule_summary.
+            summarize_thread(config)
+        return snapshot.values, result
+
+    async def arun_turn(thread_id, items):
+        # Messages which arrived during the previous turn are answered with one turn.
+        # The latest config is used, it has the freshest auth context.
+        input_texts = [text for text, _ in items]
+        config = items[-1][1]
+        metrics.COALESCED_MESSAGES.inc(amount = len(items) - 1)
+        await await_summary(config)
+        messages = {"messages": [HumanMessage(content=text) for text in input_texts]}
+        with tracing.trace("turn", thread_id=thread_id, messages=len(input_texts)) as trace:
+            graph_metrics = metrics.GraphMetrics()
+            run_config = merge_configs(config, {"callbacks": [graph_metrics] + tracing.callbacks(trace)})
+            snapshot = await graph.aget_state(config)
+            if snapshot.next==(Node.AskHuman,):
+                # Update state & resume execution after human input
+                await graph.aupdate_state(config, messages, as_node=Node.AskHuman)
+                result = await graph.ainvoke(None, run_config)
+            else:
+                # Invoke graph from the start
+                result = await graph.ainvoke(messages, run_config)
+            graph_metrics.finish()
+        if background_summarization:
+            schedule_summary(config, result)
+        return snapshot.values, result
+
+    # Note: Turns of a conversation run one at a time, otherwise they race on its checkpoint.
+    conversations = Mailboxes(arun_turn)
+    conversation_locks = KeyedLocks()
+
+    def invoke_graph(input_text, config: RunnableConfig) -> dict:
+        mode = _response_mode(config)
+        # Note: The sync path only serializes turns, it doesn't coalesce messages
+        with conversation_locks.get(config["configurable"]["thread_id"]):
+            before, result = run_turn([input_text], config)
+        return _turn_response(mode, before, result)
+
+    async def ainvoke_graph(input_text, config: RunnableConfig) -> dict:
+        mode = _response_mode(config)
+        before, result = await conversations.submit(
+            config["configurable"]["thread_id"],
+            (input_text, config)
+        )
+        return _turn_response(mode, before, result)
 
-    return RunnableLambda(invoke_graph)
+    # Note: The return type is the output schema langserve validates responses with,
+    # so it must allow every response mode, see _turn_response.
+    # Note: langserve calls ainvoke/astream, so the async path is the main one.
+    # The sync one is kept as a fallback.
+    return RunnableLambda(invoke_graph, afunc = ainvoke_graph)
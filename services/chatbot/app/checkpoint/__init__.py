@@ -0,0 +1,47 @@
+import os
+from enum import StrEnum, auto
+
+from .backend import CheckpointBackend, CheckpointRecord, CheckpointStats, WriteRecord
+from .memory import MemoryBackend
+from .sqlite import SqliteBackend
+from .saver import BackendSaver
+
+class CheckpointerKind(StrEnum):
+    Memory = auto()
+    Sqlite = auto()
+
+def create(
+    kind: str = os.getenv("BOT_CHECKPOINTER", default = CheckpointerKind.Memory),
+    *,
+    sqlite_path: str = os.getenv("BOT_CHECKPOINTER_SQLITE_PATH", default = "data/checkpoints.sqlite"),
+    hot_threads: int = int(os.getenv("BOT_CHECKPOINTER_HOT_THREADS", default = 256)),
+    keep_checkpoints: int = int(os.getenv("BOT_CHECKPOINTER_KEEP_CHECKPOINTS", default = 10)),
+    max_threads: int = int(os.getenv("BOT_CHECKPOINTER_MAX_THREADS", default = 10000)),
+    idle_ttl: float = float(os.getenv("BOT_CHECKPOINTER_IDLE_TTL", default = 24 * 60 * 60)),
+    spill_path: str = os.getenv("BOT_CHECKPOINTER_SPILL_PATH", default = "")
+) -> BackendSaver:
+    match CheckpointerKind(kind.lower()):
+        case CheckpointerKind.Memory:
+            backend = MemoryBackend(
+                max_threads = max_threads,
+                idle_ttl = idle_ttl,
+                spill = SqliteBackend(spill_path) if spill_path else None
+            )
+            # Everything is in memory already, there's nothing to cache.
+            return BackendSaver(backend, keep_checkpoints = keep_checkpoints)
+        case CheckpointerKind.Sqlite:
+            return BackendSaver(
+                SqliteBackend(sqlite_path),
+                hot_threads = hot_threads,
+                keep_checkpoints = keep_checkpoints
+            )
+
+
+def handoff(saver: BackendSaver) -> int:
+    """Moves threads kept in memory to the spill backend, the next process restores them from there.
+
+    Returns the number of threads moved.
+    """
+    if isinstance(saver.backend, MemoryBackend):
+        return saver.backend.spill_all()
+    return 0
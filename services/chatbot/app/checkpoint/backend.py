@@ -0,0 +1,100 @@
+from abc import ABC, abstractmethod
+from typing import Iterator, NamedTuple, Optional, Tuple
+
+# Serialized value as produced by SerializerProtocol.dumps_typed
+Typed = Tuple[str, bytes]
+
+class CheckpointRecord(NamedTuple):
+    thread_id: str
+    checkpoint_ns: str
+    checkpoint_id: str
+    parent_checkpoint_id: Optional[str]
+    checkpoint: Typed
+    metadata: Typed
+
+class WriteRecord(NamedTuple):
+    task_id: str
+    idx: int
+    channel: str
+    value: Typed
+
+class CheckpointStats(NamedTuple):
+    threads: int
+    # Approximate size of serialized checkpoints and writes
+    bytes: int
+
+def record_size(record: CheckpointRecord) -> int:
+    return len(record.checkpoint[1] or b"") + len(record.metadata[1] or b"")
+
+def write_size(write: WriteRecord) -> int:
+    return len(write.value[1] or b"")
+
+
+class CheckpointBackend(ABC):
+    """Storage for serialized checkpoints and pending writes.
+
+    Backends only deal with opaque serialized records.
+    Serialization, caching and langgraph specifics live in BackendSaver,
+    so a shared database backend only needs to implement these methods.
+    All methods are synchronous and must be thread safe:
+    the async saver API calls them from an executor.
+    """
+
+    @abstractmethod
+    def get_checkpoint(
+        self,
+        thread_id: str,
+        checkpoint_ns: str,
+        checkpoint_id: Optional[str] = None
+    ) -> Optional[CheckpointRecord]:
+        """Returns the given checkpoint or the latest one if checkpoint_id is None."""
+
+    @abstractmethod
+    def list_checkpoints(
+        self,
+        thread_id: Optional[str],
+        checkpoint_ns: Optional[str],
+        *,
+        checkpoint_id: Optional[str] = None,
+        before_id: Optional[str] = None,
+        limit: Optional[int] = None
+    ) -> Iterator[CheckpointRecord]:
+        """Lists checkpoints, newest first. None arguments match everything."""
+
+    @abstractmethod
+    def put_checkpoint(self, record: CheckpointRecord) -> None:
+        pass
+
+    @abstractmethod
+    def get_writes(
+        self,
+        thread_id: str,
+        checkpoint_ns: str,
+        checkpoint_id: str
+    ) -> list[WriteRecord]:
+        pass
+
+    @abstractmethod
+    def put_writes(
+        self,
+        thread_id: str,
+        checkpoint_ns: str,
+        checkpoint_id: str,
+        writes: list[WriteRecord]
+    ) -> None:
+        """Stores writes. A write with the same (task_id, idx) replaces the existing one."""
+
+    @abstractmethod
+    def prune(self, thread_id: str, checkpoint_ns: str, keep: int) -> None:
+        """Deletes all but the latest `keep` checkpoints of the thread along with their writes."""
+
+    @abstractmethod
+    def delete_thread(self, thread_id: str) -> None:
+        pass
+
+    @abstractmethod
+    def stats(self) -> CheckpointStats:
+        pass
+
+    def close(self) -> None:
+        pass
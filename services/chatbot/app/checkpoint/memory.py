@@ -0,0 +1,236 @@
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from typing import Iterator, Optional
+
+from .backend import (
+    CheckpointBackend,
+    CheckpointRecord,
+    CheckpointStats,
+    WriteRecord,
+    record_size,
+    write_size,
+)
+
+
+class MemoryBackend(CheckpointBackend):
+    """Keeps checkpoints in the process heap. State is lost on restart.
+
+    Memory is bounded by evicting whole threads:
+    idle ones after `idle_ttl` seconds and the least recently used ones
+    once there are more than `max_threads`. Evicted threads are moved
+    to the `spill` backend if it is set and dropped otherwise.
+    Eviction runs on writes, so no background task is required.
+
+    Args:
+        max_threads: Max number of threads in memory. 0 means unbounded.
+        idle_ttl: Seconds after the last access to evict a thread. 0 disables it.
+        spill: Backend to move evicted threads to, e.g. SqliteBackend.
+    """
+
+    def __init__(
+        self,
+        *,
+        max_threads: int = 0,
+        idle_ttl: float = 0,
+        spill: Optional[CheckpointBackend] = None
+    ):
+        self.max_threads = max_threads
+        self.idle_ttl = idle_ttl
+        self.spill = spill
+        self._lock = threading.RLock()
+        # thread ID -> checkpoint NS -> checkpoint ID -> record
+        self._checkpoints = defaultdict(lambda: defaultdict(dict))
+        # thread ID -> (checkpoint NS, checkpoint ID) -> (task ID, idx) -> write
+        self._writes = defaultdict(lambda: defaultdict(dict))
+        # thread ID -> last access time, least recently used first
+        self._threads: OrderedDict[str, float] = OrderedDict()
+        # thread ID -> approximate size in bytes
+        self._bytes: dict[str, int] = defaultdict(int)
+        self._total_bytes = 0
+
+    # Threads bookkeeping, must be called under the lock
+
+    def _touch(self, thread_id: str, *, create: bool = False) -> bool:
+        if thread_id in self._threads:
+            self._threads[thread_id] = time.monotonic()
+            self._threads.move_to_end(thread_id)
+            return True
+        if self.spill is not None and self._restore(thread_id):
+            return True
+        if create:
+            self._threads[thread_id] = time.monotonic()
+            return True
+        return False
+
+    def _restore(self, thread_id: str) -> bool:
+        records = list(self.spill.list_checkpoints(thread_id, None))
+        if not records:
+            return False
+        self._threads[thread_id] = time.monotonic()
+        for record in records:
+            self._put_checkpoint(record)
+            self._put_writes(
+                thread_id,
+                record.checkpoint_ns,
+                record.checkpoint_id,
+                self.spill.get_writes(thread_id, record.checkpoint_ns, record.checkpoint_id)
+            )
+        self.spill.delete_thread(thread_id)
+        return True
+
+    def _evict(self):
+        if self.idle_ttl > 0:
+            expired_at = time.monotonic() - self.idle_ttl
+            while self._threads:
+                thread_id, last_access = next(iter(self._threads.items()))
+                if last_access > expired_at:
+                    break
+                self._evict_thread(thread_id)
+        if self.max_threads > 0:
+            while len(self._threads) > self.max_threads:
+                self._evict_thread(next(iter(self._threads)))
+
+    def _evict_thread(self, thread_id: str):
+        if self.spill is not None:
+            writes = self._writes.get(thread_id, {})
+            for checkpoints in self._checkpoints.get(thread_id, {}).values():
+                for record in checkpoints.values():
+                    self.spill.put_checkpoint(record)
+                    key = (record.checkpoint_ns, record.checkpoint_id)
+                    if key in writes:
+                        self.spill.put_writes(
+                            thread_id,
+                            record.checkpoint_ns,
+                            record.checkpoint_id,
+                            list(writes[key].values())
+                        )
+        self._drop_thread(thread_id)
+
+    def _drop_thread(self, thread_id: str):
+        self._threads.pop(thread_id, None)
+        self._checkpoints.pop(thread_id, None)
+        self._writes.pop(thread_id, None)
+        self._total_bytes -= self._bytes.pop(thread_id, 0)
+
+    def _put_checkpoint(self, record: CheckpointRecord):
+        checkpoints = self._checkpoints[record.thread_id][record.checkpoint_ns]
+        if (existing := checkpoints.get(record.checkpoint_id)) is not None:
+            self._add_bytes(record.thread_id, -record_size(existing))
+        checkpoints[record.checkpoint_id] = record
+        self._add_bytes(record.thread_id, record_size(record))
+
+    def _put_writes(self, thread_id, checkpoint_ns, checkpoint_id, writes: list[WriteRecord]):
+        stored = self._writes[thread_id][(checkpoint_ns, checkpoint_id)]
+        for write in writes:
+            key = (write.task_id, write.idx)
+            if (existing := stored.get(key)) is not None:
+                self._add_bytes(thread_id, -write_size(existing))
+            stored[key] = write
+            self._add_bytes(thread_id, write_size(write))
+
+    def _add_bytes(self, thread_id: str, size: int):
+        self._bytes[thread_id] += size
+        self._total_bytes += size
+
+    # CheckpointBackend API
+
+    def get_checkpoint(self, thread_id, checkpoint_ns, checkpoint_id = None):
+        with self._lock:
+            if not self._touch(thread_id):
+                return None
+            checkpoints = self._checkpoints[thread_id].get(checkpoint_ns)
+            if not checkpoints:
+                return None
+            if checkpoint_id is None:
+                checkpoint_id = max(checkpoints.keys())
+            return checkpoints.get(checkpoint_id)
+
+    def list_checkpoints(
+        self,
+        thread_id,
+        checkpoint_ns,
+        *,
+        checkpoint_id = None,
+        before_id = None,
+        limit = None
+    ) -> Iterator[CheckpointRecord]:
+        with self._lock:
+            if thread_id is not None:
+                thread_ids = [thread_id] if self._touch(thread_id) else []
+            else:
+                thread_ids = list(self._threads.keys())
+            records = []
+            for tid in thread_ids:
+                for ns, checkpoints in self._checkpoints[tid].items():
+                    if checkpoint_ns is not None and ns != checkpoint_ns:
+                        continue
+                    records.extend(
+                        sorted(checkpoints.values(), key=lambda r: r.checkpoint_id, reverse=True)
+                    )
+        count = 0
+        for record in records:
+            if checkpoint_id is not None and record.checkpoint_id != checkpoint_id:
+                continue
+            if before_id is not None and record.checkpoint_id >= before_id:
+                continue
+            if limit is not None and count >= limit:
+                break
+            count += 1
+            yield record
+
+    def put_checkpoint(self, record: CheckpointRecord):
+        with self._lock:
+            self._touch(record.thread_id, create = True)
+            self._put_checkpoint(record)
+            self._evict()
+
+    def get_writes(self, thread_id, checkpoint_ns, checkpoint_id) -> list[WriteRecord]:
+        with self._lock:
+            if not self._touch(thread_id):
+                return []
+            return list(self._writes[thread_id].get((checkpoint_ns, checkpoint_id), {}).values())
+
+    def put_writes(self, thread_id, checkpoint_ns, checkpoint_id, writes: list[WriteRecord]):
+        with self._lock:
+            self._touch(thread_id, create = True)
+            self._put_writes(thread_id, checkpoint_ns, checkpoint_id, writes)
+
+    def prune(self, thread_id, checkpoint_ns, keep: int):
+        with self._lock:
+            checkpoints = self._checkpoints.get(thread_id, {}).get(checkpoint_ns)
+            if not checkpoints or len(checkpoints) <= keep:
+                return
+            writes = self._writes.get(thread_id, {})
+            for checkpoint_id in sorted(checkpoints.keys())[:-keep]:
+                self._add_bytes(thread_id, -record_size(checkpoints.pop(checkpoint_id)))
+                for write in writes.pop((checkpoint_ns, checkpoint_id), {}).values():
+                    self._add_bytes(thread_id, -write_size(write))
+
+    def delete_thread(self, thread_id):
+        with self._lock:
+            self._drop_thread(thread_id)
+        if self.spill is not None:
+            self.spill.delete_thread(thread_id)
+
+    def evict_idle(self):
+        with self._lock:
+            self._evict()
+
+    def stats(self) -> CheckpointStats:
+        with self._lock:
+            return CheckpointStats(threads = len(self._threads), bytes = self._total_bytes)
+
+    def spill_all(self) -> int:
+        """Moves all threads to the spill backend, e.g. before a restart. Returns their number."""
+        if self.spill is None:
+            return 0
+        with self._lock:
+            threads = list(self._threads)
+            for thread_id in threads:
+                self._evict_thread(thread_id)
+        return len(threads)
+
+    def close(self):
+        if self.spill is not None:
+            self.spill.close()
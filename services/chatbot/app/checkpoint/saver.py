@@ -0,0 +1,322 @@
+import asyncio
+import random
+import threading
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, Iterator, Optional, Sequence, Tuple
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    SerializerProtocol,
+    get_checkpoint_id,
+)
+from langgraph.checkpoint.serde.types import TASKS, ChannelProtocol
+
+from .backend import CheckpointBackend, CheckpointRecord, CheckpointStats, WriteRecord
+
+
+class _HotThread:
+    """Serialized latest checkpoint of a thread with its writes."""
+    __slots__ = ("record", "writes", "sends")
+
+    def __init__(self, record: CheckpointRecord, writes: dict, sends: Optional[list]):
+        self.record = record
+        # (task ID, idx) -> WriteRecord
+        self.writes = writes
+        # Serialized TASKS writes of the parent checkpoint, None if not loaded yet
+        self.sends = sends
+
+
+class BackendSaver(BaseCheckpointSaver[str]):
+    """Checkpoint saver on top of a pluggable CheckpointBackend.
+
+    Keeps a small LRU of the latest checkpoint of hot threads.
+    Records are cached serialized, so every read returns fresh objects
+    which langgraph is free to mutate, yet the storage isn't touched.
+
+    Args:
+        backend: Storage for serialized checkpoints.
+        hot_threads: Max number of threads to keep in the LRU. 0 disables it.
+        keep_checkpoints: Number of latest checkpoints to keep per thread.
+            0 keeps all of them. At least 2 are kept, so pending sends
+            of the latest checkpoint (stored as its parent's writes) survive.
+    """
+
+    def __init__(
+        self,
+        backend: CheckpointBackend,
+        *,
+        hot_threads: int = 0,
+        keep_checkpoints: int = 0,
+        serde: Optional[SerializerProtocol] = None
+    ):
+        super().__init__(serde = serde)
+        self.backend = backend
+        self.hot_threads = hot_threads
+        self.keep_checkpoints = max(keep_checkpoints, 2) if keep_checkpoints > 0 else 0
+        self._hot: OrderedDict[Tuple[str, str], _HotThread] = OrderedDict()
+        self._lock = threading.Lock()
+
+    # Hot threads LRU
+
+    def _get_hot(self, key) -> Optional[_HotThread]:
+        with self._lock:
+            hot = self._hot.get(key)
+            if hot is not None:
+                self._hot.move_to_end(key)
+            return hot
+
+    def _set_hot(self, key, hot: _HotThread):
+        if self.hot_threads <= 0:
+            return
+        with self._lock:
+            self._hot[key] = hot
+            self._hot.move_to_end(key)
+            while len(self._hot) > self.hot_threads:
+                self._hot.popitem(last = False)
+
+    def _drop_hot(self, key):
+        with self._lock:
+            self._hot.pop(key, None)
+
+    # Serialization
+
+    def _sends(self, record: CheckpointRecord) -> list:
+        if not record.parent_checkpoint_id:
+            return []
+        return [
+            write.value
+            for write in self.backend.get_writes(record.thread_id, record.checkpoint_ns, record.parent_checkpoint_id)
+            if write.channel == TASKS
+        ]
+
+    def _into_tuple(
+        self,
+        record: CheckpointRecord,
+        writes: list[WriteRecord],
+        sends: list
+    ) -> CheckpointTuple:
+        return CheckpointTuple(
+            config = {
+                "configurable": {
+                    "thread_id": record.thread_id,
+                    "checkpoint_ns": record.checkpoint_ns,
+                    "checkpoint_id": record.checkpoint_id,
+                }
+            },
+            checkpoint = {
+                **self.serde.loads_typed(record.checkpoint),
+                "pending_sends": [self.serde.loads_typed(s) for s in sends],
+            },
+            metadata = self.serde.loads_typed(record.metadata),
+            pending_writes = [
+                (w.task_id, w.channel, self.serde.loads_typed(w.value)) for w in writes
+            ],
+            parent_config = {
+                "configurable": {
+                    "thread_id": record.thread_id,
+                    "checkpoint_ns": record.checkpoint_ns,
+                    "checkpoint_id": record.parent_checkpoint_id,
+                }
+            } if record.parent_checkpoint_id else None,
+        )
+
+    def _try_get_hot_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        configurable = config["configurable"]
+        key = (configurable["thread_id"], configurable.get("checkpoint_ns", ""))
+        hot = self._get_hot(key)
+        if hot is None or hot.sends is None:
+            return None
+        checkpoint_id = get_checkpoint_id(config)
+        if checkpoint_id and checkpoint_id != hot.record.checkpoint_id:
+            return None
+        with self._lock:
+            writes = list(hot.writes.values())
+        return self._into_tuple(hot.record, writes, hot.sends)
+
+    # BaseCheckpointSaver API
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        if (result := self._try_get_hot_tuple(config)) is not None:
+            return result
+        configurable = config["configurable"]
+        thread_id = configurable["thread_id"]
+        checkpoint_ns = configurable.get("checkpoint_ns", "")
+        checkpoint_id = get_checkpoint_id(config)
+        record = self.backend.get_checkpoint(thread_id, checkpoint_ns, checkpoint_id)
+        if record is None:
+            return None
+        writes = self.backend.get_writes(thread_id, checkpoint_ns, record.checkpoint_id)
+        sends = self._sends(record)
+        if checkpoint_id is None:
+            self._set_hot(
+                (thread_id, checkpoint_ns),
+                _HotThread(record, {(w.task_id, w.idx): w for w in writes}, sends)
+            )
+        return self._into_tuple(record, writes, sends)
+
+    def list(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[Dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> Iterator[CheckpointTuple]:
+        records = self.backend.list_checkpoints(
+            config["configurable"]["thread_id"] if config else None,
+            config["configurable"].get("checkpoint_ns") if config else None,
+            checkpoint_id = get_checkpoint_id(config) if config else None,
+            before_id = get_checkpoint_id(before) if before else None,
+            # Metadata is filtered after deserialization
+            limit = limit if not filter else None
+        )
+        for record in records:
+            if filter:
+                metadata = self.serde.loads_typed(record.metadata)
+                if not all(metadata.get(k) == v for k, v in filter.items()):
+                    continue
+                if limit is not None:
+                    if limit <= 0:
+                        break
+                    limit -= 1
+            writes = self.backend.get_writes(record.thread_id, record.checkpoint_ns, record.checkpoint_id)
+            yield self._into_tuple(record, writes, self._sends(record))
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        c = checkpoint.copy()
+        c.pop("pending_sends")  # type: ignore[misc]
+        configurable = config["configurable"]
+        thread_id = configurable["thread_id"]
+        checkpoint_ns = configurable.get("checkpoint_ns", "")
+        parent_checkpoint_id = configurable.get("checkpoint_id")
+        record = CheckpointRecord(
+            thread_id = thread_id,
+            checkpoint_ns = checkpoint_ns,
+            checkpoint_id = checkpoint["id"],
+            parent_checkpoint_id = parent_checkpoint_id,
+            checkpoint = self.serde.dumps_typed(c),
+            metadata = self.serde.dumps_typed(metadata)
+        )
+        self.backend.put_checkpoint(record)
+        if self.keep_checkpoints > 0:
+            self.backend.prune(thread_id, checkpoint_ns, self.keep_checkpoints)
+
+        key = (thread_id, checkpoint_ns)
+        previous = self._get_hot(key)
+        sends = None
+        if not parent_checkpoint_id:
+            sends = []
+        elif previous is not None and previous.record.checkpoint_id == parent_checkpoint_id:
+            sends = [w.value for w in previous.writes.values() if w.channel == TASKS]
+        self._set_hot(key, _HotThread(record, {}, sends))
+        return {
+            "configurable": {
+                "thread_id": thread_id,
+                "checkpoint_ns": checkpoint_ns,
+                "checkpoint_id": checkpoint["id"],
+            }
+        }
+
+    def put_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[Tuple[str, Any]],
+        task_id: str,
+    ) -> None:
+        configurable = config["configurable"]
+        thread_id = configurable["thread_id"]
+        checkpoint_ns = configurable.get("checkpoint_ns", "")
+        checkpoint_id = configurable["checkpoint_id"]
+        records = [
+            WriteRecord(task_id, WRITES_IDX_MAP.get(c, idx), c, self.serde.dumps_typed(v))
+            for idx, (c, v) in enumerate(writes)
+        ]
+        self.backend.put_writes(thread_id, checkpoint_ns, checkpoint_id, records)
+
+        key = (thread_id, checkpoint_ns)
+        hot = self._get_hot(key)
+        if hot is not None:
+            if hot.record.checkpoint_id == checkpoint_id:
+                with self._lock:
+                    for w in records:
+                        hot.writes[(w.task_id, w.idx)] = w
+            else:
+                # Writes to a non-latest checkpoint: let the next read reload it
+                self._drop_hot(key)
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._lock:
+            for key in [key for key in self._hot.keys() if key[0] == thread_id]:
+                del self._hot[key]
+        self.backend.delete_thread(thread_id)
+
+    def stats(self) -> CheckpointStats:
+        return self.backend.stats()
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        # Hot threads are served right on the event loop
+        if (result := self._try_get_hot_tuple(config)) is not None:
+            return result
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self.get_tuple, config
+        )
+
+    async def alist(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[Dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> AsyncIterator[CheckpointTuple]:
+        items = await asyncio.get_running_loop().run_in_executor(
+            None,
+            lambda: list(self.list(config, filter = filter, before = before, limit = limit))
+        )
+        for item in items:
+            yield item
+
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self.put, config, checkpoint, metadata, new_versions
+        )
+
+    async def aput_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[Tuple[str, Any]],
+        task_id: str,
+    ) -> None:
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self.put_writes, config, writes, task_id
+        )
+
+    def get_next_version(self, current: Optional[str], channel: ChannelProtocol) -> str:
+        # Same versioning scheme as langgraph's MemorySaver
+        if current is None:
+            current_v = 0
+        elif isinstance(current, int):
+            current_v = current
+        else:
+            current_v = int(current.split(".")[0])
+        next_v = current_v + 1
+        next_h = random.random()
+        return f"{next_v:032}.{next_h:016}"
@@ -0,0 +1,213 @@
+import os
+import sqlite3
+import threading
+from typing import Iterator, Optional
+
+from .backend import CheckpointBackend, CheckpointRecord, CheckpointStats, WriteRecord
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS checkpoints (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    checkpoint_id TEXT NOT NULL,
+    parent_checkpoint_id TEXT,
+    type TEXT,
+    checkpoint BLOB,
+    metadata_type TEXT,
+    metadata BLOB,
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id)
+);
+CREATE TABLE IF NOT EXISTS writes (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    checkpoint_id TEXT NOT NULL,
+    task_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    channel TEXT NOT NULL,
+    type TEXT,
+    value BLOB,
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+);
+"""
+
+_CHECKPOINT_COLUMNS = "thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, type, checkpoint, metadata_type, metadata"
+
+def _into_record(row) -> CheckpointRecord:
+    thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, type_, checkpoint, metadata_type, metadata = row
+    return CheckpointRecord(
+        thread_id = thread_id,
+        checkpoint_ns = checkpoint_ns,
+        checkpoint_id = checkpoint_id,
+        parent_checkpoint_id = parent_checkpoint_id,
+        checkpoint = (type_, checkpoint),
+        metadata = (metadata_type, metadata)
+    )
+
+
+class SqliteBackend(CheckpointBackend):
+    """Single node durable backend: an SQLite file in WAL mode.
+
+    One connection is shared between threads and guarded by a lock.
+    WAL keeps readers from blocking on the single writer.
+    """
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok = True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread = False, isolation_level = None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+    def get_checkpoint(self, thread_id, checkpoint_ns, checkpoint_id = None) -> Optional[CheckpointRecord]:
+        with self._lock:
+            if checkpoint_id is None:
+                row = self._conn.execute(
+                    f"SELECT {_CHECKPOINT_COLUMNS} FROM checkpoints"
+                    " WHERE thread_id = ? AND checkpoint_ns = ?"
+                    " ORDER BY checkpoint_id DESC LIMIT 1",
+                    (thread_id, checkpoint_ns)
+                ).fetchone()
+            else:
+                row = self._conn.execute(
+                    f"SELECT {_CHECKPOINT_COLUMNS} FROM checkpoints"
+                    " WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+                    (thread_id, checkpoint_ns, checkpoint_id)
+                ).fetchone()
+        return _into_record(row) if row else None
+
+    def list_checkpoints(
+        self,
+        thread_id,
+        checkpoint_ns,
+        *,
+        checkpoint_id = None,
+        before_id = None,
+        limit = None
+    ) -> Iterator[CheckpointRecord]:
+        conditions = []
+        args = []
+        if thread_id is not None:
+            conditions.append("thread_id = ?")
+            args.append(thread_id)
+        if checkpoint_ns is not None:
+            conditions.append("checkpoint_ns = ?")
+            args.append(checkpoint_ns)
+        if checkpoint_id is not None:
+            conditions.append("checkpoint_id = ?")
+            args.append(checkpoint_id)
+        if before_id is not None:
+            conditions.append("checkpoint_id < ?")
+            args.append(before_id)
+        query = f"SELECT {_CHECKPOINT_COLUMNS} FROM checkpoints"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY thread_id, checkpoint_ns, checkpoint_id DESC"
+        if limit is not None:
+            query += " LIMIT ?"
+            args.append(limit)
+        with self._lock:
+            rows = self._conn.execute(query, args).fetchall()
+        for row in rows:
+            yield _into_record(row)
+
+    def put_checkpoint(self, record: CheckpointRecord):
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO checkpoints ({_CHECKPOINT_COLUMNS})"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    record.thread_id,
+                    record.checkpoint_ns,
+                    record.checkpoint_id,
+                    record.parent_checkpoint_id,
+                    *record.checkpoint,
+                    *record.metadata
+                )
+            )
+
+    def get_writes(self, thread_id, checkpoint_ns, checkpoint_id) -> list[WriteRecord]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT task_id, idx, channel, type, value FROM writes"
+                " WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?"
+                " ORDER BY task_id, idx",
+                (thread_id, checkpoint_ns, checkpoint_id)
+            ).fetchall()
+        return [
+            WriteRecord(task_id, idx, channel, (type_, value))
+            for task_id, idx, channel, type_, value in rows
+        ]
+
+    def put_writes(self, thread_id, checkpoint_ns, checkpoint_id, writes: list[WriteRecord]):
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO writes"
+                    " (thread_id, checkpoint_ns, checkpoint_id, task_id, idx, channel, type, value)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    [
+                        (thread_id, checkpoint_ns, checkpoint_id, w.task_id, w.idx, w.channel, *w.value)
+                        for w in writes
+                    ]
+                )
+                self._conn.execute("COMMIT")
+            except:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def prune(self, thread_id, checkpoint_ns, keep: int):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT checkpoint_id FROM checkpoints"
+                " WHERE thread_id = ? AND checkpoint_ns = ?"
+                " ORDER BY checkpoint_id DESC LIMIT 1 OFFSET ?",
+                (thread_id, checkpoint_ns, keep - 1)
+            ).fetchone()
+            if row is None:
+                return
+            args = (thread_id, checkpoint_ns, row[0])
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.execute(
+                    "DELETE FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id < ?",
+                    args
+                )
+                self._conn.execute(
+                    "DELETE FROM writes WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id < ?",
+                    args
+                )
+                self._conn.execute("COMMIT")
+            except:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def delete_thread(self, thread_id):
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.execute("DELETE FROM checkpoints WHERE thread_id = ?", (thread_id,))
+                self._conn.execute("DELETE FROM writes WHERE thread_id = ?", (thread_id,))
+                self._conn.execute("COMMIT")
+            except:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def stats(self) -> CheckpointStats:
+        # Note: Full scan, it is meant to be polled by metrics only.
+        with self._lock:
+            threads, checkpoint_bytes = self._conn.execute(
+                "SELECT COUNT(DISTINCT thread_id),"
+                " COALESCE(SUM(LENGTH(checkpoint) + LENGTH(metadata)), 0) FROM checkpoints"
+            ).fetchone()
+            write_bytes, = self._conn.execute(
+                "SELECT COALESCE(SUM(LENGTH(value)), 0) FROM writes"
+            ).fetchone()
+        return CheckpointStats(threads = threads, bytes = checkpoint_bytes + write_bytes)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
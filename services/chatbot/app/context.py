@@ -0,0 +1,100 @@
+import json
+from typing import Sequence
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, ToolMessage
+
+# Rough chars per token ratio for English and code.
+# It is intentionally pessimistic for the budget to hold for other languages.
+CHARS_PER_TOKEN = 3
+# Role, separators and other per message overhead
+MESSAGE_OVERHEAD_TOKENS = 4
+# Content of tool results left out of a prompt to fit the budget
+TRIMMED_TOOL_RESULT = "[Result removed to fit the context, call the tool again if it is needed]"
+
+def _content_chars(content) -> int:
+    if isinstance(content, str):
+        return len(content)
+    if isinstance(content, list):
+        chars = 0
+        for block in content:
+            if isinstance(block, str):
+                chars += len(block)
+            elif isinstance(block, dict):
+                if block.get("type") == "text":
+                    chars += len(block.get("text", ""))
+                elif block.get("type") == "tool_use":
+                    # Same as tool_calls below, counted once
+                    continue
+                else:
+                    chars += len(json.dumps(block, ensure_ascii = False, default = str))
+        return chars
+    return 0
+
+def message_tokens(message: BaseMessage) -> int:
+    """Approximate number of tokens the message takes in a prompt."""
+    chars = _content_chars(message.content)
+    if isinstance(message, AIMessage):
+        for tool_call in message.tool_calls:
+            chars += len(tool_call["name"])
+            chars += len(json.dumps(tool_call["args"], ensure_ascii = False, default = str))
+    return MESSAGE_OVERHEAD_TOKENS + (chars + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+def count_tokens(messages: Sequence[BaseMessage]) -> int:
+    return sum(message_tokens(message) for message in messages)
+
+def split_window(
+    messages: Sequence[BaseMessage],
+    keep_tokens: int
+) -> tuple[list[BaseMessage], list[BaseMessage]]:
+    """Splits messages into an evicted prefix and a window of recent turns.
+
+    The window starts at a user message, so a tool call is never separated
+    from its result and the prompt starts with the user turn as the model expects.
+    The window takes as many turns as fit into keep_tokens,
+    but never less than the latest turn.
+
+    Returns:
+        A tuple of (evicted, window).
+    """
+    cut = None
+    tokens = 0
+    for i in range(len(messages) - 1, -1, -1):
+        tokens += message_tokens(messages[i])
+        if not isinstance(messages[i], HumanMessage):
+            continue
+        if cut is not None and tokens > keep_tokens:
+            break
+        cut = i
+    if cut is None:
+        # No turn boundary to cut at
+        return [], list(messages)
+    return list(messages[:cut]), list(messages[cut:])
+
+def fit_budget(messages: Sequence[BaseMessage], max_tokens: int) -> list[BaseMessage]:
+    """Messages of a prompt which takes at most max_tokens, if possible.
+
+    Results of older tool calls are trimmed first, oldest first. The results of
+    the latest tool calls are kept, the model is about to read them. If that isn't
+    enough, older turns are left out as by split_window.
+    The messages aren't changed, trimmed results are copies.
+    """
+    messages = list(messages)
+    tokens = count_tokens(messages)
+    if tokens <= max_tokens:
+        return messages
+    latest = len(messages)
+    while latest > 0 and isinstance(messages[latest - 1], ToolMessage):
+        latest -= 1
+    for i in range(latest):
+        if tokens <= max_tokens:
+            return messages
+        message = messages[i]
+        if not isinstance(message, ToolMessage) or message.content == TRIMMED_TOOL_RESULT:
+            continue
+        trimmed = message.model_copy(update = {"content": TRIMMED_TOOL_RESULT})
+        tokens -= message_tokens(message) - message_tokens(trimmed)
+        messages[i] = trimmed
+    if tokens <= max_tokens:
+        return messages
+    _, window = split_window(messages, max_tokens)
+    return window
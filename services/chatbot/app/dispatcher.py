@@ -0,0 +1,435 @@
+"""Multi-process serving: a dispatcher in front of worker processes.
+
+    python -m app.dispatcher [--workers 4] [--host 0.0.0.0] [--port 8081]
+
+Conversation state lives in the memory of the worker which serves the conversation,
+so the ConversationId claim of the context token is consistent-hashed to a fixed worker.
+SIGHUP restarts the workers one by one without losing conversations, see Dispatcher.restart.
+"""
+import argparse
+import asyncio
+import bisect
+import hashlib
+import itertools
+import logging
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import asynccontextmanager
+from typing import Callable, Optional
+
+import httpx
+import jwt
+from starlette.applications import Starlette
+from starlette.background import BackgroundTask
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+logger = logging.getLogger(__name__)
+
+# Worker processes, 0 is one per CPU core. 1 runs the server in a single process, without a dispatcher.
+WORKERS = int(os.getenv("BOT_WORKERS", default = 1))
+# Directory of the workers' unix sockets, a temporary one by default
+SOCKET_DIR = os.getenv("BOT_WORKER_SOCKET_DIR", default = "")
+# Seconds a worker may take to get ready
+WORKER_START_TIMEOUT = float(os.getenv("BOT_WORKER_START_TIMEOUT", default = 120))
+# Seconds to wait for the requests of a worker being restarted
+WORKER_DRAIN_TIMEOUT = float(os.getenv("BOT_WORKER_DRAIN_TIMEOUT", default = 60))
+# Seconds a stopping worker may take to hand its threads off
+WORKER_STOP_TIMEOUT = float(os.getenv("BOT_WORKER_STOP_TIMEOUT", default = 120))
+# Threads of a stopped worker are handed off to the next one through this file,
+# unless BOT_CHECKPOINTER_SPILL_PATH is set
+HANDOFF_PATH = os.getenv("BOT_WORKER_HANDOFF_PATH", default = "data/handoff.sqlite")
+# Virtual nodes per worker, they spread conversations evenly
+RING_REPLICAS = 64
+# Requests with this header go to the given worker, e.g. to scrape its /metrics
+WORKER_HEADER = "x-bot-worker"
+
+_HOP_BY_HOP = {
+    b"connection", b"keep-alive", b"proxy-authenticate", b"proxy-authorization",
+    b"te", b"trailers", b"transfer-encoding", b"upgrade", b"host",
+}
+_METHODS = ["GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"]
+
+
+def _hash(value: str) -> int:
+    # Note: hash() is salted per process, the ring must be the same after restarts
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size = 8).digest(), "big")
+
+
+class HashRing:
+    """Consistent hashing of keys to nodes.
+
+    Changing the number of nodes moves only the keys of the added or removed share.
+    """
+
+    def __init__(self, nodes: list[int], replicas: int = RING_REPLICAS):
+        points = sorted((_hash(f"{node}:{replica}"), node) for node in nodes for replica in range(replicas))
+        self._hashes = [h for h, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def node(self, key: str) -> int:
+        return self._nodes[bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)]
+
+
+def conversation_id(authorization: Optional[str]) -> Optional[str]:
+    """ConversationId claim of the context token, the worker takes the thread id from it too.
+
+    Note: The signature isn't verified here, the worker does it.
+    A forged claim only picks the worker, which rejects the token then.
+    """
+    if not authorization or not authorization.startswith("Bearer "):
+        return None
+    try:
+        claims = jwt.decode(authorization[len("Bearer "):], options = {"verify_signature": False})
+    except jwt.InvalidTokenError:
+        return None
+    value = claims.get("ConversationId", None)
+    return str(value) if value is not None else None
+
+
+class Worker:
+    """uvicorn process serving app.server on a unix socket."""
+
+    def __init__(self, index: int, generation: int, socket_dir: str, env: dict):
+        self.index = index
+        self.generation = generation
+        self.socket = os.path.join(socket_dir, f"worker-{index}-{generation}.sock")
+        self.env = env
+        self.process: Optional[subprocess.Popen] = None
+        self.inflight = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self.client = httpx.AsyncClient(
+            transport = httpx.AsyncHTTPTransport(uds = self.socket),
+            base_url = "http://worker",
+            timeout = None
+        )
+
+    @property
+    def pid(self) -> Optional[int]:
+        return self.process.pid if self.process is not None else None
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def start(self):
+        self.process = subprocess.Popen(
+            [
+                sys.executable, "-m", "uvicorn", "app.server:app",
+                "--uds", self.socket,
+                "--timeout-graceful-shutdown", str(int(WORKER_DRAIN_TIMEOUT)),
+            ],
+            env = {**self.env, "BOT_WORKER_INDEX": str(self.index)},
+            # Note: Signals of the terminal go to the dispatcher only, it stops the workers in order
+            start_new_session = True
+        )
+
+    async def wait_ready(self, timeout: float):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if not self.alive:
+                raise RuntimeError(f"Worker {self.index} exited with {self.process.returncode}")
+            try:
+                if (await self.client.get("/readyz")).status_code == 200:
+                    return
+            except httpx.TransportError:
+                # Not listening yet
+                pass
+            await asyncio.sleep(0.1)
+        raise TimeoutError(f"Worker {self.index} isn't ready after {timeout}s")
+
+    def enter(self):
+        self.inflight += 1
+        self._idle.clear()
+
+    def leave(self):
+        self.inflight -= 1
+        if self.inflight == 0:
+            self._idle.set()
+
+    async def drain(self, timeout: float):
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Worker %s still has %s requests after %ss", self.index, self.inflight, timeout)
+
+    async def stop(self, timeout: float):
+        """The worker finishes its requests, hands its threads off and exits."""
+        if self.alive:
+            self.process.terminate()
+            try:
+                await asyncio.to_thread(self.process.wait, timeout)
+            except subprocess.TimeoutExpired:
+                logger.error("Worker %s didn't stop in %ss, killing it", self.index, timeout)
+                self.process.kill()
+                await asyncio.to_thread(self.process.wait)
+        await self.client.aclose()
+        try:
+            os.unlink(self.socket)
+        except FileNotFoundError:
+            pass
+
+
+class _Slot:
+    def __init__(self, worker: Worker):
+        self.worker = worker
+        # Cleared while the worker isn't ready, requests of the slot wait
+        self.open = asyncio.Event()
+        self.restarts = 0
+
+
+class Dispatcher:
+    """Sends all requests of a conversation to the same worker and restarts workers gracefully.
+
+    Args:
+        workers: Number of worker processes.
+        worker_factory: Creates the worker of a slot by its index and generation.
+    """
+
+    def __init__(self, workers: int, *, worker_factory: Callable[[int, int], Worker]):
+        self.ring = HashRing(list(range(workers)))
+        self.worker_factory = worker_factory
+        self.slots = [_Slot(worker_factory(index, 0)) for index in range(workers)]
+        self._round_robin = itertools.count()
+        self._restarting = asyncio.Lock()
+        self._tasks: list[asyncio.Task] = []
+
+    def slot_for(self, headers) -> _Slot:
+        pinned = headers.get(WORKER_HEADER, None)
+        if pinned is not None and pinned.isdigit() and int(pinned) < len(self.slots):
+            return self.slots[int(pinned)]
+        key = conversation_id(headers.get("authorization", None))
+        if key is None:
+            # Note: Not a conversation request, e.g. docs. Any worker serves it.
+            return self.slots[next(self._round_robin) % len(self.slots)]
+        return self.slots[self.ring.node(key)]
+
+    async def start(self):
+        for slot in self.slots:
+            slot.worker.start()
+            self._tasks.append(asyncio.create_task(self._open_when_ready(slot, slot.worker)))
+        self._tasks.append(asyncio.create_task(self._watch()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*(slot.worker.stop(WORKER_STOP_TIMEOUT) for slot in self.slots))
+
+    async def _open_when_ready(self, slot: _Slot, worker: Worker):
+        try:
+            await worker.wait_ready(WORKER_START_TIMEOUT)
+        except RuntimeError:
+            # Replaced by _watch
+            logger.exception("Worker %s failed to start", worker.index)
+            return
+        except TimeoutError:
+            # Note: A worker which never gets ready would hold the requests of its slot forever
+            logger.error("Worker %s isn't ready after %ss, starting a new one", worker.index, WORKER_START_TIMEOUT)
+            if slot.worker is worker:
+                await self._replace(slot)
+            return
+        if slot.worker is worker:
+            slot.open.set()
+
+    async def _replace(self, slot: _Slot):
+        slot.open.clear()
+        old = slot.worker
+        slot.worker = self.worker_factory(old.index, old.generation + 1)
+        slot.restarts += 1
+        await old.stop(0)
+        slot.worker.start()
+        self._tasks.append(asyncio.create_task(self._open_when_ready(slot, slot.worker)))
+
+    async def _watch(self):
+        # Note: A crashed worker loses the threads it kept in memory, spilled ones are restored
+        while True:
+            await asyncio.sleep(1)
+            for slot in self.slots:
+                if slot.worker.alive or self._restarting.locked():
+                    continue
+                logger.error("Worker %s exited with %s, starting a new one", slot.worker.index, slot.worker.process.returncode)
+                await self._replace(slot)
+
+    async def restart(self, index: int):
+        """Replaces the worker of the slot without losing its conversations.
+
+        The new worker starts and gets ready first. Then requests of the slot are held
+        while the old worker finishes its requests and hands its threads off on shutdown.
+        The held requests go to the new worker, which restores the threads on first access.
+        """
+        slot = self.slots[index]
+        old = slot.worker
+        new = self.worker_factory(index, old.generation + 1)
+        new.start()
+        try:
+            await new.wait_ready(WORKER_START_TIMEOUT)
+        except Exception:
+            logger.exception("Replacement of worker %s failed to start, keeping the old one", index)
+            await new.stop(WORKER_STOP_TIMEOUT)
+            raise
+        slot.open.clear()
+        try:
+            await old.drain(WORKER_DRAIN_TIMEOUT)
+            await old.stop(WORKER_STOP_TIMEOUT)
+            slot.worker = new
+            slot.restarts += 1
+        finally:
+            slot.open.set()
+
+    async def restart_all(self):
+        async with self._restarting:
+            for index in range(len(self.slots)):
+                try:
+                    await self.restart(index)
+                except Exception:
+                    # The old worker keeps serving, the next restart retries
+                    continue
+            logger.info("Workers restarted")
+
+    async def proxy(self, request: Request) -> Response:
+        slot = self.slot_for(request.headers)
+        try:
+            await asyncio.wait_for(slot.open.wait(), WORKER_START_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning("Worker %s isn't ready after %ss", slot.worker.index, WORKER_START_TIMEOUT)
+            return JSONResponse({"detail": "Worker not ready"}, status_code = 503)
+        worker = slot.worker
+        worker.enter()
+        released = False
+        def release():
+            nonlocal released
+            if not released:
+                released = True
+                worker.leave()
+
+        try:
+            path = request.url.path + (f"?{request.url.query}" if request.url.query else "")
+            upstream = await worker.client.send(
+                worker.client.build_request(
+                    request.method,
+                    path,
+                    headers = [(k, v) for k, v in request.headers.raw if k.lower() not in _HOP_BY_HOP],
+                    content = await request.body()
+                ),
+                stream = True
+            )
+        except httpx.TransportError as e:
+            release()
+            logger.warning("Worker %s is unavailable: %s", worker.index, e)
+            return JSONResponse({"detail": "Worker unavailable"}, status_code = 502)
+        except BaseException:
+            release()
+            raise
+
+        async def body():
+            try:
+                async for chunk in upstream.aiter_raw():
+                    yield chunk
+            finally:
+                await upstream.aclose()
+                release()
+
+        async def finish():
+            await upstream.aclose()
+            release()
+
+        response = StreamingResponse(body(), status_code = upstream.status_code, background = BackgroundTask(finish))
+        response.raw_headers = [(k, v) for k, v in upstream.headers.raw if k.lower() not in _HOP_BY_HOP]
+        return response
+
+    async def readiness(self, request: Request) -> Response:
+        async def probe(slot: _Slot):
+            if not slot.open.is_set():
+                return False
+            try:
+                return (await slot.worker.client.get("/readyz", timeout = 2)).status_code == 200
+            except httpx.HTTPError:
+                return False
+
+        ready = await asyncio.gather(*(probe(slot) for slot in self.slots))
+        return JSONResponse(
+            {"ready": all(ready), "workers": {str(i): r for i, r in enumerate(ready)}},
+            status_code = 200 if all(ready) else 503
+        )
+
+    async def stats(self, request: Request) -> Response:
+        return JSONResponse([
+            {
+                "index": index,
+                "pid": slot.worker.pid,
+                "generation": slot.worker.generation,
+                "inflight": slot.worker.inflight,
+                "open": slot.open.is_set(),
+                "restarts": slot.restarts,
+            }
+            for index, slot in enumerate(self.slots)
+        ])
+
+
+async def _liveness(request: Request) -> Response:
+    return JSONResponse({"status": "ok"})
+
+
+def create_app(dispatcher: Dispatcher) -> Starlette:
+    @asynccontextmanager
+    async def lifespan(app):
+        await dispatcher.start()
+        loop = asyncio.get_running_loop()
+        # Note: SIGHUP restarts the workers gracefully, e.g. after a config change
+        loop.add_signal_handler(signal.SIGHUP, lambda: asyncio.ensure_future(dispatcher.restart_all()))
+        try:
+            yield
+        finally:
+            loop.remove_signal_handler(signal.SIGHUP)
+            await dispatcher.stop()
+
+    return Starlette(
+        routes = [
+            Route("/healthz", _liveness),
+            Route("/readyz", dispatcher.readiness),
+            Route("/stats/workers", dispatcher.stats),
+            Route("/{path:path}", dispatcher.proxy, methods = _METHODS),
+        ],
+        lifespan = lifespan
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.splitlines()[0])
+    parser.add_argument("--workers", type = int, default = WORKERS, help = "0 is one per CPU core")
+    parser.add_argument("--host", default = "0.0.0.0")
+    parser.add_argument("--port", type = int, default = 8081)
+    args = parser.parse_args()
+    workers = args.workers or os.cpu_count() or 1
+
+    uvicorn_args = [sys.executable, "-m", "uvicorn", "--host", args.host, "--port", str(args.port)]
+    if workers == 1:
+        # A single process needs no dispatcher
+        os.execv(sys.executable, uvicorn_args + ["app.server:app"])
+
+    env = dict(os.environ)
+    if env.get("BOT_CHECKPOINTER", "memory").lower() == "memory":
+        env.setdefault("BOT_CHECKPOINTER_SPILL_PATH", HANDOFF_PATH)
+    socket_dir = SOCKET_DIR or tempfile.mkdtemp(prefix = "chatbot-workers-")
+    dispatcher = Dispatcher(
+        workers,
+        worker_factory = lambda index, generation: Worker(index, generation, socket_dir, env)
+    )
+
+    import uvicorn
+    uvicorn.run(
+        create_app(dispatcher),
+        host = args.host,
+        port = args.port,
+        timeout_graceful_shutdown = int(WORKER_DRAIN_TIMEOUT)
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class Readiness:
+    """Checks of what the service needs before it takes traffic, served at /readyz.
+
+    Checks run in the order they were added. A check which failed is retried
+    by the next run, a passed one is not run again.
+    """
+
+    def __init__(self):
+        self._checks: dict[str, Callable[[], Awaitable[None]]] = {}
+        self._passed: dict[str, float] = {}
+        self._errors: dict[str, str] = {}
+        self._lock = asyncio.Lock()
+        self.started = time.monotonic()
+
+    def add(self, name: str, check: Callable[[], Awaitable[None]]):
+        self._checks[name] = check
+
+    @property
+    def ready(self) -> bool:
+        return len(self._passed) == len(self._checks)
+
+    @property
+    def running(self) -> bool:
+        return self._lock.locked()
+
+    async def run(self) -> bool:
+        # Note: Probes and the startup warm up may run concurrently
+        async with self._lock:
+            for name, check in self._checks.items():
+                if name in self._passed:
+                    continue
+                try:
+                    await check()
+                except Exception as e:
+                    self._errors[name] = f"{type(e).__name__}: {e}"
+                    logger.warning("Readiness check %s failed: %s", name, self._errors[name])
+                    # Note: Later checks may depend on this one
+                    return False
+                self._passed[name] = time.monotonic() - self.started
+                self._errors.pop(name, None)
+        return True
+
+    def report(self) -> dict:
+        checks = {}
+        for name in self._checks:
+            if name in self._passed:
+                checks[name] = {"status": "ok", "seconds_since_start": round(self._passed[name], 3)}
+            elif name in self._errors:
+                checks[name] = {"status": "failed", "error": self._errors[name]}
+            else:
+                checks[name] = {"status": "pending"}
+        return {"ready": self.ready, "checks": checks}
@@ -0,0 +1,450 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+from enum import IntEnum
+from typing import Any, AsyncIterator, Callable, Iterator, Mapping, Optional
+
+from langchain_core.caches import BaseCache
+from langchain_core.language_models import BaseChatModel
+from langchain_core.load import dumps
+from langchain_core.messages import BaseMessage
+from langchain_core.runnables import Runnable, RunnableBinding
+from langchain_core.runnables.config import RunnableConfig
+
+from . import metrics
+from .cache.llm import ModelCache
+from .context import count_tokens
+
+# Provider limits shared by all model calls of the process, 0 is unlimited
+REQUESTS_PER_MINUTE = float(os.getenv("BOT_LLM_REQUESTS_PER_MINUTE", default = 0))
+TOKENS_PER_MINUTE = float(os.getenv("BOT_LLM_TOKENS_PER_MINUTE", default = 0))
+# Calls waiting for a slot, new ones are rejected when it is full
+QUEUE_SIZE = int(os.getenv("BOT_LLM_QUEUE_SIZE", default = 100))
+# Max seconds a call waits for a slot, by priority
+MAX_WAIT = float(os.getenv("BOT_LLM_MAX_WAIT", default = 30))
+SUMMARY_MAX_WAIT = float(os.getenv("BOT_LLM_SUMMARY_MAX_WAIT", default = 300))
+# Retries of rate limited calls, honoring retry-after
+MAX_RETRIES = int(os.getenv("BOT_LLM_MAX_RETRIES", default = 3))
+# Tokens reserved for the response until the actual usage is known
+OUTPUT_TOKENS_ESTIMATE = 256
+BACKOFF = 1.0
+JITTER = 0.25
+
+
+# Called when a model call of the current context gets its slot, e.g. to start a hedge timer
+on_admitted: contextvars.ContextVar[Optional[Callable[[], None]]] = contextvars.ContextVar("on_admitted", default = None)
+
+
+def _admitted():
+    callback = on_admitted.get()
+    if callback is not None:
+        callback()
+
+
+class Priority(IntEnum):
+    """Lower goes first."""
+    Agent = 0
+    Resolver = 1
+    Summarizer = 2
+
+
+class SchedulerRejected(Exception):
+    """A model call can't get a slot: the queue is full or it would wait too long."""
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, amount: float, now: float) -> float:
+        """Seconds until the amount is available."""
+        self._refill(now)
+        # A call larger than the whole bucket waits for a full bucket only
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount: float, now: float):
+        # Note: The level may go below zero when the actual usage exceeds the estimate,
+        # the next calls wait for the debt to be paid off.
+        self._refill(now)
+        self.level -= amount
+
+
+class _Waiter:
+    __slots__ = ("priority", "tokens", "removed", "_event", "_loop")
+
+    def __init__(self, priority: Priority, tokens: float, loop: Optional[asyncio.AbstractEventLoop]):
+        self.priority = priority
+        self.tokens = tokens
+        self.removed = False
+        self._loop = loop
+        self._event = asyncio.Event() if loop is not None else threading.Event()
+
+    def wake(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._event.set)
+        else:
+            self._event.set()
+
+    def clear(self):
+        self._event.clear()
+
+    def wait(self, timeout: float):
+        self._event.wait(timeout)
+
+    async def await_(self, timeout: float):
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+
+class Ticket:
+    """Slot of a model call. Settle it with the actual token usage."""
+
+    def __init__(self, scheduler: "LlmScheduler", tokens: float):
+        self.scheduler = scheduler
+        self.tokens = tokens
+
+    def settle(self, tokens: float):
+        self.scheduler._adjust(tokens - self.tokens)
+
+
+class LlmScheduler:
+    """Process wide admission of model calls under the provider rate limits.
+
+    Calls wait in a priority queue for both the requests and the tokens per minute budgets.
+    Only the head of the queue waits for the budget, so a low priority call can't take it
+    from an interactive one. Tokens are reserved by an estimate and settled by the usage.
+    A rate limited response which is retried pauses all calls for its retry-after with jitter.
+
+    Args:
+        requests_per_minute: 0 is unlimited.
+        tokens_per_minute: 0 is unlimited.
+        queue_size: Max waiting calls.
+        max_wait: Max seconds a call waits, by priority. Calls which can't get
+            a slot in time are rejected as soon as that is known.
+        max_retries: Retries of rate limited calls.
+    """
+
+    def __init__(
+        self,
+        *,
+        requests_per_minute: float = 0,
+        tokens_per_minute: float = 0,
+        queue_size: int = 100,
+        max_wait: Optional[Mapping[Priority, float]] = None,
+        max_retries: int = 3
+    ):
+        self._requests = TokenBucket(requests_per_minute) if requests_per_minute > 0 else None
+        self._tokens = TokenBucket(tokens_per_minute) if tokens_per_minute > 0 else None
+        self.queue_size = queue_size
+        self.max_wait = dict(max_wait or {})
+        self.max_retries = max_retries
+        self._lock = threading.Lock()
+        # (priority, arrival, waiter), removed waiters are dropped lazily
+        self._queue: list[tuple[int, int, _Waiter]] = []
+        self._arrivals = itertools.count()
+        self._waiting = 0
+        self._paused_until = 0.0
+
+    @classmethod
+    def from_env(cls) -> "LlmScheduler":
+        return cls(
+            requests_per_minute = REQUESTS_PER_MINUTE,
+            tokens_per_minute = TOKENS_PER_MINUTE,
+            queue_size = QUEUE_SIZE,
+            max_wait = {
+                Priority.Agent: MAX_WAIT,
+                Priority.Resolver: MAX_WAIT,
+                Priority.Summarizer: SUMMARY_MAX_WAIT,
+            },
+            max_retries = MAX_RETRIES
+        )
+
+    def _head(self) -> Optional[_Waiter]:
+        while self._queue and self._queue[0][2].removed:
+            heapq.heappop(self._queue)
+        return self._queue[0][2] if self._queue else None
+
+    def _enqueue(self, priority: Priority, tokens: float, loop) -> _Waiter:
+        with self._lock:
+            if self._waiting >= self.queue_size:
+                metrics.LLM_REJECTED.inc(priority.name.lower(), "queue_full")
+                raise SchedulerRejected("Model call queue is full")
+            waiter = _Waiter(priority, tokens, loop)
+            heapq.heappush(self._queue, (priority, next(self._arrivals), waiter))
+            self._waiting += 1
+            metrics.LLM_QUEUE_DEPTH.set(self._waiting)
+            return waiter
+
+    def _remove(self, waiter: _Waiter):
+        # Note: Called under the lock
+        if waiter.removed:
+            return
+        was_head = self._head() is waiter
+        waiter.removed = True
+        self._waiting -= 1
+        metrics.LLM_QUEUE_DEPTH.set(self._waiting)
+        if was_head:
+            head = self._head()
+            if head is not None:
+                head.wake()
+
+    def _delay(self, tokens: float, now: float) -> float:
+        delay = max(0.0, self._paused_until - now)
+        if self._requests is not None:
+            delay = max(delay, self._requests.delay(1, now))
+        if self._tokens is not None:
+            delay = max(delay, self._tokens.delay(tokens, now))
+        return delay
+
+    def _step(self, waiter: _Waiter, deadline: float) -> Optional[float]:
+        """Grants the slot if possible. Returns None if granted, otherwise seconds to wait."""
+        now = time.monotonic()
+        with self._lock:
+            is_head = self._head() is waiter
+            delay = self._delay(waiter.tokens, now) if is_head else None
+            if delay == 0:
+                if self._requests is not None:
+                    self._requests.take(1, now)
+                if self._tokens is not None:
+                    self._tokens.take(waiter.tokens, now)
+                self._remove(waiter)
+                return None
+            remaining = deadline - now
+            if remaining <= 0 or (delay is not None and delay > remaining):
+                self._remove(waiter)
+                metrics.LLM_REJECTED.inc(waiter.priority.name.lower(), "deadline")
+                raise SchedulerRejected(f"Model call would wait more than {self.max_wait.get(waiter.priority)}s")
+            # Note: Other waiters sleep until they become the head
+            return remaining if delay is None else delay
+
+    def _deadline(self, priority: Priority, started: float) -> float:
+        max_wait = self.max_wait.get(priority, 0)
+        return started + max_wait if max_wait > 0 else float("inf")
+
+    def acquire(self, priority: Priority, tokens: float) -> Ticket:
+        started = time.monotonic()
+        deadline = self._deadline(priority, started)
+        waiter = self._enqueue(priority, tokens, None)
+        try:
+            while True:
+                waiter.clear()
+                timeout = self._step(waiter, deadline)
+                if timeout is None:
+                    break
+                waiter.wait(timeout)
+        except BaseException:
+            with self._lock:
+                self._remove(waiter)
+            raise
+        metrics.LLM_QUEUE_WAIT_SECONDS.observe(time.monotonic() - started, priority.name.lower())
+        return Ticket(self, tokens)
+
+    async def aacquire(self, priority: Priority, tokens: float) -> Ticket:
+        started = time.monotonic()
+        deadline = self._deadline(priority, started)
+        waiter = self._enqueue(priority, tokens, asyncio.get_running_loop())
+        try:
+            while True:
+                waiter.clear()
+                timeout = self._step(waiter, deadline)
+                if timeout is None:
+                    break
+                await waiter.await_(timeout)
+        except BaseException:
+            with self._lock:
+                self._remove(waiter)
+            raise
+        metrics.LLM_QUEUE_WAIT_SECONDS.observe(time.monotonic() - started, priority.name.lower())
+        return Ticket(self, tokens)
+
+    def _adjust(self, tokens: float):
+        if self._tokens is None or tokens == 0:
+            return
+        with self._lock:
+            self._tokens.take(tokens, time.monotonic())
+
+    def should_retry(self, error: Exception, attempt: int) -> bool:
+        """Pauses all calls if the error is a rate limit response which is retried. Returns True to retry the call."""
+        if getattr(error, "status_code", None) not in (429, 529):
+            return False
+        metrics.LLM_RATE_LIMITED.inc()
+        if attempt >= self.max_retries:
+            # Note: The call gives up, pausing would only stall the calls of other conversations
+            return False
+        delay = _retry_after(error)
+        if delay is None:
+            delay = BACKOFF * 2 ** attempt
+        delay *= 1 + random.uniform(0, JITTER)
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+        return True
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    response = getattr(error, "response", None)
+    value = response.headers.get("retry-after", None) if response is not None else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def _unwrap(runnable: Runnable, kwargs: dict) -> tuple[Optional[BaseChatModel], dict]:
+    """Chat model under the bindings and the call kwargs it gets from them."""
+    bound = {}
+    while isinstance(runnable, RunnableBinding):
+        # Note: Outer bindings and the call override inner bindings
+        bound = {**runnable.kwargs, **bound}
+        runnable = runnable.bound
+    if not isinstance(runnable, BaseChatModel):
+        return None, {}
+    return runnable, {**bound, **kwargs}
+
+
+def _estimate(input: Any) -> float:
+    if isinstance(input, list) and all(isinstance(m, BaseMessage) for m in input):
+        return count_tokens(input) + OUTPUT_TOKENS_ESTIMATE
+    return len(str(input)) // 3 + OUTPUT_TOKENS_ESTIMATE
+
+
+def _usage(message: Any) -> Optional[float]:
+    usage = getattr(message, "usage_metadata", None)
+    if usage:
+        return usage.get("input_tokens", 0) + usage.get("output_tokens", 0)
+    usage = getattr(message, "response_metadata", {}).get("usage", None)
+    if usage:
+        return (usage.get("input_tokens", 0) or 0) + (usage.get("output_tokens", 0) or 0)
+    return None
+
+
+class ScheduledModel(Runnable):
+    """Model (or a binding of it) called through the scheduler with a priority.
+
+    Note: The provider client's own retries should be off, rate limited calls are retried here.
+    Calls answered by the model cache skip the scheduler.
+    """
+
+    def __init__(self, bound: Runnable, scheduler: LlmScheduler, priority: Priority):
+        self.bound = bound
+        self.scheduler = scheduler
+        self.priority = priority
+
+    def _settle(self, ticket: Ticket, message: Any):
+        usage = _usage(message)
+        ticket.settle(usage if usage is not None else ticket.tokens)
+
+    def _cache_lookup(self, input: Any, kwargs: dict) -> Optional[tuple[BaseCache, str, str]]:
+        # Same cache, prompt and llm string as BaseChatModel._generate_with_cache
+        model, kwargs = _unwrap(self.bound, kwargs)
+        if model is None or not isinstance(model.cache, BaseCache):
+            return None
+        stop = kwargs.pop("stop", None)
+        prompt = dumps(model._convert_input(input).to_messages())
+        return model.cache, prompt, model._get_llm_string(stop = stop, **kwargs)
+
+    def _is_cached(self, input: Any, kwargs: dict) -> bool:
+        lookup = self._cache_lookup(input, kwargs)
+        if lookup is None:
+            return False
+        cache, prompt, llm_string = lookup
+        if isinstance(cache, ModelCache):
+            return cache.contains(prompt, llm_string)
+        return cache.lookup(prompt, llm_string) is not None
+
+    async def _ais_cached(self, input: Any, kwargs: dict) -> bool:
+        lookup = self._cache_lookup(input, kwargs)
+        if lookup is None:
+            return False
+        cache, prompt, llm_string = lookup
+        if isinstance(cache, ModelCache):
+            return await cache.acontains(prompt, llm_string)
+        return await cache.alookup(prompt, llm_string) is not None
+
+    def invoke(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Any:
+        if self._is_cached(input, kwargs):
+            _admitted()
+            return self.bound.invoke(input, config, **kwargs)
+        for attempt in itertools.count():
+            ticket = self.scheduler.acquire(self.priority, _estimate(input))
+            _admitted()
+            try:
+                response = self.bound.invoke(input, config, **kwargs)
+            except Exception as e:
+                ticket.settle(0)
+                if not self.scheduler.should_retry(e, attempt):
+                    raise
+                continue
+            self._settle(ticket, response)
+            return response
+
+    async def ainvoke(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Any:
+        if await self._ais_cached(input, kwargs):
+            _admitted()
+            return await self.bound.ainvoke(input, config, **kwargs)
+        for attempt in itertools.count():
+            ticket = await self.scheduler.aacquire(self.priority, _estimate(input))
+            _admitted()
+            try:
+                response = await self.bound.ainvoke(input, config, **kwargs)
+            except Exception as e:
+                ticket.settle(0)
+                if not self.scheduler.should_retry(e, attempt):
+                    raise
+                continue
+            self._settle(ticket, response)
+            return response
+
+    # Note: Streamed calls don't use the model cache
+    def stream(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Iterator[Any]:
+        for attempt in itertools.count():
+            ticket = self.scheduler.acquire(self.priority, _estimate(input))
+            _admitted()
+            aggregate = None
+            try:
+                for chunk in self.bound.stream(input, config, **kwargs):
+                    aggregate = chunk if aggregate is None else aggregate + chunk
+                    yield chunk
+            except Exception as e:
+                ticket.settle(0)
+                # Only a call which hasn't streamed anything yet can be retried
+                if aggregate is not None or not self.scheduler.should_retry(e, attempt):
+                    raise
+                continue
+            self._settle(ticket, aggregate)
+            return
+
+    async def astream(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> AsyncIterator[Any]:
+        for attempt in itertools.count():
+            ticket = await self.scheduler.aacquire(self.priority, _estimate(input))
+            _admitted()
+            aggregate = None
+            try:
+                async for chunk in self.bound.astream(input, config, **kwargs):
+                    aggregate = chunk if aggregate is None else aggregate + chunk
+                    yield chunk
+            except Exception as e:
+                ticket.settle(0)
+                # Only a call which hasn't streamed anything yet can be retried
+                if aggregate is not None or not self.scheduler.should_retry(e, attempt):
+                    raise
+                continue
+            self._settle(ticket, aggregate)
+            return
+
+
+scheduler = LlmScheduler.from_env()
@@ -0,0 +1,87 @@
+import asyncio
+import threading
+import weakref
+from typing import Any, Awaitable, Callable, Hashable
+
+
+class Mailboxes:
+    """Per key mailboxes, each drained by its own task, one batch at a time.
+
+    Items submitted while a batch of the same key is processed are not processed
+    concurrently. They wait and are all processed as the next batch.
+    Every submitter gets the result of the batch its item was processed in.
+
+    Args:
+        process: Processes a batch of items of a key, oldest first.
+    """
+
+    def __init__(self, process: Callable[[Hashable, list[Any]], Awaitable[Any]]):
+        self.process = process
+        self._pending: dict[Hashable, list[tuple[Any, asyncio.Future]]] = {}
+        self._actors: dict[Hashable, asyncio.Task] = {}
+
+    async def submit(self, key: Hashable, item: Any) -> Any:
+        # Note: Runs on the event loop only, so no locking is needed
+        future = asyncio.get_running_loop().create_future()
+        self._pending.setdefault(key, []).append((item, future))
+        if key not in self._actors:
+            self._actors[key] = asyncio.create_task(self._run(key))
+        # Note: A cancelled submitter stops waiting, but its item is still processed,
+        # otherwise the message would be lost.
+        return await asyncio.shield(future)
+
+    def busy(self, key: Hashable) -> bool:
+        return key in self._actors
+
+    async def _run(self, key: Hashable):
+        try:
+            while True:
+                batch = self._pending.pop(key, None)
+                if not batch:
+                    return
+                try:
+                    result = await self.process(key, [item for item, _ in batch])
+                except Exception as e:
+                    for _, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+                            # Marks the exception as retrieved if nobody waits for it
+                            future.exception()
+                    continue
+                except BaseException:
+                    for _, future in batch + self._pending.pop(key, []):
+                        future.cancel()
+                    raise
+                for _, future in batch:
+                    if not future.done():
+                        future.set_result(result)
+        finally:
+            del self._actors[key]
+
+
+class _KeyLock:
+    # Note: threading.Lock can't be weakly referenced
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self._lock.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self._lock.release()
+
+
+class KeyedLocks:
+    """Lock per key, unused locks are collected."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._locks: weakref.WeakValueDictionary[Hashable, _KeyLock] = weakref.WeakValueDictionary()
+
+    def get(self, key: Hashable) -> _KeyLock:
+        with self._lock:
+            lock = self._locks.get(key)
+            if lock is None:
+                lock = self._locks[key] = _KeyLock()
+            return lock
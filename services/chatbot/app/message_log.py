@@ -0,0 +1,178 @@
+import uuid
+from bisect import bisect_left, bisect_right
+from typing import Any, Iterable, Iterator, Optional
+
+from langchain_core.messages import (
+    AnyMessage,
+    BaseMessage,
+    BaseMessageChunk,
+    RemoveMessage,
+    ToolMessage,
+    convert_to_messages,
+    message_chunk_to_message
+)
+from pydantic import GetCoreSchemaHandler
+from pydantic_core import core_schema
+
+# Note: The sequence number is kept in response_metadata, so it is persisted
+# with the message. Models don't see it and the model cache ignores it.
+SEQ = "seq"
+
+
+class MessageLog(list):
+    """Append optimized list of messages with indexes.
+
+    Every message gets a monotonic sequence number when it is added,
+    so a cursor stays valid even if the message it points to was removed.
+    Numbers are persisted with the messages. A restored log continues
+    the numbering after its latest message.
+
+    Indexes:
+    * id -> message, O(1)
+    * tool name -> tool messages in order
+
+    Note: It is a list for LangGraph and LangChain code to work with it as is.
+    Change it with `apply` (see reduce_list in state.py), `append` or `extend`,
+    other list methods don't update the indexes.
+    LangGraph shares channel values between checkpoints and state copies,
+    so the reducer works on a `copy` which is cheap: no messages are touched.
+    """
+
+    def __init__(self, messages: Iterable[BaseMessage] = ()):
+        super().__init__()
+        self._seqs: list[int] = []
+        self._by_id: dict[str, BaseMessage] = {}
+        self._tools: dict[str, list[int]] = {}
+        messages = list(messages)
+        # Restored messages keep their numbers
+        self.next_seq = 1 + max((self._stored_seq(m) or 0 for m in messages), default = 0)
+        for message in messages:
+            self._append(message, self._stored_seq(message))
+
+    def copy(self) -> "MessageLog":
+        log = MessageLog.__new__(MessageLog)
+        list.__init__(log, self)
+        log._seqs = self._seqs.copy()
+        log._by_id = self._by_id.copy()
+        log._tools = {name: seqs.copy() for name, seqs in self._tools.items()}
+        log.next_seq = self.next_seq
+        return log
+
+    @classmethod
+    def __get_pydantic_core_schema__(cls, source: Any, handler: GetCoreSchemaHandler) -> core_schema.CoreSchema:
+        # A log passes through State validation as is, so nodes share its indexes.
+        # Plain lists, e.g. restored from a checkpoint, are validated and indexed.
+        return core_schema.union_schema([
+            core_schema.is_instance_schema(cls),
+            core_schema.no_info_after_validator_function(
+                cls,
+                handler.generate_schema(list[AnyMessage])
+            ),
+        ])
+
+    @staticmethod
+    def _stored_seq(message: BaseMessage) -> Optional[int]:
+        seq = message.response_metadata.get(SEQ, None)
+        return seq if isinstance(seq, int) else None
+
+    @classmethod
+    def _stamped(cls, message: BaseMessage, seq: int) -> BaseMessage:
+        # Note: Messages are shared with callers, model outputs and other checkpoints,
+        # so a copy is stamped. Messages which already have their number, e.g. restored
+        # ones, are kept as is.
+        if message.id is not None and cls._stored_seq(message) == seq:
+            return message
+        return message.model_copy(update = {
+            "id": message.id if message.id is not None else str(uuid.uuid4()),
+            "response_metadata": {**message.response_metadata, SEQ: seq}
+        })
+
+    def _append(self, message: BaseMessage, seq: Optional[int] = None):
+        if seq is None or (self._seqs and seq <= self._seqs[-1]):
+            seq = self.next_seq
+        self.next_seq = max(self.next_seq, seq + 1)
+        message = self._stamped(message, seq)
+        super().append(message)
+        self._seqs.append(seq)
+        self._by_id[message.id] = message
+        if isinstance(message, ToolMessage) and message.name:
+            self._tools.setdefault(message.name, []).append(seq)
+
+    def _position(self, seq: int) -> int:
+        position = bisect_left(self._seqs, seq)
+        assert position < len(self._seqs) and self._seqs[position] == seq
+        return position
+
+    def apply(self, messages: Iterable[BaseMessage]) -> "MessageLog":
+        """Same as LangGraph add_messages, but changes the log in place:
+        new ids are appended, existing ones are replaced, RemoveMessage removes by id.
+        """
+        for message in convert_to_messages(messages):
+            message = message_chunk_to_message(message) if isinstance(message, BaseMessageChunk) else message
+            existing = self._by_id.get(message.id, None) if message.id is not None else None
+            if isinstance(message, RemoveMessage):
+                if existing is None:
+                    raise ValueError(f"Attempting to delete a message with an ID that doesn't exist ('{message.id}')")
+                self._remove(existing)
+            elif existing is not None:
+                self._replace(existing, message)
+            else:
+                self._append(message)
+        return self
+
+    def append(self, message: BaseMessage):
+        self.apply([message])
+
+    def extend(self, messages: Iterable[BaseMessage]):
+        self.apply(messages)
+
+    def __iadd__(self, messages: Iterable[BaseMessage]) -> "MessageLog":
+        return self.apply(messages)
+
+    def _remove(self, message: BaseMessage):
+        position = self._position(message.response_metadata[SEQ])
+        del self[position]
+        del self._seqs[position]
+        del self._by_id[message.id]
+        # Note: The tool index is cleaned up lazily, see tool_messages
+
+    def _replace(self, existing: BaseMessage, message: BaseMessage):
+        seq = existing.response_metadata[SEQ]
+        message = self._stamped(message, seq)
+        self[self._position(seq)] = message
+        self._by_id[message.id] = message
+        if isinstance(message, ToolMessage) and message.name:
+            seqs = self._tools.setdefault(message.name, [])
+            i = bisect_left(seqs, seq)
+            if i == len(seqs) or seqs[i] != seq:
+                seqs.insert(i, seq)
+
+    def get_by_id(self, id: str) -> Optional[BaseMessage]:
+        return self._by_id.get(id, None)
+
+    def seq_of(self, message: BaseMessage) -> int:
+        return message.response_metadata[SEQ]
+
+    @property
+    def last_seq(self) -> int:
+        """Sequence number of the latest message, 0 for an empty log."""
+        return self._seqs[-1] if self._seqs else 0
+
+    def since(self, seq: Optional[int]) -> list[BaseMessage]:
+        """Messages added after the message with the given sequence number, in order."""
+        if seq is None:
+            return list(self)
+        return self[bisect_right(self._seqs, seq):]
+
+    def tool_messages(self, name: str) -> Iterator[ToolMessage]:
+        """Tool messages of the tool, latest first."""
+        seqs = self._tools.get(name, [])
+        for i in range(len(seqs) - 1, -1, -1):
+            position = bisect_left(self._seqs, seqs[i])
+            if position < len(self._seqs) and self._seqs[position] == seqs[i]:
+                message = self[position]
+                if isinstance(message, ToolMessage) and message.name == name:
+                    yield message
+                    continue
+            # Removed or replaced
+            del seqs[i]
@@ -0,0 +1,371 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Any, Optional, Sequence
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+
+# Note: A minimal Prometheus text format implementation, so that an observation is
+# a dict lookup and a few additions under a lock, see benchmarks/metrics.py.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+STEP_BUCKETS = (1, 2, 4, 6, 8, 12, 16, 20, 25)
+
+_registry: list["_Metric"] = []
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0)
+
+    def render(self) -> list[str]:
+        lines = super().render()
+        with self._lock:
+            values = list(self._values.items())
+        for labels, value in values:
+            lines.append(f"{self.name}{_labels(self.label_names, labels)} {_number(value)}")
+        return lines
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self._values: dict[tuple, float] = {}
+
+    def set(self, value: float, *labels: str):
+        with self._lock:
+            self._values[labels] = value
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0)
+
+    def render(self) -> list[str]:
+        lines = super().render()
+        with self._lock:
+            values = list(self._values.items())
+        for labels, value in values:
+            lines.append(f"{self.name}{_labels(self.label_names, labels)} {_number(value)}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), *, buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [count per bucket..., count above the last bucket, sum]
+        self._values: dict[tuple, list[float]] = {}
+
+    def observe(self, value: float, *labels: str):
+        # Note: Per bucket counts, they are accumulated on render
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                counts = self._values[labels] = [0] * (len(self.buckets) + 2)
+            counts[i] += 1
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, *labels: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def count(self, *labels: str) -> int:
+        with self._lock:
+            counts = self._values.get(labels)
+            return int(sum(counts[:-1])) if counts is not None else 0
+
+    def render(self) -> list[str]:
+        lines = super().render()
+        with self._lock:
+            values = [(labels, counts.copy()) for labels, counts in self._values.items()]
+        for labels, counts in values:
+            total = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                total += count
+                le = "+Inf" if bound == float("inf") else _number(bound)
+                bucket = _labels(self.label_names, labels, f'le="{le}"')
+                lines.append(f"{self.name}_bucket{bucket} {_number(total)}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, labels)} {_number(counts[-1])}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, labels)} {_number(total)}")
+        return lines
+
+
+def render() -> str:
+    """All metrics in the Prometheus text format."""
+    lines = []
+    for metric in _registry:
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
+
+
+NODE_SECONDS = Histogram(
+    "chatbot_graph_node_duration_seconds",
+    "Duration of graph node runs.",
+    ["node"]
+)
+TOOL_SECONDS = Histogram(
+    "chatbot_tool_duration_seconds",
+    "Duration of tool calls.",
+    ["tool", "status"]
+)
+GRAPH_STEPS = Histogram(
+    "chatbot_graph_steps",
+    "Graph steps per run, compare with the recursion limit.",
+    buckets = STEP_BUCKETS
+)
+LLM_TOKENS = Counter(
+    "chatbot_llm_tokens_total",
+    "Model tokens by caller and kind: input, output, cache_read or cache_creation.",
+    ["caller", "kind"]
+)
+COALESCED_MESSAGES = Counter(
+    "chatbot_coalesced_messages_total",
+    "User messages answered by the turn of an earlier message of the conversation."
+)
+LLM_QUEUE_DEPTH = Gauge(
+    "chatbot_llm_queue_depth",
+    "Model calls waiting for the rate limit scheduler."
+)
+LLM_QUEUE_WAIT_SECONDS = Histogram(
+    "chatbot_llm_queue_wait_seconds",
+    "Time model calls waited for the rate limit scheduler, by priority.",
+    ["priority"]
+)
+LLM_REJECTED = Counter(
+    "chatbot_llm_rejected_total",
+    "Model calls rejected by the scheduler, by priority and reason: queue_full or deadline.",
+    ["priority", "reason"]
+)
+LLM_RATE_LIMITED = Counter(
+    "chatbot_llm_rate_limited_total",
+    "Rate limited model responses."
+)
+LLM_HEDGED = Counter(
+    "chatbot_llm_hedged_total",
+    "Slow model calls repeated on the alternate model, by caller and winner: primary or alternate.",
+    ["caller", "winner"]
+)
+LLM_FAILOVERS = Counter(
+    "chatbot_llm_failovers_total",
+    "Failed model calls retried on the alternate model, by caller.",
+    ["caller"]
+)
+BACKEND_SECONDS = Histogram(
+    "chatbot_backend_request_duration_seconds",
+    "Duration of bot tools backend requests.",
+    ["endpoint", "status"]
+)
+SEARCH_TYPE_RESOLUTIONS = Counter(
+    "chatbot_search_type_resolutions_total",
+    "Resolved search types by path: fast_path or model.",
+    ["path"]
+)
+SEARCH_CACHE_REQUESTS = Counter(
+    "chatbot_search_cache_requests_total",
+    "Searches by search results cache result: hit, miss or joined (waited for an identical search).",
+    ["result"]
+)
+LLM_CACHE_LOOKUPS = Counter(
+    "chatbot_llm_cache_lookups_total",
+    "Model cache lookups by result: memory_hit, disk_hit or miss.",
+    ["result"]
+)
+AUTH_TOKENS = Counter(
+    "chatbot_auth_tokens_total",
+    "Context tokens by result: cache_hit, verified or failed.",
+    ["result"]
+)
+AUTH_VERIFICATION_SECONDS = Histogram(
+    "chatbot_auth_verification_duration_seconds",
+    "Duration of context token signature verifications.",
+    buckets = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025)
+)
+AUTH_KEY_RELOADS = Counter(
+    "chatbot_auth_key_reloads_total",
+    "Reloads of the token verification keys file."
+)
+TRACES = Counter(
+    "chatbot_traces_total",
+    "Traces by result: started, sampled or sampled_on_error.",
+    ["result"]
+)
+TRACE_SPANS = Counter(
+    "chatbot_trace_spans_total",
+    "Spans of sampled traces by result: exported or dropped.",
+    ["result"]
+)
+TRACE_EXPORT_ERRORS = Counter(
+    "chatbot_trace_export_errors_total",
+    "Failed trace export batches."
+)
+PROMPT_REFRESHES = Counter(
+    "chatbot_prompt_refreshes_total",
+    "Prompt registry refreshes by result: ok or error.",
+    ["result"]
+)
+PROMPT_VERSIONS_LOADED = Counter(
+    "chatbot_prompt_versions_loaded_total",
+    "Prompt versions loaded by the prompt registry."
+)
+PROMPT_VERSION = Gauge(
+    "chatbot_prompt_version_info",
+    "Current version of each prompt, 1 for the served version.",
+    ["name", "version"]
+)
+CHECKPOINT_THREADS = Gauge(
+    "chatbot_checkpoint_threads",
+    "Conversation threads kept by the checkpointer."
+)
+CHECKPOINT_BYTES = Gauge(
+    "chatbot_checkpoint_bytes",
+    "Approximate size of the checkpoints kept by the checkpointer."
+)
+
+# Set in generation_info of generations served by the model cache,
+# their usage was counted when they were generated
+FROM_CACHE = "from_model_cache"
+
+
+class TokenUsage(BaseCallbackHandler):
+    """Counts tokens of model responses for the caller."""
+
+    run_inline = True
+
+    def __init__(self, caller: str):
+        self.caller = caller
+
+    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> Any:
+        for generations in response.generations:
+            for generation in generations:
+                message = getattr(generation, "message", None)
+                if message is None or (generation.generation_info or {}).get(FROM_CACHE, False):
+                    continue
+                usage = _usage(message)
+                for kind, key in (
+                    ("input", "input_tokens"),
+                    ("output", "output_tokens"),
+                    ("cache_read", "cache_read_input_tokens"),
+                    ("cache_creation", "cache_creation_input_tokens"),
+                ):
+                    tokens = usage.get(key, 0) or 0
+                    if tokens:
+                        LLM_TOKENS.inc(self.caller, kind, amount = tokens)
+
+
+def _usage(message) -> dict:
+    usage = message.response_metadata.get("usage", None)
+    if usage:
+        return usage
+    # Note: Streamed responses carry only usage_metadata. Its input_tokens include the cached ones,
+    # which are reported in input_token_details by integrations that track them.
+    usage = getattr(message, "usage_metadata", None) or {}
+    details = usage.get("input_token_details", None) or {}
+    cache_read = details.get("cache_read", 0) or 0
+    cache_creation = details.get("cache_creation", 0) or 0
+    return {
+        "input_tokens": max(0, (usage.get("input_tokens", 0) or 0) - cache_read - cache_creation),
+        "output_tokens": usage.get("output_tokens", 0) or 0,
+        "cache_read_input_tokens": cache_read,
+        "cache_creation_input_tokens": cache_creation,
+    }
+
+
+class GraphMetrics(BaseCallbackHandler):
+    """Measures graph nodes and tools of a run. Call `finish` after the run."""
+
+    run_inline = True
+
+    def __init__(self):
+        # run id -> (metric, labels, started)
+        self._runs: dict[UUID, tuple[Histogram, tuple, float]] = {}
+        self._first_step: Optional[int] = None
+        self._last_step: Optional[int] = None
+
+    def on_chain_start(self, serialized, inputs, *, run_id, metadata = None, **kwargs):
+        node = (metadata or {}).get("langgraph_node", None)
+        if node is None or kwargs.get("name", None) != node or node.startswith("__"):
+            return
+        self._runs[run_id] = (NODE_SECONDS, (node,), time.perf_counter())
+        step = metadata.get("langgraph_step", None)
+        if step is not None:
+            self._first_step = step if self._first_step is None else min(self._first_step, step)
+            self._last_step = step if self._last_step is None else max(self._last_step, step)
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        name = kwargs.get("name", None) or (serialized or {}).get("name", "unknown")
+        self._runs[run_id] = (TOOL_SECONDS, (name,), time.perf_counter())
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._end(run_id, "success")
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, "error")
+
+    def _end(self, run_id: UUID, *status: str):
+        run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        metric, labels, started = run
+        metric.observe(time.perf_counter() - started, *labels, *status)
+
+    def finish(self):
+        if self._first_step is not None:
+            GRAPH_STEPS.observe(self._last_step - self._first_step + 1)
@@ -0,0 +1,271 @@
+import asyncio
+import collections
+import functools
+import os
+import threading
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Iterator, Optional
+
+from langchain_core.runnables import ConfigurableField, Runnable, RunnableSerializable
+from langchain_core.runnables.config import RunnableConfig
+from pydantic import ConfigDict, Field
+
+from . import metrics
+from .llm_scheduler import ScheduledModel, SchedulerRejected, on_admitted
+from .runnables.configurable import RunnableConfigurableRuntimeAlternatives
+
+DEFAULT_MODEL = "claude-3-haiku-20240307"
+# Model of each call site
+MODELS = {
+    "agent": os.getenv("BOT_AGENT_MODEL", default = DEFAULT_MODEL),
+    "resolver": os.getenv("BOT_RESOLVER_MODEL", default = DEFAULT_MODEL),
+    "summarizer": os.getenv("BOT_SUMMARIZER_MODEL", default = DEFAULT_MODEL),
+}
+# More models which can be chosen per call with the "<call site>_model" configurable
+SELECTABLE_MODELS = [m.strip() for m in os.getenv("BOT_SELECTABLE_MODELS", default = "").split(",") if m.strip()]
+# Hedged and failover requests go to this model and endpoint. Without them failed calls
+# are repeated on the same model and endpoint, and calls aren't hedged.
+ALTERNATE_MODEL = os.getenv("BOT_ALTERNATE_MODEL", default = "") or None
+ALTERNATE_API_URL = os.getenv("BOT_ALTERNATE_API_URL", default = "") or None
+# A hedged request is sent when the first one takes longer than this quantile
+# of the recent latencies, 0 disables hedging
+HEDGE_QUANTILE = float(os.getenv("BOT_HEDGE_QUANTILE", default = 0.95))
+# Min seconds before a hedged request
+HEDGE_MIN_DELAY = float(os.getenv("BOT_HEDGE_MIN_DELAY", default = 1.0))
+HEDGE_LATENCY_WINDOW = int(os.getenv("BOT_HEDGE_LATENCY_WINDOW", default = 200))
+# No hedging until this many latencies are known
+HEDGE_MIN_SAMPLES = 20
+FAILOVER = os.getenv("BOT_MODEL_FAILOVER", default = "true").lower() == "true"
+
+
+class LatencyTracker:
+    """Quantiles of the latencies of recent calls."""
+
+    def __init__(self, window: int = HEDGE_LATENCY_WINDOW, min_samples: int = HEDGE_MIN_SAMPLES):
+        self.min_samples = min_samples
+        self._samples: collections.deque[float] = collections.deque(maxlen = window)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def quantile(self, q: float) -> Optional[float]:
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return None
+            samples = sorted(self._samples)
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+_END = object()
+
+
+class HedgedModel(RunnableSerializable):
+    """Calls the primary model, the alternate one when the primary is slow or fails.
+
+    When the primary takes longer than the quantile of its recent latencies, the same
+    request is sent to the alternate and whichever responds first wins, the other one
+    is cancelled. Streams are hedged on the time to the first chunk.
+    Errors which the alternate could succeed on (server errors, timeouts, exhausted
+    rate limit retries) are retried on it once.
+
+    Note: Sync calls fail over but aren't hedged, the server runs the chain asynchronously.
+    Latencies are measured from the admission of a call by the scheduler, waiting for
+    the rate limits doesn't trigger hedged requests.
+    """
+
+    primary: Runnable
+    alternate: Optional[Runnable] = None
+    caller: str
+    quantile: float = HEDGE_QUANTILE
+    min_delay: float = HEDGE_MIN_DELAY
+    failover: bool = FAILOVER
+    latency: LatencyTracker = Field(default_factory = LatencyTracker)
+    first_chunk_latency: LatencyTracker = Field(default_factory = LatencyTracker)
+
+    model_config = ConfigDict(arbitrary_types_allowed = True)
+
+    def _hedge_delay(self, tracker: LatencyTracker) -> Optional[float]:
+        if self.alternate is None or self.quantile <= 0:
+            return None
+        threshold = tracker.quantile(self.quantile)
+        return max(threshold, self.min_delay) if threshold is not None else None
+
+    def _fails_over(self, error: Exception) -> bool:
+        # Note: The alternate shares the scheduler, so a rejected call would be rejected again
+        if self.alternate is None or not self.failover or isinstance(error, SchedulerRejected):
+            return False
+        status = getattr(error, "status_code", None)
+        # Invalid requests fail on any model
+        return status is None or status >= 500 or status in (408, 429)
+
+    @staticmethod
+    def _start(call: Callable[[Runnable], Awaitable[Any]], model: Runnable) -> tuple[asyncio.Task, asyncio.Event]:
+        admitted = asyncio.Event()
+        if not isinstance(model, ScheduledModel):
+            admitted.set()
+        # Note: The task copies the context, so the callback is of this call only
+        token = on_admitted.set(admitted.set)
+        try:
+            return asyncio.create_task(call(model)), admitted
+        finally:
+            on_admitted.reset(token)
+
+    async def _first(
+        self,
+        call: Callable[[Runnable], Awaitable[Any]],
+        tracker: LatencyTracker,
+        discard: Optional[Callable[[Any], Awaitable[None]]] = None
+    ) -> Any:
+        primary, admitted = self._start(call, self.primary)
+        tasks = {primary: "primary"}
+        delay = self._hedge_delay(tracker)
+        hedged = failed_over = False
+        try:
+            admission = asyncio.create_task(admitted.wait())
+            try:
+                await asyncio.wait([primary, admission], return_when = asyncio.FIRST_COMPLETED)
+            finally:
+                admission.cancel()
+            started = time.monotonic()
+            while True:
+                done, _ = await asyncio.wait(
+                    tasks,
+                    timeout = delay if not (hedged or failed_over) else None,
+                    return_when = asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    # The primary is slower than usual
+                    hedged = True
+                    tasks[asyncio.create_task(call(self.alternate))] = "alternate"
+                    continue
+                task = done.pop()
+                source = tasks.pop(task)
+                try:
+                    result = task.result()
+                except Exception as e:
+                    if tasks:
+                        # The other request may still succeed
+                        continue
+                    if source == "primary" and not hedged and self._fails_over(e):
+                        failed_over = True
+                        metrics.LLM_FAILOVERS.inc(self.caller)
+                        tasks[asyncio.create_task(call(self.alternate))] = "alternate"
+                        continue
+                    raise
+                if source == "primary" or "primary" in tasks.values():
+                    # Note: A primary which lost the race took at least that long
+                    tracker.observe(time.monotonic() - started)
+                if hedged:
+                    metrics.LLM_HEDGED.inc(self.caller, source)
+                return result
+        finally:
+            for task in tasks:
+                if task.done() and not task.cancelled() and task.exception() is None:
+                    if discard is not None:
+                        await discard(task.result())
+                else:
+                    task.cancel()
+
+    def invoke(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Any:
+        started = time.monotonic()
+        admitted = []
+        token = on_admitted.set(lambda: admitted.append(time.monotonic()))
+        try:
+            response = self.primary.invoke(input, config, **kwargs)
+        except Exception as e:
+            if not self._fails_over(e):
+                raise
+            metrics.LLM_FAILOVERS.inc(self.caller)
+            return self.alternate.invoke(input, config, **kwargs)
+        finally:
+            on_admitted.reset(token)
+        self.latency.observe(time.monotonic() - (admitted[-1] if admitted else started))
+        return response
+
+    async def ainvoke(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Any:
+        return await self._first(lambda model: model.ainvoke(input, config, **kwargs), self.latency)
+
+    def stream(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Iterator[Any]:
+        iterator = iter(self.primary.stream(input, config, **kwargs))
+        try:
+            first = next(iterator, _END)
+        except Exception as e:
+            if not self._fails_over(e):
+                raise
+            metrics.LLM_FAILOVERS.inc(self.caller)
+            iterator = iter(self.alternate.stream(input, config, **kwargs))
+            first = next(iterator, _END)
+        if first is _END:
+            return
+        yield first
+        yield from iterator
+
+    async def astream(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> AsyncIterator[Any]:
+        async def first_chunk(model: Runnable):
+            iterator = aiter(model.astream(input, config, **kwargs))
+            try:
+                return iterator, await anext(iterator, _END)
+            except BaseException:
+                await iterator.aclose()
+                raise
+
+        async def close(result):
+            await result[0].aclose()
+
+        iterator, first = await self._first(first_chunk, self.first_chunk_latency, discard = close)
+        try:
+            if first is _END:
+                return
+            yield first
+            async for chunk in iterator:
+                yield chunk
+        finally:
+            await iterator.aclose()
+
+
+def create(
+    caller: str,
+    build: Callable[[str, Optional[str]], Runnable],
+    *,
+    model: Optional[str] = None,
+    selectable_models: Optional[list[str]] = None,
+    alternate_model: Optional[str] = ALTERNATE_MODEL,
+    alternate_api_url: Optional[str] = ALTERNATE_API_URL,
+    **hedging: Any
+) -> RunnableConfigurableRuntimeAlternatives:
+    """Model of a call site, it can be switched per call with the "<caller>_model" configurable.
+
+    Args:
+        caller: Call site: agent, resolver or summarizer.
+        build: Creates a model by its name and API URL (None is the default endpoint).
+        model: Default model, BOT_<CALLER>_MODEL by default.
+        selectable_models: Other models the configurable can choose.
+        hedging: Overrides of the HedgedModel settings.
+    """
+    model = model or MODELS[caller]
+    selectable_models = selectable_models if selectable_models is not None else SELECTABLE_MODELS
+
+    def route(name: str) -> HedgedModel:
+        primary = build(name, None)
+        if alternate_model is None and alternate_api_url is None:
+            # Note: A hedged request to the same endpoint would double the spend
+            # of slow calls, failed calls are still repeated there
+            return HedgedModel(primary = primary, alternate = primary, caller = caller, **{**hedging, "quantile": 0.0})
+        alternate = build(alternate_model or name, alternate_api_url)
+        return HedgedModel(primary = primary, alternate = alternate, caller = caller, **hedging)
+
+    # Note: Alternatives are created on first use and then reused, they keep their latencies
+    alternatives = {
+        name: functools.cache(functools.partial(route, name))
+        for name in dict.fromkeys(list(MODELS.values()) + selectable_models)
+        if name != model
+    }
+    return RunnableConfigurableRuntimeAlternatives(
+        which = ConfigurableField(id = f"{caller}_model"),
+        default = route(model),
+        default_key = model,
+        alternatives = alternatives,
+        prefix_keys = False
+    )
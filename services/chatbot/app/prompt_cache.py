@@ -0,0 +1,27 @@
+from typing import Sequence
+
+from langchain_anthropic.chat_models import convert_to_anthropic_tool
+from langchain_core.messages import SystemMessage
+from langchain_core.tools import BaseTool
+
+# Note: Anthropic caches the whole prompt prefix up to a block marked with cache_control.
+# Prefixes shorter than the model minimum (2048 tokens for Haiku) are not cached,
+# the marker is ignored then.
+EPHEMERAL = {"type": "ephemeral"}
+HEADERS = {"anthropic-beta": "prompt-caching-2024-07-31"}
+
+
+def cacheable_tools(tools: Sequence[BaseTool]) -> list[dict]:
+    """Converts tools to Anthropic definitions with the cache breakpoint after the last one.
+
+    Tools go first in the prompt, so the breakpoint covers all tool schemas.
+    """
+    definitions = [dict(convert_to_anthropic_tool(tool)) for tool in tools]
+    if definitions:
+        definitions[-1]["cache_control"] = EPHEMERAL
+    return definitions
+
+
+def cacheable_system_message(text: str) -> SystemMessage:
+    """System message with the cache breakpoint after it."""
+    return SystemMessage(content=[{"type": "text", "text": text, "cache_control": EPHEMERAL}])
@@ -1,10 +1,20 @@
-from typing import Dict, Any
+import logging
+from typing import Dict, Any, Optional
 from fastapi import Request
 from inspect import cleandoc
-from langchain_core.prompts import ChatPromptTemplate, BaseChatPromptTemplate, PromptTemplate
-from langchain_core.runnables.configurable import RunnableConfigurableAlternatives
-from langchain_core.runnables import ConfigurableField
-from app.runnables.configurable import RunnableConfigurableRuntimeAlternatives
+
+from .registry import (
+    FileSource,
+    LangfuseSource,
+    PromptRegistry,
+    PromptVersion,
+    MAX_VERSIONS,
+    PROMPTS_DIR,
+    REFRESH_INTERVAL,
+    SOURCE,
+)
+
+logger = logging.getLogger(__name__)
 
 class _LANGFUSE_PROMPT_KEY:
     MAIN = "main"
@@ -44,48 +54,38 @@ def init(langfuse):
     )
 
 
-def _into_key(prompt):
-    return "ver-" + str(prompt.version)
+def create_registry(langfuse) -> Optional[PromptRegistry]:
+    """Registry of the service prompts from BOT_PROMPT_SOURCE, None if prompts aren't managed."""
+    if SOURCE == "none":
+        return None
+    if SOURCE == "file":
+        source = FileSource(PROMPTS_DIR)
+    elif SOURCE == "langfuse":
+        if langfuse is None:
+            logger.warning("BOT_PROMPT_SOURCE is langfuse, but Langfuse isn't configured")
+            return None
+        source = LangfuseSource(langfuse)
+    else:
+        raise ValueError(f"Unknown BOT_PROMPT_SOURCE: {SOURCE}")
+    return PromptRegistry(
+        source,
+        [_LANGFUSE_PROMPT_KEY.MAIN],
+        partial_variables = {_LANGFUSE_PROMPT_KEY.MAIN: {"chat_history": []}},
+        max_versions = MAX_VERSIONS,
+        refresh_interval = REFRESH_INTERVAL
+    )
+
 
-def set_per_request(langfuse, dynamic_prompt):
+def set_per_request(registry: PromptRegistry):
     def add_per_request(
         config: Dict[str, Any],
         request: Request
     ) -> Dict[str, Any]:
-        if "configurable" not in config:
-            config["configurable"] = {}
-        prompt = langfuse.get_prompt(_LANGFUSE_PROMPT_KEY.MAIN, cache_ttl_seconds=30)
-        prompt_id = _into_key(prompt)
-        dynamic_prompt.set_alternative(
-            key = prompt_id,
-            prompt = ChatPromptTemplate.from_template(
-                prompt.get_langchain_prompt(),
-                partial_variables={"chat_history": []},
-            )
-        )
-        config["configurable"]["prompt"] = prompt_id
-        # Bug:
-        # Configurable field is not passed inside AgentExecutors.
-        # Actually it doesnt seem to pass anything at all.
-        # config["tags"] = [f"prompt={prompt_id}"]
-        config["run_name"] = "agent"
+        # Note: Pins the current versions for the whole request, no I/O here
+        configurable = config.get("configurable", {})
+        for name, key in registry.current_versions().items():
+            configurable[f"{name}_prompt"] = key
+        config["configurable"] = configurable
         return config
 
     return add_per_request
-
-
-def create_dynamic_prompt(langfuse):
-    default_prompt = langfuse.get_prompt(_LANGFUSE_PROMPT_KEY.MAIN, cache_ttl_seconds=30)
-    prompt_id = _into_key(default_prompt)
-    default_langchain_prompt = ChatPromptTemplate.from_template(
-        default_prompt.get_langchain_prompt(),
-        partial_variables={"chat_history": []},
-    )
-    dynamic_prompt = RunnableConfigurableRuntimeAlternatives(
-        which = ConfigurableField(id='prompt'),
-        default = default_langchain_prompt,
-        default_key = _into_key(default_prompt),
-        prefix_keys = False,
-        use_inplace_partial = False
-    )
-    return dynamic_prompt
@@ -0,0 +1,233 @@
+import hashlib
+import logging
+import os
+import threading
+from dataclasses import dataclass
+from typing import Any, Mapping, Optional, Protocol
+
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import ConfigurableField, Runnable, RunnableConfig, ensure_config
+
+from app import metrics
+from app.runnables.configurable import RunnableConfigurableRuntimeAlternatives
+
+logger = logging.getLogger(__name__)
+
+# none, langfuse or file
+SOURCE = os.getenv("BOT_PROMPT_SOURCE", default = "none").lower()
+# Directory of the file source, prompts are <name>.txt files
+PROMPTS_DIR = os.getenv("BOT_PROMPTS_DIR", default = "prompts")
+REFRESH_INTERVAL = float(os.getenv("BOT_PROMPT_REFRESH_INTERVAL", default = 30))
+# Versions of a prompt kept for requests which started with an older one
+MAX_VERSIONS = int(os.getenv("BOT_PROMPT_MAX_VERSIONS", default = 5))
+
+
+@dataclass(frozen = True)
+class PromptVersion:
+    name: str
+    version: str
+    template: str
+
+
+class PromptSource(Protocol):
+    def fetch(self, name: str) -> PromptVersion:
+        """Current version of the prompt."""
+
+
+class LangfuseSource:
+    def __init__(self, langfuse):
+        self.langfuse = langfuse
+
+    def fetch(self, name: str) -> PromptVersion:
+        # Note: The registry is the cache, so the client's one is bypassed
+        prompt = self.langfuse.get_prompt(name, cache_ttl_seconds = 0)
+        return PromptVersion(name, str(prompt.version), prompt.get_langchain_prompt())
+
+
+class FileSource:
+    """Prompts read from <directory>/<name>.txt, versioned by their content. For tests and offline runs."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def fetch(self, name: str) -> PromptVersion:
+        with open(os.path.join(self.directory, f"{name}.txt"), encoding = "utf-8") as f:
+            template = f.read()
+        return PromptVersion(name, hashlib.sha256(template.encode()).hexdigest()[:12], template)
+
+
+def version_key(version: str) -> str:
+    return "ver-" + version
+
+
+@dataclass(frozen = True)
+class _Snapshot:
+    # Current version key by prompt name
+    current: Mapping[str, str]
+    # Loaded versions by prompt name, oldest first
+    versions: Mapping[str, Mapping[str, ChatPromptTemplate]]
+
+
+class PromptRoute(RunnableConfigurableRuntimeAlternatives):
+    """Route of a registry prompt, each call reads the current version and the
+    alternatives from one registry snapshot.
+
+    Note: default, default_key and alternatives are kept up to date for the config
+    schema, but calls don't read them, they change one by one on a refresh.
+    """
+
+    prompt: str
+    registry: Any
+
+    def _prepare(self, config: Optional[RunnableConfig] = None) -> tuple[Runnable, RunnableConfig]:
+        config = ensure_config(config)
+        snapshot = self.registry._snapshot
+        which = config.get("configurable", {}).get(self.which.id, snapshot.current[self.prompt])
+        versions = snapshot.versions[self.prompt]
+        if which not in versions:
+            raise ValueError(f"Unknown alternative: {which}")
+        return versions[which], config
+
+
+class PromptRegistry:
+    """Prompts kept in memory and refreshed from the source in the background.
+
+    Each version is compiled and partial-applied once. Up to max_versions versions
+    of every prompt are kept, the oldest ones are dropped. Lookups do no I/O.
+    A refresh that fails keeps the previous versions.
+
+    Args:
+        source: Where the prompts come from.
+        names: Names of the prompts.
+        partial_variables: Variables applied to the templates, by prompt name.
+        max_versions: Max versions kept per prompt.
+        refresh_interval: Seconds between refreshes in the background. 0 disables them.
+    """
+
+    def __init__(
+        self,
+        source: PromptSource,
+        names: list[str],
+        *,
+        partial_variables: Optional[Mapping[str, Mapping[str, Any]]] = None,
+        max_versions: int = 5,
+        refresh_interval: float = 0
+    ):
+        self.source = source
+        self.partial_variables = dict(partial_variables or {})
+        self.max_versions = max(1, max_versions)
+        self.refresh_interval = refresh_interval
+        # Note: Replaced with one assignment, never mutated, so lookups don't need the lock
+        # and always see a current version together with its template.
+        self._snapshot = _Snapshot(current = {}, versions = {name: {} for name in names})
+        self._routes: dict[str, PromptRoute] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.refresh()
+
+    def _compile(self, prompt: PromptVersion) -> ChatPromptTemplate:
+        return ChatPromptTemplate.from_template(
+            prompt.template,
+            partial_variables = dict(self.partial_variables.get(prompt.name, {}))
+        )
+
+    def refresh(self) -> bool:
+        """Loads new versions of the prompts. Returns True if any prompt changed."""
+        changed = False
+        for name in self._snapshot.versions:
+            try:
+                prompt = self.source.fetch(name)
+                key = version_key(prompt.version)
+                snapshot = self._snapshot
+                if key == snapshot.current.get(name, None):
+                    continue
+                template = snapshot.versions[name].get(key, None)
+                if template is None:
+                    template = self._compile(prompt)
+                    metrics.PROMPT_VERSIONS_LOADED.inc()
+            except Exception:
+                metrics.PROMPT_REFRESHES.inc("error")
+                logger.exception("Failed to refresh prompt %s, keeping the previous versions", name)
+                continue
+            self._set_current(name, key, template)
+            changed = True
+        metrics.PROMPT_REFRESHES.inc("ok")
+        return changed
+
+    def _set_current(self, name: str, key: str, template: ChatPromptTemplate):
+        with self._lock:
+            snapshot = self._snapshot
+            versions = {k: v for k, v in snapshot.versions[name].items() if k != key}
+            versions[key] = template
+            for old in list(versions)[:-self.max_versions]:
+                del versions[old]
+            self._snapshot = _Snapshot(
+                current = {**snapshot.current, name: key},
+                versions = {**snapshot.versions, name: versions}
+            )
+            route = self._routes.get(name, None)
+            if route is not None:
+                self._update_route(route, key, versions)
+
+    @staticmethod
+    def _update_route(route: PromptRoute, key: str, versions: dict):
+        route.alternatives = {k: v for k, v in versions.items() if k != key}
+        route.default = versions[key]
+        route.default_key = key
+
+    def current_versions(self) -> dict[str, str]:
+        """Keys of the current versions, by prompt name."""
+        return dict(self._snapshot.current)
+
+    def versions(self, name: str) -> list[str]:
+        return list(self._snapshot.versions[name])
+
+    def get(self, name: str, version: Optional[str] = None) -> ChatPromptTemplate:
+        """Compiled prompt, the current version by default.
+
+        Raises:
+            KeyError: The prompt or its version isn't loaded.
+        """
+        snapshot = self._snapshot
+        key = version if version is not None else snapshot.current[name]
+        return snapshot.versions[name][key]
+
+    def route(self, name: str) -> PromptRoute:
+        """Prompt runnable, its version is chosen by the "<name>_prompt" configurable.
+
+        Raises:
+            KeyError: The prompt isn't loaded.
+        """
+        with self._lock:
+            route = self._routes.get(name, None)
+            if route is None:
+                snapshot = self._snapshot
+                key = snapshot.current[name]
+                route = self._routes[name] = PromptRoute(
+                    which = ConfigurableField(id = f"{name}_prompt"),
+                    default = snapshot.versions[name][key],
+                    default_key = key,
+                    prefix_keys = False,
+                    prompt = name,
+                    registry = self
+                )
+                self._update_route(route, key, snapshot.versions[name])
+            return route
+
+    def start(self):
+        if self.refresh_interval <= 0 or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target = self._run, name = "prompts-refresh", daemon = True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.refresh_interval):
+            self.refresh()
@@ -1 +1,2 @@
 from . import configurable
+from .lazy import LazyRunnable
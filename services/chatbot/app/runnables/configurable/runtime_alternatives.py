@@ -1,8 +1,11 @@
 from langchain_core.runnables.configurable import RunnableConfigurableAlternatives
 from typing import List, Mapping, Any
+import logging
 
 from pydantic import Field
 
+logger = logging.getLogger(__name__)
+
 class RunnableConfigurableRuntimeAlternatives(RunnableConfigurableAlternatives):
     partial_variables: Mapping[str, Any] = Field(default_factory=dict)
 
@@ -51,6 +54,7 @@ class RunnableConfigurableRuntimeAlternatives(RunnableConfigurableAlternatives):
         self,
         config = None
     ):
-        print(f"Using _prepare! >> {config}")
+        # Note: Runs on every call, model routes included
+        logger.debug("Using _prepare! >> %s", config)
         return super()._prepare(config)
 
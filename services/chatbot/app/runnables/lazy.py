@@ -0,0 +1,79 @@
+import asyncio
+import threading
+from typing import Any, AsyncIterator, Callable, Iterator, Optional
+
+from langchain_core.runnables import Runnable
+from langchain_core.runnables.config import RunnableConfig
+
+
+class LazyRunnable(Runnable):
+    """Runnable created on first use, its types are known upfront.
+
+    Lets routes be registered before the runnable is built, e.g. at import time.
+
+    Args:
+        factory: Creates the runnable, called once.
+        input_type: Type of the input schema.
+        output_type: Type of the output schema.
+        name: Name of the schemas.
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[], Runnable],
+        *,
+        input_type: Any = Any,
+        output_type: Any = Any,
+        name: Optional[str] = None
+    ):
+        self.factory = factory
+        self.name = name
+        self._input_type = input_type
+        self._output_type = output_type
+        self._runnable: Optional[Runnable] = None
+        self._lock = threading.Lock()
+
+    @property
+    def InputType(self) -> Any:
+        return self._input_type
+
+    @property
+    def OutputType(self) -> Any:
+        return self._output_type
+
+    @property
+    def created(self) -> bool:
+        return self._runnable is not None
+
+    def get(self) -> Runnable:
+        runnable = self._runnable
+        if runnable is None:
+            with self._lock:
+                if self._runnable is None:
+                    self._runnable = self.factory()
+                runnable = self._runnable
+        return runnable
+
+    async def aget(self) -> Runnable:
+        """Same as get, but the runnable is built in a thread, not on the event loop.
+
+        Note: Concurrent first callers wait for the same build, see get.
+        """
+        runnable = self._runnable
+        if runnable is None:
+            runnable = await asyncio.to_thread(self.get)
+        return runnable
+
+    def invoke(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Any:
+        return self.get().invoke(input, config, **kwargs)
+
+    async def ainvoke(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Any:
+        return await (await self.aget()).ainvoke(input, config, **kwargs)
+
+    def stream(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Iterator[Any]:
+        yield from self.get().stream(input, config, **kwargs)
+
+    async def astream(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> AsyncIterator[Any]:
+        runnable = await self.aget()
+        async for chunk in runnable.astream(input, config, **kwargs):
+            yield chunk
@@ -1,8 +1,10 @@
 #!/usr/bin/env python
 
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from fastapi.responses import RedirectResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, RedirectResponse
 from fastapi import Request
+from fastapi import HTTPException
 from langserve import add_routes
 from inspect import cleandoc
 from typing import Dict, Any
@@ -10,32 +12,64 @@ from langchain_core.runnables import ConfigurableField
 from langchain_core.runnables.configurable import RunnableConfigurableAlternatives
 from langchain_core.prompts import ChatPromptTemplate
 
+import asyncio
 import jwt
 import os
 import logging
+import threading
 logger = logging.getLogger(__name__)
 
+from . import auth
+from . import cache
+from . import metrics
 from . import chain
+from . import checkpoint
+from . import health
 from . import prompts
-from . import utils
 from . import tools
+from . import tracing
+from .runnables import LazyRunnable
+
+# Warm up in the background on startup: connect Langfuse, load prompts, build the graph
+# and open the backend connections. Otherwise that happens on the first probe or request.
+PREWARM = os.getenv("BOT_PREWARM", default = "true").lower() == "true"
+# Max seconds to wait for background summaries on shutdown, before the threads are handed off
+SHUTDOWN_DRAIN_TIMEOUT = float(os.getenv("BOT_SHUTDOWN_DRAIN_TIMEOUT", default = 30))
+
+# Note: Everything slow happens after the import, see lifespan and readiness checks below.
+langfuse = None
+prompt_registry = None
+_set_prompt = None
+token_verifier = None
+checkpointer = None
+llm_cache = None
+_init_lock = threading.Lock()
+readiness = health.Readiness()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Note: The port is served while the service warms up, /readyz tells when it is ready.
+    warm_up = asyncio.create_task(readiness.run()) if PREWARM else None
+    try:
+        yield
+    finally:
+        if warm_up is not None:
+            warm_up.cancel()
+        # Note: uvicorn drains requests before this, background summaries are drained here.
+        # Then the threads go to the spill backend (if any), so the next process restores them.
+        await chain.drain(SHUTDOWN_DRAIN_TIMEOUT)
+        if checkpointer is not None:
+            handed_off = await asyncio.to_thread(checkpoint.handoff, checkpointer)
+            if handed_off:
+                logger.info("Handed %s threads off to the spill backend", handed_off)
+        if token_verifier is not None and token_verifier.keys is not None:
+            token_verifier.keys.stop()
+        if prompt_registry is not None:
+            prompt_registry.stop()
+        tracing.tracer.stop()
+        await tools._Tools.aclose()
 
-from langfuse import Langfuse
-
-try:
-    if os.getenv("LANGFUSE_HOST"):
-        langfuse = Langfuse()
-        langfuse.auth_check()
-    else:
-        langfuse = None
-except:
-    langfuse = None
-
-# prompts.init(langfuse)
-
-tools._Tools.init(
-    base_url = os.getenv("BOT_TOOLS_BASE_URL")
-)
 
 app = FastAPI(
     title="Chatbot Service",
@@ -44,52 +78,9 @@ app = FastAPI(
     description=cleandoc("""
         Chat bot service responsible to chat with users and help finding answers on their questions.
     """),
+    lifespan = lifespan,
 )
 
-# Note: Copied from https://github.com/langchain-ai/langserve/issues/311
-def _add_tracing(
-    config: Dict[str, Any],
-    request: Request
-) -> Dict[str, Any]:
-    """
-    Config modifier function to add a tracing callback
-
-    :param config: config dict
-    :param request: HTTP request
-    :return: updated config
-    """
-
-    if "callbacks" not in config:
-        config["callbacks"] = []
-
-    # Note: temporary solution to make it working
-    if "conversation_id" not in config:
-        config["conversation_id"] = str(request.client)
-    if "user_id" not in config:
-        config["user_id"] = str(request.client)
-    # endof temporary solution
-
-    conversation_id = config["conversation_id"]
-    user_id = config["user_id"]
-
-    metadata = {
-        "conversation_id": conversation_id,
-        "user_id": user_id
-    }
-    if langfuse is not None:
-        trace = langfuse.trace(
-            id=conversation_id,
-            metadata=metadata,
-        )
-        trace_handler = trace.getNewHandler()
-
-        config["callbacks"].extend([
-            # langfuse_handler
-            trace_handler
-        ])
-    return config
-
-
 assert tools.TOOLS_AUTH_FORWARD_CONTEXT is not None
 
 def _add_tools_auth_context(
@@ -101,6 +92,19 @@ def _add_tools_auth_context(
     config["configurable"] = configurable
     return config
 
+def _add_response_mode(
+    config: Dict[str, Any],
+    request: Request
+) -> Dict[str, Any]:
+    # Note: The client can't set a configurable the chain doesn't declare,
+    # so the response mode is passed in a header.
+    response_mode = request.headers.get("X-Bot-Response-Mode", None)
+    if response_mode is not None:
+        configurable = config.get("configurable", {})
+        configurable[chain.RESPONSE_MODE_KEY] = chain.ResponseMode(response_mode.lower())
+        config["configurable"] = configurable
+    return config
+
 def _extract_thread_id(
     config: Dict[str, Any],
     request: Request
@@ -111,39 +115,139 @@ def _extract_thread_id(
     assert jwt_bearer_token.startswith("Bearer "), "Sanity check"
     jwt_token = jwt_bearer_token.replace("Bearer ", "", 1)
 
-    claims = jwt.decode(
-        jwt_token,
-        options = {
-            # TODO: Validate JWT token
-            "verify_signature": False
-        }
-    )
+    try:
+        verifier = _get_verifier()
+    except Exception as e:
+        # Note: Fails closed, see the auth readiness check
+        raise HTTPException(status_code = 401, detail = f"Tokens can't be verified: {e}")
+    try:
+        claims = verifier.verify(jwt_token)
+    except jwt.InvalidTokenError as e:
+        raise HTTPException(status_code = 401, detail = str(e))
     conversation_id = claims.get("ConversationId", None)
     assert conversation_id is not None, "ConversationId must be set"
     configurable["thread_id"] = conversation_id
+    configurable[tools.TOOLS_USER_ID] = claims.get("UserId", None)
     config["configurable"] = configurable
     return config
 
 
+def _get_verifier() -> auth.TokenVerifier:
+    global token_verifier
+    with _init_lock:
+        if token_verifier is None:
+            verifier = auth.create_verifier()
+            if verifier.keys is not None:
+                verifier.keys.start()
+            token_verifier = verifier
+    return token_verifier
+
+def _get_storage():
+    # Note: Opens the checkpoint and model cache files
+    global checkpointer, llm_cache
+    with _init_lock:
+        if checkpointer is None:
+            memory = checkpoint.create()
+            llm_cache = cache.create_model_cache()
+            checkpointer = memory
+    return checkpointer, llm_cache
 
 @app.get("/")
 async def redirect_root_to_docs():
     return RedirectResponse("/docs")
 
+@app.get("/healthz")
+async def liveness():
+    # Note: Dependencies are not checked here, a restart wouldn't fix them. See /readyz.
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readiness_probe():
+    if not readiness.ready and not readiness.running:
+        await readiness.run()
+    report = readiness.report()
+    return JSONResponse(report, status_code = 200 if report["ready"] else 503)
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    # Note: Gauges of state owned by other objects are set at scrape time
+    if checkpointer is not None:
+        # Note: A count over the stored checkpoints, kept off the event loop
+        stats = await asyncio.to_thread(checkpointer.stats)
+        metrics.CHECKPOINT_THREADS.set(stats.threads)
+        metrics.CHECKPOINT_BYTES.set(stats.bytes)
+    if prompt_registry is not None:
+        metrics.PROMPT_VERSION.clear()
+        for name, version in prompt_registry.current_versions().items():
+            metrics.PROMPT_VERSION.set(1, name, version)
+    return PlainTextResponse(metrics.render(), media_type = "text/plain; version=0.0.4")
+
+def _connect_langfuse():
+    if not os.getenv("LANGFUSE_HOST"):
+        return None
+    # Note: Imported only if configured, it is slow to import
+    from langfuse import Langfuse
+    try:
+        client = Langfuse()
+        client.auth_check()
+    except Exception:
+        logger.exception("Langfuse is not available, traces and prompts don't use it")
+        return None
+    return client
+
+async def _init_tracing():
+    global langfuse
+    langfuse = await asyncio.to_thread(_connect_langfuse)
+    # prompts.init(langfuse)
+    # Note: Turns are traced by the chain, see tracing.py
+    tracing.init(tracing.create_exporter(langfuse))
+    tracing.tracer.start()
+
+async def _init_prompts():
+    global prompt_registry, _set_prompt
+    # Note: Prompts are refreshed in the background, requests read them from memory
+    registry = await asyncio.to_thread(prompts.create_registry, langfuse)
+    if registry is not None:
+        registry.start()
+        _set_prompt = prompts.set_per_request(registry)
+    prompt_registry = registry
+
+async def _init_auth():
+    await asyncio.to_thread(_get_verifier)
+
+async def _init_storage():
+    await asyncio.to_thread(_get_storage)
+
+def _create_chain():
+    tools._Tools.init(
+        base_url = os.getenv("BOT_TOOLS_BASE_URL")
+    )
+    checkpointer, llm_cache = _get_storage()
+    return chain.create(
+        claude_api_key = os.getenv("CLAUDE_API_KEY"),
+        checkpointer = checkpointer,
+        llm_cache = llm_cache,
+    #    prompt = prompt_registry.route(prompts._LANGFUSE_PROMPT_KEY.MAIN)
+    )
 
-# dynamic_prompt = prompts.create_dynamic_prompt(langfuse)
+# Note: Routes need only the types of the chain, it is built by the warm up
+# or by the first request. Model clients are created with it.
+the_chain = LazyRunnable(_create_chain, output_type = dict, name = "invoke_graph")
 
-the_chain = chain.create(
-    claude_api_key = os.getenv("CLAUDE_API_KEY"),
-#    prompt = dynamic_prompt
-)
-# Inject real prompt here.
-# _set_prompt = prompts.set_per_request(langfuse, dynamic_prompt = dynamic_prompt)
-_set_prompt = None
+async def _build_chain():
+    await asyncio.to_thread(the_chain.get)
+
+readiness.add("auth", _init_auth)
+readiness.add("tracing", _init_tracing)
+readiness.add("prompts", _init_prompts)
+readiness.add("storage", _init_storage)
+readiness.add("chain", _build_chain)
+readiness.add("tools_backend", tools._Tools.acheck)
 
 def _per_request_config(config, request):
-    config = _add_tracing(config, request)
     config = _add_tools_auth_context(config, request)
+    config = _add_response_mode(config, request)
     config = _extract_thread_id(config, request)
     if _set_prompt is not None:
         config = _set_prompt(config, request)
@@ -1,32 +1,42 @@
 from pydantic import BaseModel
 from typing import Annotated, Optional, Union
 from langchain_core.messages import (
-    AnyMessage,
     RemoveMessage,
     MessageLikeRepresentation
 )
-from langgraph.graph import add_messages
+
+from .message_log import MessageLog
 
 Messages = Union[list[MessageLikeRepresentation], MessageLikeRepresentation]
 
-def reduce_list(left: Messages, right: Messages) -> Messages:
-    if isinstance(left, list) and len(left) > 0 and not left[-1].content:
+def reduce_list(left: Messages, right: Messages) -> MessageLog:
+    # Note: Unlike add_messages, it doesn't convert and re-index the whole history
+    log = left.copy() if isinstance(left, MessageLog) else MessageLog(left or [])
+    right = right if isinstance(right, list) else [right]
+    if len(log) > 0 and not log[-1].content:
         # Remove empty final message by AI agent from it previous response
-        remove_message = RemoveMessage(id=left[-1].id)
-        right = right + [remove_message] if isinstance(right, list) else [right, remove_message]
+        right = right + [RemoveMessage(id=log[-1].id)]
+
+    return log.apply(right)
 
-    return add_messages(left, right)
+class SearchResult(BaseModel):
+    """Compact form of a search_in_chats result kept in the state."""
+    link: str
+    id: Optional[str] = None
+    score: Optional[float] = None
+    snippet: Optional[str] = None
 
 class State(BaseModel):
-    messages: Annotated[list[AnyMessage], reduce_list]
+    messages: Annotated[MessageLog, reduce_list]
 
     summary: Optional[str] = None
     search_type: Optional[str] = None
-    last_seen_msg_id: Optional[str] = None
-    last_search_result: Optional[str] = None
+    # Sequence number of the last message processed by save_tool_results_to_state
+    last_seen_seq: Optional[int] = None
+    last_search_results: Optional[list[SearchResult]] = None
 
     def clear(self):
         self.summary = None
         self.search_type = None
-        self.last_search_result = None
-        # Do not clear last_seen_msg_id
+        self.last_search_results = None
+        # Do not clear last_seen_seq
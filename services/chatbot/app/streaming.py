@@ -0,0 +1,119 @@
+import logging
+import time
+
+from langchain_core.messages import AIMessage, AIMessageChunk, message_chunk_to_message
+from langchain_core.runnables.config import RunnableConfig
+
+from .tools import _areply, _aremove_reply
+
+logger = logging.getLogger(__name__)
+
+# Marks an agent message which was already delivered to the user while streaming
+REPLY_STREAMED = "reply_streamed"
+
+def _text(content) -> str:
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "".join(
+            block if isinstance(block, str) else block.get("text", "")
+            for block in content
+            if isinstance(block, str) or block.get("type") == "text"
+        )
+    return ""
+
+def into_message(response: AIMessageChunk) -> AIMessage:
+    """Converts an aggregated stream into the message non-streaming invoke returns."""
+    message = message_chunk_to_message(response)
+    # Same as ChatAnthropic does for a non-streaming response
+    content = message.content
+    if isinstance(content, list) and len(content) == 1 and not message.tool_calls:
+        block = content[0]
+        if isinstance(block, dict) and block.get("type") == "text":
+            message.content = block.get("text", "")
+    return message
+
+
+class ReplyStreamer:
+    """Forwards the agent's text to the user while it is being generated.
+
+    The first flush creates a reply, the next ones update it with all the
+    text generated so far. The last update sends exactly the final content.
+    Text of a message with tool calls isn't shown by the non-streaming path,
+    so the first flush waits for flush_size characters without a tool call,
+    and a reply sent before a tool call is removed.
+
+    Args:
+        flush_interval: Min seconds between two updates.
+        flush_size: Min number of new characters to send an update.
+            Either condition triggers a flush.
+    """
+
+    def __init__(self, config: RunnableConfig, *, flush_interval: float, flush_size: int):
+        self.config = config
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.text = ""
+        self.sent = ""
+        self.entry_local_id = None
+        self.is_stopped = False
+        self._flushed_at = None
+
+    async def feed(self, chunk: AIMessageChunk):
+        if self.is_stopped:
+            return
+        # Note: models without native streaming yield a single complete message
+        if chunk.tool_calls or getattr(chunk, "tool_call_chunks", None):
+            self.is_stopped = True
+            await self._retract()
+            return
+        self.text += _text(chunk.content)
+        pending = len(self.text) - len(self.sent)
+        if pending <= 0:
+            return
+        now = time.monotonic()
+        if self._flushed_at is None:
+            # Note: A tool call may still follow a short text
+            if pending < self.flush_size:
+                return
+        elif pending < self.flush_size and now - self._flushed_at < self.flush_interval:
+            return
+        await self._flush(self.text)
+        self._flushed_at = now
+
+    async def finish(self, message: AIMessage) -> bool:
+        """Sends the final text. Returns True if the message was delivered to the user."""
+        if message.tool_calls:
+            await self._retract()
+            return False
+        if not self.sent:
+            # Nothing is visible yet: the regular final answer path does the job
+            return False
+        final_text = _text(message.content)
+        if final_text != self.sent:
+            await self._flush(final_text)
+        return bool(self.sent)
+
+    async def _flush(self, text: str):
+        if self.sent and self.entry_local_id is None:
+            # The backend doesn't support updates: send the rest as a new reply
+            await _areply(text[len(self.sent):], self.config)
+        else:
+            result = await _areply(text, self.config, entry_local_id = self.entry_local_id)
+            if self.entry_local_id is None:
+                self.entry_local_id = (result or {}).get("entryLocalId", None)
+                if self.entry_local_id is None:
+                    logger.warning("Reply updates are not supported by the backend, streaming is disabled.")
+                    self.is_stopped = True
+        self.sent = text
+
+    async def _retract(self):
+        """Removes the reply sent before a tool call."""
+        if not self.sent:
+            return
+        if self.entry_local_id is None:
+            logger.warning("Can't remove the text streamed before a tool call, the backend doesn't support updates.")
+        else:
+            await _aremove_reply(self.entry_local_id, self.config)
+        self.sent = ""
+        self.entry_local_id = None
@@ -1,5 +1,4 @@
 from enum import StrEnum, auto
-from itertools import takewhile
 
 from typing import Annotated, List, Any, Literal
 from langchain_core.tools import tool
@@ -8,31 +7,108 @@ from langchain_core.messages import ToolMessage
 from langchain_core.runnables.config import RunnableConfig
 from langchain_core.language_models.chat_models import BaseChatModel
 
+import httpx
+import importlib.util
+import os
+import time
 
-import requests
-import json
-
+from app import metrics
+from app import tracing
 from app.state import State
 from app.tools.reset import ResetHandler
 from app.tools.resolver import SearchTypeResolver
+from app.tools.resolver_rules import SearchTypeRules
+from app.tools.search_cache import SearchCache
+from app.tools.search_results import SearchResultsHandler
 
 TOOLS_AUTH_FORWARD_CONTEXT = "forward-auth-context"
+# UserId claim of the verified context token, set by the server
+TOOLS_USER_ID = "user_id"
 
 class ToolNames(StrEnum):
     Reset = auto()
     ResolveSearchType = auto()
 
+def _http2_available() -> bool:
+    return importlib.util.find_spec("h2") is not None
+
 class _Tools(object):
+    BASE_URL = None
     REPLY = None
+    REMOVE_REPLY = None
     FORWARD_CHAT_LINKS = None
+    # Whether the backend updates replies in place, learned from its answers to new replies
+    REPLY_UPDATES = None
     SEARCH_IN_CHATS = None
 
+    CONNECT_TIMEOUT = float(os.getenv("BOT_TOOLS_CONNECT_TIMEOUT", default = 5.0))
+    READ_TIMEOUT = float(os.getenv("BOT_TOOLS_READ_TIMEOUT", default = 30.0))
+    # Note: All tools share a single backend host (BOT_TOOLS_BASE_URL),
+    # so the pool limits below are effectively per-host limits.
+    MAX_CONNECTIONS = int(os.getenv("BOT_TOOLS_MAX_CONNECTIONS", default = 100))
+    MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("BOT_TOOLS_MAX_KEEPALIVE_CONNECTIONS", default = 20))
+    KEEPALIVE_EXPIRY = float(os.getenv("BOT_TOOLS_KEEPALIVE_EXPIRY", default = 30.0))
+    HTTP2 = os.getenv("BOT_TOOLS_HTTP2", default = "true").lower() == "true"
+
+    # Identical searches within a conversation reuse the results for a short time
+    SEARCH_CACHE = os.getenv("BOT_SEARCH_CACHE", default = "true").lower() == "true"
+    SEARCH_CACHE_TTL = float(os.getenv("BOT_SEARCH_CACHE_TTL", default = 60.0))
+    SEARCH_CACHE_MAX_ENTRIES = int(os.getenv("BOT_SEARCH_CACHE_MAX_ENTRIES", default = 1000))
+
+    client: httpx.Client = None
+    async_client: httpx.AsyncClient = None
+    search_cache: SearchCache = None
+
     @classmethod
     def init(cls, *, base_url):
+        cls.BASE_URL = base_url
         cls.REPLY = base_url + "/api/bot/conversation/reply"
+        cls.REMOVE_REPLY = base_url + "/api/bot/conversation/remove-reply"
         cls.FORWARD_CHAT_LINKS = base_url + "/api/bot/conversation/forward-chat-links"
         cls.SEARCH_IN_CHATS = base_url + "/api/bot/search/chats"
 
+        cls.close()
+        options = dict(
+            timeout = httpx.Timeout(
+                cls.READ_TIMEOUT,
+                connect = cls.CONNECT_TIMEOUT
+            ),
+            limits = httpx.Limits(
+                max_connections = cls.MAX_CONNECTIONS,
+                max_keepalive_connections = cls.MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry = cls.KEEPALIVE_EXPIRY
+            ),
+            http2 = cls.HTTP2 and _http2_available(),
+            verify = False # TODO: think again if needed.
+        )
+        cls.client = httpx.Client(**options)
+        cls.async_client = httpx.AsyncClient(**options)
+        cls.search_cache = SearchCache(
+            max_entries = cls.SEARCH_CACHE_MAX_ENTRIES,
+            ttl = cls.SEARCH_CACHE_TTL
+        ) if cls.SEARCH_CACHE else None
+
+    @classmethod
+    def close(cls):
+        if cls.client is not None:
+            cls.client.close()
+            cls.client = None
+        # Note: Async client is dropped without awaiting here.
+        # Use aclose() from within the event loop for a graceful shutdown.
+        cls.async_client = None
+
+    @classmethod
+    async def acheck(cls):
+        """Opens a pooled connection to the backend, any HTTP response means it is reachable."""
+        await cls.async_client.head(cls.BASE_URL)
+
+    @classmethod
+    async def aclose(cls):
+        if cls.async_client is not None:
+            await cls.async_client.aclose()
+            cls.async_client = None
+        cls.close()
+
 @tool(parse_docstring=True)
 def reply(
     message: str,
@@ -51,6 +127,12 @@ def reply(
     _ = _reply(message, config)
     return
 
+async def _reply_async(message: str, config: RunnableConfig):
+    _ = await _areply(message, config)
+    return
+
+reply.coroutine = _reply_async
+
 @tool(parse_docstring=True)
 def search_in_chats(
     text: str,
@@ -66,32 +148,53 @@ def search_in_chats(
     Returns:
         List: ranked search results.
     """
-    # search_type_value = "Public" if search_type=="PUBLIC" else "Private" if search_type=="PRIVATE" else "General"
-    search_type_value = 1 if search_type=="PUBLIC" else 2 if search_type=="PRIVATE" else 3
-    results = _post(
+    fetch = lambda: _post(
         _Tools.SEARCH_IN_CHATS,
-        {
-            "text": text,
-            "searchType": search_type_value
-        },
+        _search_in_chats_request(text, search_type),
         config
     )
+    if _Tools.search_cache is None:
+        results = fetch()
+    else:
+        results = _Tools.search_cache.get_or_fetch(_search_cache_key(text, search_type, config), fetch)
 
     # Note: For some reason if results are formatted into a plain text
     # the agent doesn't want to send relevand search results to the user.
     # return text_results
     return results
 
-def get_last_search_results(state: State) -> List[Any]:
-    for message in reversed(state.messages):
-        if isinstance(message, ToolMessage) and message.name==search_in_chats.name:
-            if message.status=="success":
-                state.last_search_result = message.content
-            else:
-                state.last_search_result = ""
-            break
+async def _search_in_chats_async(
+    text: str,
+    search_type: Literal["PUBLIC", "PRIVATE", "GENERAL"],
+    config: RunnableConfig
+) -> List[Any]:
+    fetch = lambda: _apost(
+        _Tools.SEARCH_IN_CHATS,
+        _search_in_chats_request(text, search_type),
+        config
+    )
+    if _Tools.search_cache is None:
+        return await fetch()
+    return await _Tools.search_cache.aget_or_fetch(_search_cache_key(text, search_type, config), fetch)
+
+search_in_chats.coroutine = _search_in_chats_async
+
+def _search_cache_key(text, search_type, config: RunnableConfig):
+    configurable = (config or {}).get("configurable", {})
+    return SearchCache.key(
+        configurable.get(TOOLS_USER_ID, None),
+        configurable.get("thread_id", None),
+        text,
+        search_type
+    )
 
-    return json.loads(state.last_search_result) if state.last_search_result else []
+def _search_in_chats_request(text, search_type):
+    # search_type_value = "Public" if search_type=="PUBLIC" else "Private" if search_type=="PRIVATE" else "General"
+    search_type_value = 1 if search_type=="PUBLIC" else 2 if search_type=="PRIVATE" else 3
+    return {
+        "text": text,
+        "searchType": search_type_value
+    }
 
 @tool(parse_docstring=True)
 def forward_search_results(
@@ -107,47 +210,66 @@ def forward_search_results(
     Args:
         comment: A comment to add along with the search results.
     """
-    last_search_results = get_last_search_results(state)
-    if not last_search_results:
-        raise Exception("Can not forward last search result. It could be that the last search_in_public_chats tool call was not successfull or returned an empty result.")
-
-    links = [link for link in map(lambda result: result.get("link", None), last_search_results) if link is not None]
-
     _post(
         _Tools.FORWARD_CHAT_LINKS,
-        {
-            "comment": comment,
-            "links": links
-        },
+        _forward_search_results_request(comment, state),
         config
     )
     return
 
+async def _forward_search_results_async(
+    comment: str,
+    state: Annotated[State, InjectedState],
+    config: RunnableConfig
+):
+    await _apost(
+        _Tools.FORWARD_CHAT_LINKS,
+        _forward_search_results_request(comment, state),
+        config
+    )
+    return
+
+forward_search_results.coroutine = _forward_search_results_async
+
+def _forward_search_results_request(comment, state: State):
+    # Note: Search results are saved to the state by SearchResultsHandler
+    last_search_results = state.last_search_results
+    if not last_search_results:
+        raise Exception("Can not forward last search result. It could be that the last search_in_public_chats tool call was not successfull or returned an empty result.")
+
+    links = [result.link for result in last_search_results]
+    return {
+        "comment": comment,
+        "links": links
+    }
+
 @tool(ToolNames.Reset, parse_docstring=True)
-def reset(state: Annotated[State, InjectedState]):
+def reset(state: Annotated[State, InjectedState], config: RunnableConfig):
     """
     Clears the state if user requests to reset or start the search over.
 
     Args:
     """
-    # The actual job is done in the ResetHandler
-    pass
-
-def save_tool_results_to_state(state: State) -> State:
-    stop_id = state.last_seen_msg_id
-    tool_messages: list[ToolMessage] = [
-        msg for msg in takewhile(lambda m: m.id != stop_id, reversed(state.messages)) if isinstance(msg, ToolMessage)
-    ]
-
-    while tool_messages:
-        message = tool_messages.pop()
+    # The state is cleared in the ResetHandler
+    if _Tools.search_cache is not None:
+        _Tools.search_cache.invalidate(config.get("configurable", {}).get("thread_id", None))
+
+def save_tool_results_to_state(state: State):
+    for message in state.messages.since(state.last_seen_seq):
+        if not isinstance(message, ToolMessage):
+            continue
         SearchTypeResolver.try_update_state(state, message, ToolNames.ResolveSearchType)
         ResetHandler.try_update_state(state, message, ToolNames.Reset)
+        SearchResultsHandler.try_update_state(state, message, search_in_chats.name)
 
-    if state.messages:
-        state.last_seen_msg_id = state.messages[-1].id
+    state.last_seen_seq = state.messages.last_seq
 
-    return state
+    # Note: Messages are not returned, otherwise the whole log goes through the reducer
+    return {
+        name: getattr(state, name)
+        for name in State.model_fields
+        if name != "messages"
+    }
 
 def _reply(message, config):
     _result = _post(
@@ -157,38 +279,118 @@ def _reply(message, config):
         },
         config
     )
+    _note_reply_updates(_result)
     return _result
 
-def _post(url, data, config: RunnableConfig):
+async def _areply(message, config, *, entry_local_id = None):
+    data = {
+        "text": message
+    }
+    if entry_local_id is not None:
+        # Updates the previously sent reply
+        data["entryLocalId"] = entry_local_id
+    _result = await _apost(
+        _Tools.REPLY,
+        data,
+        config
+    )
+    if entry_local_id is None:
+        _note_reply_updates(_result)
+    return _result
+
+def _note_reply_updates(result):
+    # Note: A backend which supports updates returns the entryLocalId of the new reply
+    _Tools.REPLY_UPDATES = isinstance(result, dict) and result.get("entryLocalId", None) is not None
+
+def reply_updates_supported() -> bool:
+    return _Tools.REPLY_UPDATES is True
+
+async def _aremove_reply(entry_local_id, config):
+    _result = await _apost(
+        _Tools.REMOVE_REPLY,
+        {
+            "entryLocalId": entry_local_id
+        },
+        config
+    )
+    return _result
+
+def _auth_headers(config: RunnableConfig):
     if (config is None):
         config = {}
     config = config.get("configurable", {})
     auth_context = config.get(TOOLS_AUTH_FORWARD_CONTEXT, None)
-    headers = {
+    if auth_context is None:
+        return {}
+    return {
         "Authorization": auth_context
     }
 
-    result = requests.post(
-        url,
-        json = data,
-        headers = headers,
-        verify = False # TODO: think again if needed.
-    )
+def _observe_backend(url, started, result):
+    status = str(result.status_code) if result is not None else "error"
+    metrics.BACKEND_SECONDS.observe(time.perf_counter() - started, httpx.URL(url).path, status)
+
+@tracing.traced("backend")
+def _post(url, data, config: RunnableConfig):
+    tracing.annotate(url = url)
+    started, result = time.perf_counter(), None
+    try:
+        result = _Tools.client.post(
+            url,
+            json = data,
+            headers = _auth_headers(config)
+        )
+    finally:
+        _observe_backend(url, started, result)
+    result.raise_for_status()
+    if not result.content:
+        return {}
+    return result.json()
+
+@tracing.traced("backend")
+async def _apost(url, data, config: RunnableConfig):
+    tracing.annotate(url = url)
+    started, result = time.perf_counter(), None
+    try:
+        result = await _Tools.async_client.post(
+            url,
+            json = data,
+            headers = _auth_headers(config)
+        )
+    finally:
+        _observe_backend(url, started, result)
     result.raise_for_status()
     if not result.content:
         return {}
     return result.json()
 
 
-def all(*, classifier_model: BaseChatModel):
+def all(
+    *,
+    classifier_model: BaseChatModel,
+    batched_resolver: bool = False,
+    resolver_rules: SearchTypeRules = None,
+    prompt_caching: bool = False
+):
 
-    search_type_resolver = SearchTypeResolver(classifier_model, ToolNames.ResolveSearchType)
+    search_type_resolver = SearchTypeResolver(
+        classifier_model,
+        ToolNames.ResolveSearchType,
+        batched = batched_resolver,
+        rules = resolver_rules,
+        prompt_caching = prompt_caching
+    )
 
     @tool(ToolNames.ResolveSearchType)
     def resolve_search_type(state: Annotated[State, InjectedState]) -> str:
         """Call to get the search type."""
         return search_type_resolver.process(state)
 
+    async def resolve_search_type_async(state: Annotated[State, InjectedState]) -> str:
+        return await search_type_resolver.aprocess(state)
+
+    resolve_search_type.coroutine = resolve_search_type_async
+
     return [
         reply,
         search_in_chats,
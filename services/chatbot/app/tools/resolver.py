@@ -1,10 +1,18 @@
+import json
+
 from langchain_core.language_models.chat_models import BaseChatModel
 from langchain_core.messages import SystemMessage, ToolMessage, HumanMessage
 
+from app import metrics
+from app.prompt_cache import cacheable_system_message
 from app.state import State
+from app.tools.resolver_rules import SearchTypeRules
+
+SEARCH_TYPES = ["PUBLIC", "PRIVATE", "GENERAL"]
+UNCERTAIN = "UNCERTAIN"
 
 class SearchTypeResolver:
-    type_of_search_prompt = '''As an expert in searching for information in chats, you follow a clear process to identify the target search area.
+    _search_areas_prompt = '''As an expert in searching for information in chats, you follow a clear process to identify the target search area.
     Depending on your answer, the search process runs through different subsets of chats, so the answer is critical.
     There are three possible search areas:
     * PUBLIC - search in the publicly available chats
@@ -19,33 +27,145 @@ class SearchTypeResolver:
     * In all other cases when user's message is unrelated to chats the search area is UNCERTAIN
     Important:
     * Every user message in the list redefines search area unless search area is UNCERTAIN.
-    * Return only one word in the output (PUBLIC, PRIVATE, GENERAL or UNCERTAIN).
+'''
+    type_of_search_prompt = _search_areas_prompt + '''    * Return only one word in the output (PUBLIC, PRIVATE, GENERAL or UNCERTAIN).
+    '''
+    batch_type_of_search_prompt = _search_areas_prompt + '''    * You are given several user messages, each one starts with its number in square brackets.
+    * Classify every message on its own.
+    * Return only a JSON object with the message numbers as keys and one value (PUBLIC, PRIVATE, GENERAL or UNCERTAIN) per message,
+      e.g. {"1": "UNCERTAIN", "2": "PUBLIC"}.
     '''
 
-    def __init__(self, model: BaseChatModel, tool_name: str):
+    def __init__(
+        self,
+        model: BaseChatModel,
+        tool_name: str,
+        *,
+        batched: bool = False,
+        rules: SearchTypeRules = None,
+        prompt_caching: bool = False
+    ):
+        """
+        Args:
+            batched: Classify all pending messages with a single model call.
+                Falls back to a call per message if the response can't be parsed
+                or doesn't answer exactly the numbers of the messages.
+                Note: A single pending message, the usual case, is classified with
+                the per message prompt, it is shorter and takes one call too.
+            rules: Fast path for explicit phrases. Only messages the rules
+                can't answer are sent to the model.
+            prompt_caching: Mark system prompts as cacheable by the provider.
+        """
         self.model = model
         self.tool_name = tool_name
+        self.batched = batched
+        self.rules = rules
+        self.prompt_caching = prompt_caching
 
     def process(self, state: State):
-        stack = list()
-        search_type = state.search_type if state.search_type else "GENERAL"
-        for message in reversed(state.messages):
-            if isinstance(message, HumanMessage):
-                stack.append(message)
-            elif isinstance(message, ToolMessage) and message.name==self.tool_name and message.status=="success":
-                break
+        search_type, stack = self._fast_path(*self._pending(state))
+        if self.batched and len(stack) > 1:
+            response = self.model.invoke(self._batch_input(stack))
+            resolved = self._parse_batch(response.content, len(stack))
+            if resolved is not None:
+                return self._effective(search_type, resolved)
 
-        system_message = [SystemMessage(content=self.type_of_search_prompt)]
+        system_message = [self._system_message(self.type_of_search_prompt)]
         while stack:
             message = stack.pop()
             response = self.model.invoke(system_message + [message])
-            if response.content in ["PUBLIC", "PRIVATE", "GENERAL"]:
+            if response.content in SEARCH_TYPES:
+                search_type = response.content
+
+        return search_type
+
+    async def aprocess(self, state: State):
+        search_type, stack = self._fast_path(*self._pending(state))
+        if self.batched and len(stack) > 1:
+            response = await self.model.ainvoke(self._batch_input(stack))
+            resolved = self._parse_batch(response.content, len(stack))
+            if resolved is not None:
+                return self._effective(search_type, resolved)
+
+        system_message = [self._system_message(self.type_of_search_prompt)]
+        while stack:
+            message = stack.pop()
+            response = await self.model.ainvoke(system_message + [message])
+            if response.content in SEARCH_TYPES:
                 search_type = response.content
 
         return search_type
 
+    def _pending(self, state: State):
+        search_type = state.search_type if state.search_type else "GENERAL"
+        # User messages after the last successful resolution
+        resolved = next(
+            (m for m in state.messages.tool_messages(self.tool_name) if m.status=="success"),
+            None
+        )
+        since = state.messages.seq_of(resolved) if resolved is not None else None
+        stack = [m for m in reversed(state.messages.since(since)) if isinstance(m, HumanMessage)]
+        return search_type, stack
+
+    def _fast_path(self, search_type, stack):
+        if self.rules is not None:
+            # The latest message answered by the rules overrides all the previous ones,
+            # so only the messages after it have to go to the model.
+            for i, message in enumerate(stack):
+                resolved = self.rules.classify(message.content)
+                if resolved is not None:
+                    # Note: Including the messages made irrelevant by this one
+                    metrics.SEARCH_TYPE_RESOLUTIONS.inc("fast_path", amount = len(stack) - i)
+                    search_type = resolved
+                    stack = stack[:i]
+                    break
+        if stack:
+            metrics.SEARCH_TYPE_RESOLUTIONS.inc("model", amount = len(stack))
+        return search_type, stack
+
+    def _batch_input(self, stack):
+        # Note: stack holds the latest message first
+        numbered = "\n".join(
+            f"[{i}] {message.content}" for i, message in enumerate(reversed(stack), start=1)
+        )
+        return [
+            self._system_message(self.batch_type_of_search_prompt),
+            HumanMessage(content=numbered)
+        ]
+
+    def _system_message(self, prompt):
+        if self.prompt_caching:
+            return cacheable_system_message(prompt)
+        return SystemMessage(content=prompt)
+
+    @staticmethod
+    def _parse_batch(content, count):
+        """Types of the messages in order, None if the response isn't a complete answer."""
+        if not isinstance(content, str):
+            return None
+        start = content.find("{")
+        end = content.rfind("}")
+        if start < 0 or end < start:
+            return None
+        try:
+            answers = json.loads(content[start:end + 1])
+        except ValueError:
+            return None
+        if not isinstance(answers, dict) or set(answers) != {str(i) for i in range(1, count + 1)}:
+            return None
+        resolved = [answers[str(i)] for i in range(1, count + 1)]
+        if any(value not in SEARCH_TYPES and value != UNCERTAIN for value in resolved):
+            return None
+        return resolved
+
+    @staticmethod
+    def _effective(search_type, resolved):
+        for value in resolved:
+            if value in SEARCH_TYPES:
+                search_type = value
+        return search_type
+
     @staticmethod
     def try_update_state(state: State, message: ToolMessage, tool_name: str):
         if message.name==tool_name and message.status=="success":
             state.search_type = message.content
-
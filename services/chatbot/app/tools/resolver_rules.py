@@ -0,0 +1,68 @@
+import json
+import re
+from typing import Mapping, Optional, Sequence
+
+# Search type -> patterns. A pattern matches anywhere in the message, case insensitive.
+# "DEFER" patterns make the message ambiguous, e.g. negations, so it goes to the model.
+DEFAULT_RULES = {
+    "DEFER": [
+        r"\b(not|no|don'?t|never|except|excluding|without|instead)\b",
+        r"\b(не|нет|кроме|без|вместо)\b",
+    ],
+    "GENERAL": [
+        r"\b(all|any|every)\s+(the\s+)?chats\b",
+        r"\beverywhere\b",
+        r"\bstart\s+(it\s+|the\s+search\s+)?(over|again|from\s+scratch)\b",
+        r"\breset\b",
+        r"\bвезде\b",
+        r"\bво\s+всех\s+чатах\b",
+        r"\b(начн(ем|и|ём)|начать)\s+(поиск\s+)?(заново|сначала|с\s+начала)\b",
+        r"\bсброс\w*\b",
+    ],
+    "PUBLIC": [
+        r"\bpublic\s+(chats?|channels?|groups?)\b",
+        r"\bпубличн\w*\s+(чат|канал|групп)\w*\b",
+        r"\bоткрыт\w*\s+(чат|канал|групп)\w*\b",
+    ],
+    "PRIVATE": [
+        r"\b(my|private|own)\s+(chats?|channels?|groups?)\b",
+        r"\bchats\s+i('?m|\s+am)\s+(in|a\s+member\s+of)\b",
+        r"\b(мои[хм]?|приватн\w*|личн\w*)\s+(чат|канал|групп)\w*\b",
+    ],
+}
+
+DEFER = "DEFER"
+
+
+class SearchTypeRules:
+    """Deterministic pre-classifier for explicit search area phrases.
+
+    Answers only when exactly one search type matches and nothing
+    makes the message ambiguous. Otherwise returns None,
+    so the message is classified by the model.
+    """
+
+    def __init__(self, table: Mapping[str, Sequence[str]] = DEFAULT_RULES):
+        self.defer = [re.compile(p, re.IGNORECASE) for p in table.get(DEFER, [])]
+        self.rules = {
+            search_type: [re.compile(p, re.IGNORECASE) for p in patterns]
+            for search_type, patterns in table.items()
+            if search_type != DEFER
+        }
+
+    @classmethod
+    def from_file(cls, path: str) -> "SearchTypeRules":
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def classify(self, text) -> Optional[str]:
+        if not isinstance(text, str):
+            return None
+        if any(p.search(text) for p in self.defer):
+            return None
+        matched = [
+            search_type
+            for search_type, patterns in self.rules.items()
+            if any(p.search(text) for p in patterns)
+        ]
+        return matched[0] if len(matched) == 1 else None
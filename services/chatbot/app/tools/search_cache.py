@@ -0,0 +1,115 @@
+import asyncio
+import hashlib
+import re
+import threading
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+from app import metrics
+from app.cache.lru import TtlLru
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+
+
+class SearchCache:
+    """Short-lived cache of search results with single-flight requests.
+
+    Entries are keyed by the principal (a hash of the UserId and ConversationId claims),
+    the conversation, the normalized text and the search type.
+    Note: Not by the token, the backend signs a new one with a new expiration for every turn.
+    Concurrent identical requests share a single backend call.
+    Failed calls are not cached.
+
+    Args:
+        max_entries: Max number of cached results.
+        ttl: Seconds a result is reused.
+    """
+
+    def __init__(self, *, max_entries: int, ttl: float):
+        self.results = TtlLru(max_entries = max_entries, ttl = ttl)
+        self._lock = threading.Lock()
+        self._flights: dict[Hashable, _Flight] = {}
+        self._aflights: dict[Hashable, asyncio.Future] = {}
+
+    @staticmethod
+    def key(user_id: Optional[str], thread_id: Optional[str], text: str, search_type: str) -> tuple:
+        principal = hashlib.sha256(f"{user_id}\n{thread_id}".encode("utf-8")).hexdigest() if user_id else ""
+        normalized = _WHITESPACE.sub(" ", text).strip().casefold()
+        return (principal, thread_id, normalized, search_type)
+
+    def get_or_fetch(self, key: tuple, fetch: Callable[[], Any]) -> Any:
+        with self._lock:
+            result = self.results.get(key)
+            if result is not None:
+                metrics.SEARCH_CACHE_REQUESTS.inc("hit")
+                return result
+            flight = self._flights.get(key)
+            is_leader = flight is None
+            if is_leader:
+                metrics.SEARCH_CACHE_REQUESTS.inc("miss")
+                flight = self._flights[key] = _Flight()
+            else:
+                metrics.SEARCH_CACHE_REQUESTS.inc("joined")
+        if not is_leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        try:
+            flight.result = fetch()
+            self.results.set(key, flight.result)
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    async def aget_or_fetch(self, key: tuple, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        # Note: Runs on the event loop only, so no locking is needed
+        while True:
+            result = self.results.get(key)
+            if result is not None:
+                metrics.SEARCH_CACHE_REQUESTS.inc("hit")
+                return result
+            flight = self._aflights.get(key)
+            if flight is None:
+                break
+            metrics.SEARCH_CACHE_REQUESTS.inc("joined")
+            try:
+                # Cancellation of a waiting request must not cancel the shared one
+                return await asyncio.shield(flight)
+            except asyncio.CancelledError:
+                if not flight.cancelled():
+                    raise
+                # The shared request was cancelled, not this one: try again
+
+        metrics.SEARCH_CACHE_REQUESTS.inc("miss")
+        flight = self._aflights[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await fetch()
+            self.results.set(key, result)
+            flight.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            flight.cancel()
+            raise
+        except Exception as e:
+            flight.set_exception(e)
+            # Marks the exception as retrieved if nobody waits for it
+            flight.exception()
+            raise
+        finally:
+            del self._aflights[key]
+
+    def invalidate(self, thread_id: Optional[str]) -> int:
+        """Drops all results of the conversation."""
+        return self.results.discard_if(lambda key: key[1] == thread_id)
@@ -0,0 +1,46 @@
+import json
+from typing import Any, Optional
+
+from langchain_core.messages import ToolMessage
+
+from app.state import SearchResult, State
+
+# Enough for the agent and the user to recognize a result
+MAX_SNIPPET_LENGTH = 300
+
+def _into_result(item: Any) -> Optional[SearchResult]:
+    if not isinstance(item, dict) or not item.get("link", None):
+        return None
+    # Note: See SearchQueryDocumentResult in SearchToolsController.cs
+    ranked = item.get("document", None) or {}
+    document = ranked.get("document", None) or {}
+    entries = (document.get("metadata", None) or {}).get("chatEntries", None) or []
+    entry_id = entries[0].get("id", None) if entries and isinstance(entries[0], dict) else None
+    text = document.get("text", None)
+    return SearchResult(
+        link = item["link"],
+        id = str(entry_id) if entry_id is not None else None,
+        score = ranked.get("rank", None),
+        snippet = text[:MAX_SNIPPET_LENGTH] if isinstance(text, str) else None
+    )
+
+def parse_search_results(content) -> list[SearchResult]:
+    """Parses search_in_chats tool message content."""
+    if isinstance(content, str):
+        try:
+            content = json.loads(content) if content else []
+        except ValueError:
+            return []
+    if not isinstance(content, list):
+        return []
+    return [result for result in map(_into_result, content) if result is not None]
+
+
+class SearchResultsHandler:
+    @staticmethod
+    def try_update_state(state: State, message: ToolMessage, tool_name: str):
+        if message.name == tool_name:
+            if message.status == "success":
+                state.last_search_results = parse_search_results(message.content)
+            else:
+                state.last_search_results = []
@@ -0,0 +1,414 @@
+import asyncio
+import datetime
+import functools
+import inspect
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Optional, Sequence
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Share of turns exported. Turns with errors are exported regardless.
+SAMPLE_RATE = float(os.getenv("BOT_TRACE_SAMPLE_RATE", default = "0.1"))
+# none, jsonl or langfuse. Defaults to langfuse if it is configured.
+EXPORTER = os.getenv("BOT_TRACE_EXPORTER", default = "")
+JSONL_PATH = os.getenv("BOT_TRACE_JSONL_PATH", default = "traces.jsonl")
+# Finished traces waiting for export, new ones are dropped when it is full
+QUEUE_SIZE = int(os.getenv("BOT_TRACE_QUEUE_SIZE", default = "1000"))
+BATCH_SIZE = int(os.getenv("BOT_TRACE_BATCH_SIZE", default = "50"))
+FLUSH_INTERVAL = float(os.getenv("BOT_TRACE_FLUSH_INTERVAL", default = "1"))
+
+
+class Span:
+    """Span of a trace. A light span keeps only its timing and error, not its attributes."""
+
+    __slots__ = ("name", "span_id", "parent_id", "start_time", "_started", "duration", "error", "attributes", "light")
+
+    def __init__(self, name: str, parent_id: Optional[str], attributes: dict, light: bool = False):
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.start_time = time.time()
+        self._started = time.perf_counter()
+        self.duration: Optional[float] = None
+        self.error: Optional[str] = None
+        self.attributes = attributes if not light else {}
+        self.light = light
+
+    def end(self, error: Optional[BaseException] = None):
+        if self.duration is not None:
+            return
+        self.duration = time.perf_counter() - self._started
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+
+    def set(self, **attributes):
+        if not self.light:
+            self.attributes.update(attributes)
+
+
+class Trace:
+    """Spans of one unit of work, e.g. a turn. Kept in memory until the trace ends.
+
+    Spans of a trace which isn't sampled are light until an error occurs, the trace
+    is exported then with the timings of all spans and the attributes of the later ones.
+    """
+
+    def __init__(self, name: str, sampled: bool, attributes: dict):
+        self.trace_id = uuid.uuid4().hex
+        self.sampled = sampled
+        self.has_errors = False
+        self.spans: list[Span] = []
+        # Note: The root attributes identify the trace, they are kept in any case
+        self.root = Span(name, None, attributes)
+        self.spans.append(self.root)
+
+    def start_span(self, name: str, parent: Optional[Span], attributes: dict) -> Span:
+        span = Span(
+            name,
+            parent.span_id if parent is not None else None,
+            attributes,
+            light = not (self.sampled or self.has_errors)
+        )
+        self.spans.append(span)
+        return span
+
+    def end_span(self, span: Span, error: Optional[BaseException] = None):
+        span.end(error)
+        if span.error is not None:
+            self.has_errors = True
+
+
+_current: ContextVar[Optional[tuple[Trace, Span]]] = ContextVar("trace", default = None)
+
+
+class JsonlExporter:
+    """Appends spans to a local file, one JSON object per line."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def export(self, traces: Sequence[Trace]):
+        with open(self.path, "a", encoding = "utf-8") as f:
+            for trace in traces:
+                for span in trace.spans:
+                    f.write(json.dumps({
+                        "trace_id": trace.trace_id,
+                        "span_id": span.span_id,
+                        "parent_id": span.parent_id,
+                        "name": span.name,
+                        "start_time": span.start_time,
+                        "duration_ms": round((span.duration or 0) * 1000, 3),
+                        "error": span.error,
+                        "attributes": span.attributes,
+                    }, default = str) + "\n")
+
+
+class LangfuseExporter:
+    """Sends traces to Langfuse. Its client batches the events on its own thread too."""
+
+    def __init__(self, langfuse):
+        self.langfuse = langfuse
+
+    def export(self, traces: Sequence[Trace]):
+        for trace in traces:
+            root = trace.root
+            lf_trace = self.langfuse.trace(
+                id = trace.trace_id,
+                name = root.name,
+                session_id = root.attributes.get("thread_id", None),
+                metadata = root.attributes,
+                timestamp = _datetime(root.start_time),
+            )
+            for span in trace.spans[1:]:
+                lf_trace.span(
+                    id = span.span_id,
+                    parent_observation_id = span.parent_id if span.parent_id != root.span_id else None,
+                    name = span.name,
+                    start_time = _datetime(span.start_time),
+                    end_time = _datetime(span.start_time + (span.duration or 0)),
+                    metadata = span.attributes,
+                    level = "ERROR" if span.error is not None else span.attributes.get("level", None),
+                    status_message = span.error,
+                )
+
+def _datetime(timestamp: float) -> datetime.datetime:
+    return datetime.datetime.fromtimestamp(timestamp, tz = datetime.timezone.utc)
+
+
+class Tracer:
+    """Records traces and exports them in batches on a background thread.
+
+    The sampling decision is made when a trace starts. Traces which aren't sampled
+    record light spans only, so that a trace with an error is still exported.
+    See Trace.
+    Finished traces go to a bounded queue. If the exporter can't keep up,
+    new traces are dropped and counted instead of slowing down requests.
+
+    Args:
+        exporter: Object with `export(traces)`. None disables tracing.
+        sample_rate: Share of traces exported, 0..1.
+    """
+
+    def __init__(
+        self,
+        exporter = None,
+        *,
+        sample_rate: float = 1.0,
+        queue_size: int = 1000,
+        batch_size: int = 50,
+        flush_interval: float = 1.0
+    ):
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: queue.Queue[Optional[Trace]] = queue.Queue(maxsize = queue_size)
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.exporter is not None
+
+    @contextmanager
+    def trace(self, name: str, **attributes):
+        """Starts a trace and makes it current. Yields None if tracing is disabled."""
+        if not self.enabled:
+            yield None
+            return
+        metrics.TRACES.inc("started")
+        trace = Trace(name, random.random() < self.sample_rate, attributes)
+        token = _current.set((trace, trace.root))
+        error = None
+        try:
+            yield trace
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            _current.reset(token)
+            trace.end_span(trace.root, error)
+            self.submit(trace)
+
+    def submit(self, trace: Trace):
+        if trace.sampled:
+            metrics.TRACES.inc("sampled")
+        elif trace.has_errors:
+            # Not sampled by the rate, but exported because of an error
+            metrics.TRACES.inc("sampled_on_error")
+        else:
+            return
+        try:
+            self._queue.put_nowait(trace)
+        except queue.Full:
+            metrics.TRACE_SPANS.inc("dropped", amount = len(trace.spans))
+
+    def start(self):
+        if not self.enabled or self._thread is not None:
+            return
+        self._thread = threading.Thread(target = self._run, name = "trace-export", daemon = True)
+        self._thread.start()
+
+    def stop(self):
+        """Exports the queued traces and stops the export thread."""
+        if self._thread is None:
+            return
+        # Note: The sentinel may wait for a free slot, the export thread frees them
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        stopped = False
+        while not stopped:
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    trace = self._queue.get(timeout = max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if trace is None:
+                    stopped = True
+                    break
+                batch.append(trace)
+            if batch:
+                self._export(batch)
+
+    def _export(self, batch: list[Trace]):
+        spans = sum(len(trace.spans) for trace in batch)
+        try:
+            self.exporter.export(batch)
+            metrics.TRACE_SPANS.inc("exported", amount = spans)
+        except Exception:
+            metrics.TRACE_EXPORT_ERRORS.inc()
+            metrics.TRACE_SPANS.inc("dropped", amount = spans)
+            logger.exception("Failed to export %d traces", len(batch))
+
+
+tracer = Tracer()
+
+
+def init(exporter, *, sample_rate: float = SAMPLE_RATE):
+    global tracer
+    tracer = Tracer(
+        exporter,
+        sample_rate = sample_rate,
+        queue_size = QUEUE_SIZE,
+        batch_size = BATCH_SIZE,
+        flush_interval = FLUSH_INTERVAL
+    )
+    return tracer
+
+
+def create_exporter(langfuse = None):
+    kind = (EXPORTER or ("langfuse" if langfuse is not None else "none")).lower()
+    if kind == "jsonl":
+        return JsonlExporter(JSONL_PATH)
+    if kind == "langfuse":
+        if langfuse is None:
+            logger.warning("Langfuse trace exporter is set, but Langfuse isn't configured")
+            return None
+        return LangfuseExporter(langfuse)
+    return None
+
+
+def trace(name: str, **attributes):
+    return tracer.trace(name, **attributes)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Child span of the current one. Does nothing outside of a trace."""
+    current = _current.get()
+    if current is None:
+        yield None
+        return
+    trace, parent = current
+    span = trace.start_span(name, parent, attributes)
+    token = _current.set((trace, span))
+    error = None
+    try:
+        yield span
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        _current.reset(token)
+        trace.end_span(span, error)
+
+
+def traced(name: Optional[str] = None):
+    """Decorator recording calls of a sync or async function as spans."""
+    def decorator(func):
+        span_name = name or func.__name__
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def annotate(**attributes):
+    """Adds attributes to the current span, e.g. level="WARNING"."""
+    current = _current.get()
+    if current is not None:
+        current[1].set(**attributes)
+
+
+class TracingCallback(BaseCallbackHandler):
+    """Records graph nodes and model calls of a run as spans of the trace."""
+
+    # Note: Called in the caller's thread, so no executor hop per event
+    run_inline = True
+
+    def __init__(self, trace: Trace):
+        self.trace = trace
+        # run id -> span of the run or of its nearest recorded ancestor
+        self._spans: dict[UUID, Span] = {}
+        self._own: set[UUID] = set()
+
+    def _parent(self, parent_run_id: Optional[UUID]) -> Span:
+        return self._spans.get(parent_run_id, self.trace.root) if parent_run_id else self.trace.root
+
+    def _start(self, name: str, run_id: UUID, parent_run_id: Optional[UUID], **attributes):
+        self._spans[run_id] = self.trace.start_span(name, self._parent(parent_run_id), attributes)
+        self._own.add(run_id)
+
+    def _end(self, run_id: UUID, error: Optional[BaseException] = None) -> Optional[Span]:
+        span = self._spans.pop(run_id, None)
+        if run_id not in self._own:
+            return None
+        self._own.discard(run_id)
+        self.trace.end_span(span, error)
+        return span
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id = None, metadata = None, **kwargs):
+        node = (metadata or {}).get("langgraph_node", None)
+        # Note: Internal nodes like __start__ only move the input
+        if node is not None and kwargs.get("name", None) == node and not node.startswith("__"):
+            self._start(node, run_id, parent_run_id)
+        else:
+            self._spans[run_id] = self._parent(parent_run_id)
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        # Note: LangGraph interrupts and control flow exceptions are not errors
+        self._end(run_id, error if not _is_control_flow(error) else None)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id = None, metadata = None, **kwargs):
+        model = (metadata or {}).get("ls_model_name", None)
+        self._start("model", run_id, parent_run_id, model = model)
+
+    def on_llm_end(self, response: LLMResult, *, run_id, **kwargs):
+        span = self._end(run_id)
+        if span is None or span.light:
+            return
+        for generations in response.generations:
+            for generation in generations:
+                message = getattr(generation, "message", None)
+                if message is not None:
+                    usage = message.response_metadata.get("usage", None)
+                    if usage:
+                        span.set(usage = dict(usage))
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        # Note: The losing call of a hedged request is cancelled, that is not an error
+        if isinstance(error, asyncio.CancelledError):
+            span = self._end(run_id)
+            if span is not None:
+                span.set(cancelled = True)
+            return
+        self._end(run_id, error)
+
+
+def _is_control_flow(error: BaseException) -> bool:
+    return type(error).__name__ in ("GraphInterrupt", "NodeInterrupt", "ParentCommand")
+
+
+def callbacks(trace: Optional[Trace]) -> list:
+    return [TracingCallback(trace)] if trace is not None else []
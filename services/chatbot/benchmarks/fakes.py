@@ -0,0 +1,146 @@
+"""Offline stand-ins for the model provider and the bot tools backend."""
+import asyncio
+import itertools
+import socket
+import threading
+import time
+from typing import Any, Optional
+
+import uvicorn
+from fastapi import FastAPI, Request
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+# Note: Doesn't import app, so that it can replace the model class before app is imported
+_call_ids = itertools.count(1)
+
+
+class ScriptedChatModel(BaseChatModel):
+    """Deterministic chat model with a fixed latency.
+
+    With tools bound it plays the agent, a turn is:
+    user message -> search_in_chats -> forward_search_results -> text answer.
+    Without tools it answers the search type resolver and summarization prompts.
+    Accepts the ChatAnthropic arguments chain.create passes.
+    """
+
+    model: str = "scripted"
+    api_key: Optional[Any] = None
+    default_headers: Optional[dict] = None
+    latency: float = 0.0
+    output_tokens: int = 30
+    tool_names: tuple = ()
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted"
+
+    def bind_tools(self, tools, **kwargs):
+        names = tuple(tool["name"] if isinstance(tool, dict) else tool.name for tool in tools)
+        return self.model_copy(update = {"tool_names": names})
+
+    def _respond(self, messages: list[BaseMessage]) -> AIMessage:
+        usage = {"input_tokens": sum(len(str(m.content)) for m in messages) // 3, "output_tokens": self.output_tokens}
+        last = messages[-1]
+        if not self.tool_names:
+            text = "GENERAL" if "PUBLIC" in str(messages[0].content) else "Summary of the conversation so far."
+            return AIMessage(content = text, response_metadata = {"usage": usage})
+
+        if isinstance(last, HumanMessage):
+            name, args = "search_in_chats", {"text": str(last.content), "search_type": "PUBLIC"}
+        elif isinstance(last, ToolMessage) and last.name == "search_in_chats":
+            name, args = "forward_search_results", {"comment": "Here is what I found."}
+        else:
+            return AIMessage(content = "Let me know if you need anything else.", response_metadata = {"usage": usage})
+        call_id = f"call-{next(_call_ids)}"
+        return AIMessage(
+            # Same shape as ChatAnthropic, a message with tool calls only is never empty
+            content = [{"type": "tool_use", "id": call_id, "name": name, "input": args}],
+            tool_calls = [{"name": name, "args": args, "id": call_id}],
+            response_metadata = {"usage": usage}
+        )
+
+    def _generate(self, messages, stop = None, run_manager = None, **kwargs) -> ChatResult:
+        time.sleep(self.latency)
+        return ChatResult(generations = [ChatGeneration(message = self._respond(messages))])
+
+    async def _agenerate(self, messages, stop = None, run_manager = None, **kwargs) -> ChatResult:
+        await asyncio.sleep(self.latency)
+        return ChatResult(generations = [ChatGeneration(message = self._respond(messages))])
+
+
+def stub_backend(latency: float = 0.0) -> FastAPI:
+    """Bot tools backend with the endpoints the tools call."""
+    app = FastAPI()
+    app.state.requests = 0
+
+    @app.post("/api/bot/conversation/reply")
+    async def reply(request: Request):
+        app.state.requests += 1
+        await asyncio.sleep(latency)
+        return {"entryLocalId": app.state.requests}
+
+    @app.post("/api/bot/conversation/remove-reply")
+    async def remove_reply(request: Request):
+        app.state.requests += 1
+        await asyncio.sleep(latency)
+        return {}
+
+    @app.post("/api/bot/conversation/forward-chat-links")
+    async def forward_chat_links(request: Request):
+        app.state.requests += 1
+        await asyncio.sleep(latency)
+        return {}
+
+    @app.post("/api/bot/search/chats")
+    async def search_chats(request: Request):
+        app.state.requests += 1
+        body = await request.json()
+        await asyncio.sleep(latency)
+        return [
+            {
+                "link": f"https://actual.chat/chat/bench/{i}",
+                "document": {
+                    "rank": 1.0 / (i + 1),
+                    "document": {
+                        "text": f"{body['text']} result {i}",
+                        "metadata": {"chatEntries": [{"id": f"bench:0:{i}"}]}
+                    }
+                }
+            }
+            for i in range(5)
+        ]
+
+    return app
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class StubServer:
+    """Runs the stub backend on a local port in a background thread."""
+
+    def __init__(self, port: int, latency: float = 0.0):
+        self.port = port
+        self.url = f"http://127.0.0.1:{port}"
+        self.server = uvicorn.Server(uvicorn.Config(
+            stub_backend(latency),
+            host = "127.0.0.1",
+            port = port,
+            log_level = "warning"
+        ))
+        self._thread = threading.Thread(target = self.server.run, daemon = True)
+
+    def __enter__(self):
+        self._thread.start()
+        while not self.server.started:
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc):
+        self.server.should_exit = True
+        self._thread.join()
@@ -0,0 +1,181 @@
+"""Load test of the service: concurrent conversations against the FastAPI app.
+
+Runs offline: the model is scripted (see fakes.py), the bot tools backend is a local
+stub server and requests go to the app in process through the ASGI transport.
+Context tokens are signed and verified like in production.
+
+    python benchmarks/load_test.py [--conversations 200] [--concurrency 20] [--turns 3]
+        [--model-latency 0.05] [--backend-latency 0.01] [--output results.json]
+"""
+import argparse
+import asyncio
+import datetime
+import functools
+import json
+import os
+import platform
+import resource
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+import jwt
+import langchain_anthropic
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+
+from benchmarks.fakes import ScriptedChatModel, StubServer, free_port
+
+AUDIENCE = "bot-tools.actual.chat"
+ISSUER = "integrations.actual.chat"
+
+
+def _signing_key(directory: str):
+    """Signing key and the certificate file the service verifies tokens with."""
+    key = ec.generate_private_key(ec.SECP384R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, ISSUER)])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now)
+        .not_valid_after(now + datetime.timedelta(days = 1))
+        .sign(key, hashes.SHA384())
+    )
+    path = os.path.join(directory, "bench.crt")
+    with open(path, "wb") as f:
+        f.write(certificate.public_bytes(serialization.Encoding.PEM))
+    return key, path
+
+
+def _token(key, conversation_id: str) -> str:
+    return jwt.encode(
+        {
+            "ConversationId": conversation_id,
+            "UserId": "bench",
+            "aud": AUDIENCE,
+            "iss": ISSUER,
+            "exp": int(time.time()) + 3600,
+        },
+        key,
+        algorithm = "ES384"
+    )
+
+
+def rss_bytes() -> int:
+    """Current resident set size, the peak one if /proc isn't available."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+async def _run(args, key) -> dict:
+    from app import server
+
+    transport = httpx.ASGITransport(app = server.app)
+    async with httpx.AsyncClient(transport = transport, base_url = "http://chatbot", timeout = 60) as client:
+        durations = []
+        errors = 0
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def conversation(i):
+            nonlocal errors
+            headers = {
+                "Authorization": f"Bearer {_token(key, f'bench-{i}')}",
+                "X-Bot-Response-Mode": "status",
+            }
+            async with semaphore:
+                for turn in range(args.turns):
+                    started = time.perf_counter()
+                    response = await client.post(
+                        "/invoke",
+                        json = {"input": f"find messages about topic {i}.{turn}", "config": {}},
+                        headers = headers
+                    )
+                    durations.append(time.perf_counter() - started)
+                    if response.status_code != 200:
+                        errors += 1
+
+        # Warm up: first calls import and compile lazily
+        await conversation(-1)
+        durations.clear()
+        rss_before = rss_bytes()
+        started = time.perf_counter()
+        await asyncio.gather(*(conversation(i) for i in range(args.conversations)))
+        elapsed = time.perf_counter() - started
+        rss_after = rss_bytes()
+
+    await server.tools._Tools.aclose()
+    return {
+        "conversations": args.conversations,
+        "turns": len(durations),
+        "errors": errors,
+        "seconds": elapsed,
+        "turns_per_second": len(durations) / elapsed,
+        "latency_ms": {
+            "p50": statistics.median(durations) * 1000,
+            "p95": percentile(durations, 95) * 1000,
+            "p99": percentile(durations, 99) * 1000,
+        },
+        "rss_mb": rss_after / 2**20,
+        "rss_growth_mb_per_1k_conversations": (rss_after - rss_before) / 2**20 / args.conversations * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.splitlines()[0])
+    parser.add_argument("--conversations", type = int, default = 200)
+    parser.add_argument("--concurrency", type = int, default = 20)
+    parser.add_argument("--turns", type = int, default = 3, help = "Turns per conversation")
+    parser.add_argument("--model-latency", type = float, default = 0.05, help = "Seconds per model call")
+    parser.add_argument("--backend-latency", type = float, default = 0.01, help = "Seconds per backend call")
+    parser.add_argument("--output", help = "JSON file to write the results to")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix = "chatbot-bench-")
+    key, certificate_path = _signing_key(directory)
+    port = free_port()
+    os.environ.update({
+        "BOT_TOOLS_BASE_URL": f"http://127.0.0.1:{port}",
+        "CLAUDE_API_KEY": "fake",
+        "BOT_JWT_KEYS_PATH": certificate_path,
+        "BOT_JWT_AUDIENCE": AUDIENCE,
+        "BOT_JWT_ISSUER": ISSUER,
+        "BOT_LLM_CACHE": "false",
+        "BOT_STREAM_REPLIES": "false",
+        "BOT_TRACE_EXPORTER": "none",
+    })
+    # Note: chain.create takes the model class as a default argument,
+    # so it has to be replaced before app is imported.
+    langchain_anthropic.ChatAnthropic = functools.partial(ScriptedChatModel, latency = args.model_latency)
+
+    with StubServer(port, latency = args.backend_latency):
+        results = asyncio.run(_run(args, key))
+    results["parameters"] = vars(args)
+    results["python"] = platform.python_version()
+
+    print(json.dumps(results, indent = 2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent = 2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""Microbenchmarks of the State message log vs plain list with add_messages.
+
+    python benchmarks/message_log.py [--sizes 10 1000 10000]
+"""
+import argparse
+import os
+import sys
+import timeit
+from itertools import takewhile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langgraph.graph import add_messages
+
+from app.state import State, reduce_list
+
+RESOLVER = "resolvesearchtype"
+
+
+def _history(size: int) -> list:
+    messages = []
+    for i in range(size // 4 + 1):
+        messages += [
+            HumanMessage(content=f"find {i}", id=f"h{i}"),
+            AIMessage(content="", tool_calls=[{"name": RESOLVER, "args": {}, "id": f"c{i}"}], id=f"a{i}"),
+            ToolMessage(content="PUBLIC", tool_call_id=f"c{i}", name=RESOLVER, id=f"t{i}"),
+            AIMessage(content=f"found {i}", id=f"r{i}"),
+        ]
+    return messages[:size]
+
+
+def _list_append(messages):
+    message = AIMessage(content="new")
+    return lambda: add_messages(messages, [message])
+
+def _log_append(log):
+    message = AIMessage(content="new")
+    return lambda: reduce_list(log, [message])
+
+def _list_since(messages):
+    # What save_tool_results_to_state did: walk back to the last seen id,
+    # the worst case is a last seen message removed by summarization
+    return lambda: [m for m in takewhile(lambda m: m.id != "removed", reversed(messages)) if isinstance(m, ToolMessage)]
+
+def _log_since(log):
+    cursor = log.last_seq - 3
+    return lambda: [m for m in log.since(cursor) if isinstance(m, ToolMessage)]
+
+def _list_pending(messages):
+    # What SearchTypeResolver did: collect user messages back to the last resolution
+    def pending():
+        stack = []
+        for message in reversed(messages):
+            if isinstance(message, HumanMessage):
+                stack.append(message)
+            elif isinstance(message, ToolMessage) and message.name == RESOLVER and message.status == "success":
+                break
+        return stack
+    return pending
+
+def _log_pending(log):
+    def pending():
+        resolved = next((m for m in log.tool_messages(RESOLVER) if m.status == "success"), None)
+        since = log.seq_of(resolved) if resolved is not None else None
+        return [m for m in reversed(log.since(since)) if isinstance(m, HumanMessage)]
+    return pending
+
+def _lookup_list(messages):
+    target = messages[len(messages) // 2].id
+    return lambda: next(m for m in messages if m.id == target)
+
+def _lookup_log(log):
+    target = log[len(log) // 2].id
+    return lambda: log.get_by_id(target)
+
+
+CASES = [
+    ("append", _list_append, _log_append),
+    ("new since last seen", _list_since, _log_since),
+    ("resolver pending", _list_pending, _log_pending),
+    ("lookup by id", _lookup_list, _lookup_log),
+]
+
+
+def _measure(fn) -> float:
+    number, _ = timeit.Timer(fn).autorange()
+    best = min(timeit.Timer(fn).repeat(repeat = 3, number = number))
+    return best / number * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.splitlines()[0])
+    parser.add_argument("--sizes", type = int, nargs = "+", default = [10, 1000, 10000])
+    args = parser.parse_args()
+
+    print(f"{'case':<22}{'messages':>10}{'list, us':>12}{'log, us':>12}")
+    for size in args.sizes:
+        messages = _history(size)
+        log = State(messages = messages).messages
+        for name, list_case, log_case in CASES:
+            print(
+                f"{name:<22}{size:>10}"
+                f"{_measure(list_case(messages)):>12.2f}"
+                f"{_measure(log_case(log)):>12.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Microbenchmarks of the state hot paths, results are written as JSON.
+
+    python benchmarks/micro.py [--sizes 10 1000 10000] [--output micro.json]
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+
+from app.state import State, reduce_list
+from app.tools import ToolNames, save_tool_results_to_state
+from app.tools.resolver import SearchTypeResolver
+from app.tools.resolver_rules import SearchTypeRules
+from benchmarks.fakes import ScriptedChatModel
+
+RESOLVER = str(ToolNames.ResolveSearchType)
+SEARCH_RESULTS = json.dumps([
+    {
+        "link": f"https://actual.chat/chat/bench/{i}",
+        "document": {"rank": 1.0, "document": {"text": "result", "metadata": {"chatEntries": [{"id": f"e{i}"}]}}}
+    }
+    for i in range(5)
+])
+
+
+def _history(size: int) -> list:
+    messages = []
+    for i in range(size // 4 + 1):
+        messages += [
+            HumanMessage(content=f"find {i}", id=f"h{i}"),
+            AIMessage(content=[{"type": "tool_use"}], tool_calls=[{"name": RESOLVER, "args": {}, "id": f"c{i}"}], id=f"a{i}"),
+            ToolMessage(content="PUBLIC", tool_call_id=f"c{i}", name=RESOLVER, id=f"t{i}"),
+            AIMessage(content=f"found {i}", id=f"r{i}"),
+        ]
+    return messages[:size]
+
+
+def _reduce_list(size):
+    log = State(messages = _history(size)).messages
+    message = AIMessage(content="new")
+    return lambda: reduce_list(log, [message])
+
+def _save_tool_results(size):
+    # A turn with a search: only the new messages are processed
+    state = State(messages = _history(size))
+    state.messages.extend([
+        HumanMessage(content="find cats"),
+        ToolMessage(content=SEARCH_RESULTS, tool_call_id="s1", name="search_in_chats"),
+    ])
+    cursor = state.messages.last_seq - 2
+    def save():
+        state.last_seen_seq = cursor
+        save_tool_results_to_state(state)
+    return save
+
+def _resolver(size, rules):
+    state = State(messages = _history(size))
+    state.messages.append(HumanMessage(content="search in my chats please"))
+    resolver = SearchTypeResolver(ScriptedChatModel(), RESOLVER, rules = rules)
+    return lambda: resolver.process(state)
+
+
+CASES = [
+    ("reduce_list append", _reduce_list),
+    ("save_tool_results_to_state", _save_tool_results),
+    ("SearchTypeResolver.process fast path", lambda size: _resolver(size, SearchTypeRules())),
+    ("SearchTypeResolver.process model", lambda size: _resolver(size, None)),
+]
+
+
+def _measure(fn) -> float:
+    number, _ = timeit.Timer(fn).autorange()
+    best = min(timeit.Timer(fn).repeat(repeat = 3, number = number))
+    return best / number * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.splitlines()[0])
+    parser.add_argument("--sizes", type = int, nargs = "+", default = [10, 1000, 10000])
+    parser.add_argument("--output", help = "JSON file to write the results to")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'case':<40}{'messages':>10}{'us':>12}")
+    for size in args.sizes:
+        for name, case in CASES:
+            us = _measure(case(size))
+            results.append({"case": name, "messages": size, "us": us})
+            print(f"{name:<40}{size:>10}{us:>12.2f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"results": results, "python": platform.python_version()}, f, indent = 2)
+
+
+if __name__ == "__main__":
+    main()
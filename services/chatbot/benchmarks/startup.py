@@ -0,0 +1,145 @@
+"""Startup profile of the service: import time by module, time to serve and to get ready.
+
+Each run is a fresh interpreter started with -X importtime. The bot tools backend is a local
+stub server, no network access is needed. With budgets set, exits with 1 when one is exceeded,
+so CI catches startup regressions.
+
+    python benchmarks/startup.py [--runs 3] [--top 15] [--output startup.json]
+        [--max-import-seconds 3] [--max-ready-seconds 5]
+"""
+import argparse
+import collections
+import json
+import os
+import platform
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fakes import StubServer, free_port
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in the child process, prints the timings as JSON
+CHILD = """
+import json, time
+started = time.perf_counter()
+from app import server
+imported = time.perf_counter()
+from starlette.testclient import TestClient
+with TestClient(server.app) as client:
+    client.get("/healthz")
+    serving = time.perf_counter()
+    while client.get("/readyz").status_code != 200 and time.perf_counter() - serving < 60:
+        time.sleep(0.01)
+    ready = time.perf_counter()
+    report = client.get("/readyz").json()
+print(json.dumps({
+    "import_seconds": imported - started,
+    "serving_seconds": serving - started,
+    "ready_seconds": ready - started,
+    "readiness": report,
+}))
+"""
+
+
+def parse_importtime(stderr: str) -> list[dict]:
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        if not self_us.strip().isdigit():
+            # Header line
+            continue
+        modules.append({
+            "module": name.strip(),
+            "self_ms": int(self_us) / 1000,
+            "cumulative_ms": int(cumulative_us) / 1000,
+        })
+    return modules
+
+
+def run_once(env: dict) -> dict:
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", CHILD],
+        cwd = ROOT,
+        env = env,
+        capture_output = True,
+        text = True,
+        timeout = 120
+    )
+    if process.returncode != 0:
+        raise RuntimeError(f"Startup failed:\n{process.stderr[-4000:]}")
+    result = json.loads(process.stdout.strip().splitlines()[-1])
+    result["modules"] = parse_importtime(process.stderr)
+    return result
+
+
+def summarize(modules: list[dict], top: int) -> dict:
+    packages = collections.Counter()
+    for module in modules:
+        packages[module["module"].split(".")[0]] += module["self_ms"]
+    return {
+        "slowest_modules": sorted(modules, key = lambda m: m["self_ms"], reverse = True)[:top],
+        "packages_ms": {name: round(ms, 3) for name, ms in packages.most_common(top)},
+        "app_modules": sorted(
+            (m for m in modules if m["module"] == "app" or m["module"].startswith("app.")),
+            key = lambda m: m["cumulative_ms"],
+            reverse = True
+        )[:top],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.splitlines()[0])
+    parser.add_argument("--runs", type = int, default = 3, help = "The fastest run is reported")
+    parser.add_argument("--top", type = int, default = 15, help = "Modules and packages to list")
+    parser.add_argument("--max-import-seconds", type = float, help = "Budget of importing app.server")
+    parser.add_argument("--max-ready-seconds", type = float, help = "Budget of the time until /readyz passes")
+    parser.add_argument("--output", help = "JSON file to write the results to")
+    args = parser.parse_args()
+
+    port = free_port()
+    env = dict(
+        os.environ,
+        BOT_TOOLS_BASE_URL = f"http://127.0.0.1:{port}",
+        CLAUDE_API_KEY = os.environ.get("CLAUDE_API_KEY", "fake"),
+        BOT_TRACE_EXPORTER = "none",
+        BOT_PREWARM = "true",
+        BOT_JWT_VERIFY = "false",
+    )
+    env.pop("LANGFUSE_HOST", None)
+    with StubServer(port, latency = 0):
+        runs = [run_once(env) for _ in range(args.runs)]
+    best = min(runs, key = lambda r: r["import_seconds"])
+
+    results = {
+        "import_seconds": best["import_seconds"],
+        "serving_seconds": best["serving_seconds"],
+        "ready_seconds": min(r["ready_seconds"] for r in runs),
+        "readiness": best["readiness"],
+        **summarize(best["modules"], args.top),
+        "runs": args.runs,
+        "python": platform.python_version(),
+    }
+    print(json.dumps(results, indent = 2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent = 2)
+
+    exceeded = []
+    if args.max_import_seconds is not None and results["import_seconds"] > args.max_import_seconds:
+        exceeded.append(f"import took {results['import_seconds']:.2f}s > {args.max_import_seconds}s")
+    if args.max_ready_seconds is not None and results["ready_seconds"] > args.max_ready_seconds:
+        exceeded.append(f"getting ready took {results['ready_seconds']:.2f}s > {args.max_ready_seconds}s")
+    if not results["readiness"]["ready"]:
+        exceeded.append("the service didn't get ready")
+    if exceeded:
+        print("Startup budget exceeded: " + ", ".join(exceeded), file = sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""Turn latency of the chain with summarization within the turn vs in the background.
+
+Runs offline: models are fakes with a fixed latency and the backend is mocked.
+
+    python benchmarks/turn_latency.py [--turns 40] [--threads 4] [--latency 0.05]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Small context budget, so that most turns trigger summarization
+os.environ.setdefault("BOT_CONTEXT_MAX_TOKENS", "300")
+os.environ.setdefault("BOT_CONTEXT_KEEP_TOKENS", "100")
+os.environ.setdefault("BOT_TOOLS_BASE_URL", "http://backend")
+os.environ.setdefault("CLAUDE_API_KEY", "fake")
+os.environ.setdefault("BOT_LLM_CACHE", "false")
+os.environ.setdefault("BOT_STREAM_REPLIES", "false")
+
+import httpx
+from langchain_core.language_models.fake_chat_models import FakeMessagesListChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from app import chain, checkpoint
+from app.tools import _Tools
+
+
+class SlowFakeModel(FakeMessagesListChatModel):
+    latency: float = 0.05
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _result(self):
+        message = self.responses[self.i % len(self.responses)].model_copy(deep = True)
+        self.i += 1
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _generate(self, *args, **kwargs):
+        time.sleep(self.latency)
+        return self._result()
+
+    async def _agenerate(self, *args, **kwargs):
+        await asyncio.sleep(self.latency)
+        return self._result()
+
+
+def _agent_turn(i):
+    return [
+        AIMessage(
+            content=[{"type": "tool_use", "id": f"c{i}", "name": "search_in_chats", "input": {}}],
+            tool_calls=[{
+                "name": "search_in_chats",
+                "args": {"text": f"topic {i}", "search_type": "PUBLIC"},
+                "id": f"c{i}"
+            }]
+        ),
+        AIMessage(content="Here is what I found about the topic. " * 5),
+    ]
+
+
+def _backend(request: httpx.Request) -> httpx.Response:
+    if request.url.path.endswith("/search/chats"):
+        return httpx.Response(200, json=[{"link": f"chat-{i}"} for i in range(5)])
+    return httpx.Response(200, json={})
+
+
+def _mock_backend():
+    _Tools.init(base_url = os.environ["BOT_TOOLS_BASE_URL"])
+    transport = httpx.MockTransport(_backend)
+    _Tools.client = httpx.Client(transport = transport)
+    _Tools.async_client = httpx.AsyncClient(transport = transport)
+
+
+def _percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+async def _run(background: bool, *, turns: int, threads: int, latency: float) -> list[float]:
+    _mock_backend()
+    models = []
+    def chat_model(**kwargs):
+        if models:
+            responses = [response for i in range(turns) for response in _agent_turn(i)]
+        else:
+            responses = [AIMessage(content="Summary of the search session so far.")]
+        model = SlowFakeModel(responses = responses, latency = latency)
+        models.append(model)
+        return model
+
+    the_chain = chain.create(
+        claude_api_key = "fake",
+        checkpointer = checkpoint.create(),
+        chat_model = chat_model,
+        background_summarization = background
+    )
+
+    async def conversation(thread_id):
+        config = {"configurable": {"thread_id": thread_id}}
+        durations = []
+        for i in range(turns):
+            started = time.perf_counter()
+            await the_chain.ainvoke(f"find messages about topic {i}", config)
+            durations.append(time.perf_counter() - started)
+            # User think time, background summaries run meanwhile
+            await asyncio.sleep(latency * 2)
+        return durations
+
+    # Note: Conversations run one by one, so the agent responses don't interleave.
+    durations = []
+    for thread in range(threads):
+        durations += await conversation(f"thread-{thread}")
+    return durations
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.splitlines()[0])
+    parser.add_argument("--turns", type = int, default = 40)
+    parser.add_argument("--threads", type = int, default = 4)
+    parser.add_argument("--latency", type = float, default = 0.05, help = "Seconds per model call")
+    args = parser.parse_args()
+
+    print(f"{'mode':<12}{'turns':>8}{'p50, ms':>10}{'p99, ms':>10}")
+    for background in (False, True):
+        durations = asyncio.run(_run(
+            background,
+            turns = args.turns,
+            threads = args.threads,
+            latency = args.latency
+        ))
+        print(
+            f"{'background' if background else 'inline':<12}"
+            f"{len(durations):>8}"
+            f"{statistics.median(durations) * 1000:>10.1f}"
+            f"{_percentile(durations, 99) * 1000:>10.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
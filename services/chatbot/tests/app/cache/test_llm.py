@@ -0,0 +1,74 @@
+import asyncio
+
+from langchain_core.language_models.fake_chat_models import FakeListChatModel, FakeMessagesListChatModel
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+from app import metrics
+from app.cache import ModelCache, SqliteCacheTier
+
+def _messages(text):
+    return [SystemMessage(content="Classify"), HumanMessage(content=text)]
+
+def test_normalized_prompt_hits_memory():
+    model = FakeListChatModel(responses = ["PUBLIC", "PRIVATE"], cache = ModelCache())
+    hits = metrics.LLM_CACHE_LOOKUPS.value("memory_hit")
+
+    first = model.invoke(_messages("Search in public chats"))
+    second = model.invoke(_messages("  search in   PUBLIC chats "))
+    assert first.content == second.content == "PUBLIC"
+    assert first.id != second.id
+    assert model.i == 1
+    assert metrics.LLM_CACHE_LOOKUPS.value("memory_hit") - hits == 1
+
+    assert model.invoke(_messages("search in my chats")).content == "PRIVATE"
+
+def test_async_calls_are_cached():
+    model = FakeListChatModel(responses = ["PUBLIC", "PRIVATE"], cache = ModelCache())
+
+    async def run():
+        return [(await model.ainvoke(_messages("public"))).content for _ in range(3)]
+
+    assert asyncio.run(run()) == ["PUBLIC"] * 3
+    assert model.i == 1
+
+def test_cached_responses_dont_count_tokens():
+    usage = {"input_tokens": 100, "output_tokens": 10}
+    model = FakeMessagesListChatModel(
+        responses = [AIMessage(content = "PUBLIC", response_metadata = {"usage": usage})],
+        cache = ModelCache(),
+        callbacks = [metrics.TokenUsage("resolver")]
+    )
+    tokens = metrics.LLM_TOKENS.value("resolver", "input")
+    model.invoke(_messages("public"))
+    model.invoke(_messages("public"))
+    assert metrics.LLM_TOKENS.value("resolver", "input") - tokens == 100
+
+def test_disk_tier_survives_restart(tmp_path):
+    path = str(tmp_path / "llm-cache.sqlite")
+    model = FakeListChatModel(
+        responses = ["PUBLIC", "PRIVATE"],
+        cache = ModelCache(disk = SqliteCacheTier(path, max_bytes = 1024 * 1024))
+    )
+    model.invoke(_messages("public"))
+
+    disk_hits = metrics.LLM_CACHE_LOOKUPS.value("disk_hit")
+    restarted = FakeListChatModel(
+        responses = ["PUBLIC", "PRIVATE"],
+        cache = ModelCache(disk = SqliteCacheTier(path, max_bytes = 1024 * 1024))
+    )
+    restarted.i = 1 # The model would answer PRIVATE now
+    assert restarted.invoke(_messages("public")).content == "PUBLIC"
+    assert restarted.invoke(_messages("public")).content == "PUBLIC"
+    assert restarted.i == 1
+    assert metrics.LLM_CACHE_LOOKUPS.value("disk_hit") - disk_hits == 1
+
+def test_disk_tier_eviction(tmp_path):
+    tier = SqliteCacheTier(str(tmp_path / "llm-cache.sqlite"), max_bytes = 25)
+    for key in ["a", "b", "c"]:
+        tier.set(key, "0123456789")
+    assert tier.get("a") is None
+    assert tier.get("c") == "0123456789"
+
+    expiring = SqliteCacheTier(str(tmp_path / "expiring.sqlite"), max_bytes = 1024, ttl = 1e-9)
+    expiring.set("a", "value")
+    assert expiring.get("a") is None
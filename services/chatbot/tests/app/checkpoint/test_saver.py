@@ -0,0 +1,130 @@
+import asyncio
+import operator
+from typing import Annotated, TypedDict
+
+import pytest
+from langgraph.graph import StateGraph, START, END
+
+from app.checkpoint import BackendSaver, MemoryBackend, SqliteBackend, handoff
+
+
+class _State(TypedDict):
+    items: Annotated[list[str], operator.add]
+
+def _graph(checkpointer):
+    builder = StateGraph(_State)
+    builder.add_node("step", lambda state: {"items": ["step"]})
+    builder.add_edge(START, "step")
+    builder.add_edge("step", END)
+    return builder.compile(checkpointer = checkpointer)
+
+def _config(thread_id):
+    return {"configurable": {"thread_id": thread_id}}
+
+
+@pytest.fixture(params = ["memory", "sqlite", "sqlite-hot"])
+def saver_factory(request, tmp_path):
+    path = str(tmp_path / "checkpoints.sqlite")
+    match request.param:
+        case "memory":
+            backend = MemoryBackend()
+            return lambda: BackendSaver(backend)
+        case "sqlite":
+            return lambda: BackendSaver(SqliteBackend(path))
+        case "sqlite-hot":
+            return lambda: BackendSaver(SqliteBackend(path), hot_threads = 2)
+
+
+def test_state_survives_restart(saver_factory):
+    graph = _graph(saver_factory())
+    graph.invoke({"items": ["a"]}, _config("t1"))
+    graph.invoke({"items": ["b"]}, _config("t1"))
+
+    restarted = _graph(saver_factory())
+    assert restarted.get_state(_config("t1")).values["items"] == ["a", "step", "b", "step"]
+    assert restarted.get_state(_config("t2")).values == {}
+
+
+def test_async_and_history(saver_factory):
+    graph = _graph(saver_factory())
+
+    async def run():
+        for thread_id in ["t1", "t2", "t3"]:
+            await graph.ainvoke({"items": [thread_id]}, _config(thread_id))
+        return [
+            (await graph.aget_state(_config(thread_id))).values["items"]
+            for thread_id in ["t1", "t2", "t3"]
+        ]
+
+    assert asyncio.run(run()) == [["t1", "step"], ["t2", "step"], ["t3", "step"]]
+    history = list(graph.get_state_history(_config("t1")))
+    assert history[0].values["items"] == ["t1", "step"]
+    assert len(list(graph.get_state_history(_config("t1"), limit = 2))) == 2
+
+
+def test_hot_threads_skip_storage(tmp_path):
+    backend = SqliteBackend(str(tmp_path / "checkpoints.sqlite"))
+    saver = BackendSaver(backend, hot_threads = 1)
+    graph = _graph(saver)
+    graph.invoke({"items": ["a"]}, _config("t1"))
+
+    backend.get_checkpoint = None # Any storage read fails from now on
+    assert graph.get_state(_config("t1")).values["items"] == ["a", "step"]
+
+
+def test_prune_keeps_latest_checkpoints(saver_factory):
+    saver = saver_factory()
+    saver.keep_checkpoints = 2
+    graph = _graph(saver)
+    for item in ["a", "b", "c"]:
+        graph.invoke({"items": [item]}, _config("t1"))
+
+    assert len(list(graph.get_state_history(_config("t1")))) == 2
+    assert graph.get_state(_config("t1")).values["items"] == ["a", "step", "b", "step", "c", "step"]
+
+
+def test_memory_evicts_least_recently_used_threads():
+    backend = MemoryBackend(max_threads = 2)
+    graph = _graph(BackendSaver(backend))
+    for thread_id in ["t1", "t2", "t3"]:
+        graph.invoke({"items": [thread_id]}, _config(thread_id))
+
+    assert backend.stats().threads == 2
+    assert backend.stats().bytes > 0
+    assert graph.get_state(_config("t1")).values == {}
+    assert graph.get_state(_config("t3")).values["items"] == ["t3", "step"]
+
+
+def test_memory_evicts_idle_threads_to_spill(tmp_path):
+    spill = SqliteBackend(str(tmp_path / "spill.sqlite"))
+    backend = MemoryBackend(idle_ttl = 60, spill = spill)
+    graph = _graph(BackendSaver(backend))
+    graph.invoke({"items": ["a"]}, _config("t1"))
+
+    backend.idle_ttl = 1e-9
+    backend.evict_idle()
+    assert backend.stats() == (0, 0)
+    assert spill.stats().threads == 1
+
+    backend.idle_ttl = 60
+    assert graph.get_state(_config("t1")).values["items"] == ["a", "step"]
+    assert backend.stats().threads == 1
+    assert spill.stats().threads == 0
+
+    backend.delete_thread("t1")
+    assert backend.stats() == (0, 0)
+
+
+def test_handoff_restores_threads_in_the_next_process(tmp_path):
+    path = str(tmp_path / "handoff.sqlite")
+    saver = BackendSaver(MemoryBackend(spill = SqliteBackend(path)))
+    graph = _graph(saver)
+    graph.invoke({"items": ["a"]}, _config("t1"))
+    graph.invoke({"items": ["b"]}, _config("t2"))
+
+    assert handoff(saver) == 2
+    saver.backend.close()
+
+    graph = _graph(BackendSaver(MemoryBackend(spill = SqliteBackend(path))))
+    assert graph.get_state(_config("t1")).values["items"] == ["a", "step"]
+    assert graph.get_state(_config("t2")).values["items"] == ["b", "step"]
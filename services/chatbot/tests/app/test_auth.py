@@ -0,0 +1,155 @@
+import datetime
+import json
+import os
+import time
+
+import jwt
+import pytest
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+
+from app import auth, metrics
+from app.auth import KeySet, TokenVerifier
+
+def _private_key():
+    return ec.generate_private_key(ec.SECP384R1())
+
+def _certificate_pem(private_key) -> bytes:
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "integrations.actual.chat")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(private_key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now)
+        .not_valid_after(now + datetime.timedelta(days = 1))
+        .sign(private_key, hashes.SHA384())
+    )
+    return certificate.public_bytes(serialization.Encoding.PEM)
+
+def _public_key_pem(private_key) -> bytes:
+    return private_key.public_key().public_bytes(
+        serialization.Encoding.PEM,
+        serialization.PublicFormat.SubjectPublicKeyInfo
+    )
+
+def _token(private_key, *, lifetime = 300, kid = None, **claims):
+    claims = {
+        "ConversationId": "c1",
+        "aud": "bot-tools.actual.chat",
+        "iss": "integrations.actual.chat",
+        "exp": int(time.time()) + lifetime,
+        **claims
+    }
+    headers = {"kid": kid} if kid else None
+    return jwt.encode(claims, private_key, algorithm = "ES384", headers = headers)
+
+def _verifier(keys):
+    return TokenVerifier(
+        keys,
+        algorithms = ["ES384"],
+        audience = "bot-tools.actual.chat",
+        issuer = "integrations.actual.chat"
+    )
+
+def _write(path, data: bytes):
+    path.write_bytes(data)
+    # Make sure the change is visible even on coarse mtime file systems
+    stat = os.stat(path)
+    os.utime(path, ns = (stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+def test_verified_tokens_are_cached(tmp_path):
+    private_key = _private_key()
+    path = tmp_path / "keys.pem"
+    _write(path, _certificate_pem(private_key))
+    verifier = _verifier(KeySet(str(path)))
+
+    token = _token(private_key)
+    verifications, hits = metrics.AUTH_TOKENS.value("verified"), metrics.AUTH_TOKENS.value("cache_hit")
+    assert verifier.verify(token)["ConversationId"] == "c1"
+    assert verifier.verify(token)["ConversationId"] == "c1"
+    assert metrics.AUTH_TOKENS.value("verified") - verifications == 1
+    assert metrics.AUTH_TOKENS.value("cache_hit") - hits == 1
+
+def test_invalid_tokens_are_rejected(tmp_path):
+    private_key = _private_key()
+    path = tmp_path / "keys.pem"
+    _write(path, _public_key_pem(private_key))
+    verifier = _verifier(KeySet(str(path)))
+
+    with pytest.raises(jwt.InvalidSignatureError):
+        verifier.verify(_token(_private_key()))
+    with pytest.raises(jwt.ExpiredSignatureError):
+        verifier.verify(_token(private_key, lifetime = -10))
+    with pytest.raises(jwt.InvalidAudienceError):
+        verifier.verify(_token(private_key, aud = "other"))
+    with pytest.raises(jwt.MissingRequiredClaimError):
+        verifier.verify(jwt.encode({"ConversationId": "c1"}, private_key, algorithm = "ES384"))
+    # Failures are not cached
+    token = _token(_private_key())
+    for _ in range(2):
+        with pytest.raises(jwt.InvalidSignatureError):
+            verifier.verify(token)
+
+def test_key_rotation(tmp_path):
+    old_key, new_key = _private_key(), _private_key()
+    path = tmp_path / "keys.pem"
+    _write(path, _certificate_pem(old_key))
+    keys = KeySet(str(path))
+    verifier = _verifier(keys)
+    old_token = _token(old_key)
+    verifier.verify(old_token)
+
+    # Both keys are accepted during the rotation
+    _write(path, _certificate_pem(old_key) + _certificate_pem(new_key))
+    assert keys.refresh()
+    verifier.verify(old_token)
+    verifier.verify(_token(new_key))
+
+    # The old key is removed, the cached claims are dropped with it
+    _write(path, _certificate_pem(new_key))
+    assert keys.refresh()
+    with pytest.raises(jwt.InvalidSignatureError):
+        verifier.verify(old_token)
+
+    # A broken file keeps the current keys
+    _write(path, b"garbage")
+    assert not keys.refresh()
+    verifier.verify(_token(new_key))
+
+def test_jwks_keys_are_matched_by_kid(tmp_path):
+    key1, key2 = _private_key(), _private_key()
+    jwks = {"keys": [
+        {**json.loads(jwt.algorithms.ECAlgorithm.to_jwk(key.public_key())), "kid": kid, "alg": "ES384"}
+        for kid, key in (("k1", key1), ("k2", key2))
+    ]}
+    path = tmp_path / "keys.json"
+    _write(path, json.dumps(jwks).encode("utf-8"))
+    keys = KeySet(str(path))
+    verifier = _verifier(keys)
+
+    assert [key for key in keys.find("k2")] == [keys.keys[1][1]]
+    assert verifier.verify(_token(key2, kid = "k2"))["ConversationId"] == "c1"
+    # Unknown kid falls back to all keys
+    assert verifier.verify(_token(key1, kid = "k3"))["ConversationId"] == "c1"
+    with pytest.raises(jwt.InvalidSignatureError):
+        verifier.verify(_token(key1, kid = "k2"))
+
+def test_verification_without_keys(monkeypatch, tmp_path):
+    monkeypatch.setattr(auth, "KEYS_PATH", None)
+    monkeypatch.setattr(auth, "VERIFY", "true")
+    with pytest.raises(RuntimeError):
+        auth.create_verifier()
+
+    token = jwt.encode({"ConversationId": "c1"}, "any", algorithm = "HS256")
+    for verify in ("auto", "false"):
+        monkeypatch.setattr(auth, "VERIFY", verify)
+        assert auth.create_verifier().verify(token)["ConversationId"] == "c1"
+    # The image sets the path, the file is there once the certificate is mounted
+    monkeypatch.setattr(auth, "KEYS_PATH", str(tmp_path / "missing.crt"))
+    monkeypatch.setattr(auth, "VERIFY", "auto")
+    assert auth.create_verifier().keys is None
@@ -13,3 +13,221 @@ def test_create_chain():
 #print(the_chain.get_graph(xray=True).draw_mermaid())
 #print(the_chain.get_graph().draw_mermaid())
 #the_chain.invoke({"aggregate": []})
+
+def test_background_summarization(monkeypatch):
+    import asyncio
+    from langchain_core.language_models.fake_chat_models import FakeMessagesListChatModel
+    from langchain_core.messages import AIMessage
+    from app import checkpoint
+
+    class FakeModel(FakeMessagesListChatModel):
+        def bind_tools(self, tools, **kwargs):
+            return self
+
+    replies = []
+    async def areply(message, config, **kwargs):
+        replies.append(message)
+    monkeypatch.setattr(chain, "call_areply", areply)
+    monkeypatch.setattr(chain, "MAX_CONTEXT_TOKENS", 1)
+    monkeypatch.setattr(chain, "KEEP_CONTEXT_TOKENS", 1)
+
+    models = []
+    def chat_model(**kwargs):
+        content = "answer" if models else "summary"
+        # Note: Distinct objects, otherwise all responses get the same id
+        models.append(FakeModel(responses=[AIMessage(content=content) for _ in range(10)]))
+        return models[-1]
+
+    checkpointer = checkpoint.create()
+    the_chain = chain.create(
+        claude_api_key = "fake",
+        checkpointer = checkpointer,
+        chat_model = chat_model,
+        background_summarization = True
+    )
+    config = {"configurable": {"thread_id": "background-summary"}}
+
+    async def run():
+        await the_chain.ainvoke("first", config)
+        second = await the_chain.ainvoke("second", config)
+        # The turn returns before the summary is made
+        assert second.get("summary") is None
+        third = await the_chain.ainvoke("third", config)
+        # The first turn is folded into the summary before the third one starts
+        assert third["summary"] == "summary"
+        assert [m.content for m in third["messages"]] == ["second", "answer", "third", "answer"]
+    asyncio.run(run())
+    assert replies == ["answer"] * 3
+
+    # Sync calls summarize before returning, out of the graph run
+    monkeypatch.setattr(chain, "call_reply", lambda message, config, **kwargs: replies.append(message))
+    config = {"configurable": {"thread_id": "background-summary-sync"}}
+    the_chain.invoke("first", config)
+    summaries = models[0].i
+    second = the_chain.invoke("second", config)
+    assert second.get("summary") is None
+    assert models[0].i - summaries == 1
+    third = the_chain.invoke("third", config)
+    # Folded when the second call returned, as in the async case
+    assert third["summary"] == "summary"
+    assert [m.content for m in third["messages"]] == ["second", "answer", "third", "answer"]
+
+def test_response_modes(monkeypatch):
+    import asyncio
+    from langchain_core.language_models.fake_chat_models import FakeMessagesListChatModel
+    from langchain_core.messages import AIMessage
+    from app import checkpoint
+
+    class FakeModel(FakeMessagesListChatModel):
+        def bind_tools(self, tools, **kwargs):
+            return self
+
+    async def areply(message, config, **kwargs):
+        pass
+    monkeypatch.setattr(chain, "call_areply", areply)
+
+    the_chain = chain.create(
+        claude_api_key = "fake",
+        checkpointer = checkpoint.create(),
+        chat_model = lambda **kwargs: FakeModel(responses=[AIMessage(content="answer") for _ in range(10)]),
+        background_summarization = False
+    )
+
+    def config(mode):
+        return {"configurable": {"thread_id": "response-modes", chain.RESPONSE_MODE_KEY: mode}}
+
+    async def run():
+        full = await the_chain.ainvoke("first", config(chain.ResponseMode.Full))
+        delta = await the_chain.ainvoke("second", config(chain.ResponseMode.Delta))
+        status = await the_chain.ainvoke("third", config(chain.ResponseMode.Status))
+        return full, delta, status
+
+    full, delta, status = asyncio.run(run())
+    assert [m.content for m in full["messages"]] == ["first", "answer"]
+    # Only what changed in the turn
+    assert [m.content for m in delta["messages"]] == ["second", "answer"]
+    assert set(delta) == {"messages"}
+    assert status["status"] == "ok"
+    assert len(status["message_ids"]) == 2
+    # langserve validates responses with the output schema
+    for response in (full, delta, status):
+        the_chain.get_output_schema().model_validate(response)
+
+def test_concurrent_messages_are_coalesced(monkeypatch):
+    import asyncio
+    from langchain_core.language_models.fake_chat_models import FakeMessagesListChatModel
+    from langchain_core.messages import AIMessage
+    from app import checkpoint
+
+    class SlowModel(FakeMessagesListChatModel):
+        def bind_tools(self, tools, **kwargs):
+            return self
+
+        async def _agenerate(self, *args, **kwargs):
+            await asyncio.sleep(0.05)
+            return await super()._agenerate(*args, **kwargs)
+
+    replies = []
+    async def areply(message, config, **kwargs):
+        replies.append(message)
+    monkeypatch.setattr(chain, "call_areply", areply)
+
+    models = []
+    def chat_model(**kwargs):
+        models.append(SlowModel(responses=[AIMessage(content=f"answer {i}") for i in range(10)]))
+        return models[-1]
+
+    the_chain = chain.create(
+        claude_api_key = "fake",
+        checkpointer = checkpoint.create(),
+        chat_model = chat_model,
+        background_summarization = False
+    )
+    config = {"configurable": {"thread_id": "coalesced"}}
+
+    async def run():
+        first = asyncio.create_task(the_chain.ainvoke("find", config))
+        await asyncio.sleep(0.01)
+        # Dictated in a burst while the first turn is running
+        rest = await asyncio.gather(*(the_chain.ainvoke(text, config) for text in ("cats", "and dogs")))
+        return await first, rest
+
+    first, (second, third) = asyncio.run(run())
+    assert [m.content for m in first["messages"]] == ["find", "answer 0"]
+    # One follow-up turn answers both messages
+    assert second is third
+    assert [m.content for m in third["messages"]] == ["find", "answer 0", "cats", "and dogs", "answer 1"]
+    assert replies == ["answer 0", "answer 1"]
+
+def test_streamed_replies(monkeypatch):
+    import asyncio
+    import httpx
+    from langchain_core.language_models.fake_chat_models import FakeMessagesListChatModel
+    from langchain_core.messages import AIMessage, AIMessageChunk
+    from langchain_core.outputs import ChatGenerationChunk
+    from app import checkpoint, metrics
+    from app.tools import _Tools
+
+    class StreamingModel(FakeMessagesListChatModel):
+        def bind_tools(self, tools, **kwargs):
+            return self
+
+        async def _astream(self, messages, stop = None, run_manager = None, **kwargs):
+            yield ChatGenerationChunk(message = AIMessageChunk(
+                content = "",
+                usage_metadata = {
+                    "input_tokens": 10, "output_tokens": 0, "total_tokens": 10,
+                    "input_token_details": {"cache_read": 4},
+                }
+            ))
+            for text in ("Hello", ", world"):
+                yield ChatGenerationChunk(message = AIMessageChunk(content = text))
+            yield ChatGenerationChunk(message = AIMessageChunk(
+                content = "",
+                usage_metadata = {"input_tokens": 0, "output_tokens": 3, "total_tokens": 3}
+            ))
+
+    posted = []
+    def backend(request):
+        data = httpx.Response(200, content = request.content).json()
+        posted.append(data)
+        return httpx.Response(200, json = {"entryLocalId": 7} if supported else {})
+    monkeypatch.setattr(_Tools, "async_client", httpx.AsyncClient(transport = httpx.MockTransport(backend)))
+    monkeypatch.setattr(_Tools, "REPLY", "http://backend/api/bot/conversation/reply")
+    monkeypatch.setattr(_Tools, "REPLY_UPDATES", None)
+    monkeypatch.setattr(chain, "STREAM_REPLIES", True)
+    monkeypatch.setattr(chain, "STREAM_FLUSH_SIZE", 1)
+    monkeypatch.setattr(chain, "STREAM_FLUSH_INTERVAL", 0)
+
+    the_chain = chain.create(
+        claude_api_key = "fake",
+        checkpointer = checkpoint.create(),
+        chat_model = lambda **kwargs: StreamingModel(responses = [AIMessage(content = "Hello, world") for _ in range(10)]),
+        background_summarization = False
+    )
+
+    async def run(thread_id):
+        config = {"configurable": {"thread_id": thread_id}}
+        await the_chain.ainvoke("first", config)
+        await the_chain.ainvoke("second", config)
+
+    # Answers are sent whole until the backend shows it updates replies in place
+    supported = True
+    tokens = {kind: metrics.LLM_TOKENS.value("agent", kind) for kind in ("input", "output", "cache_read")}
+    asyncio.run(run("streamed"))
+    assert posted == [
+        {"text": "Hello, world"},
+        {"text": "Hello"},
+        {"text": "Hello, world", "entryLocalId": 7},
+    ]
+    # Usage of the streamed call
+    assert metrics.LLM_TOKENS.value("agent", "input") - tokens["input"] == 6
+    assert metrics.LLM_TOKENS.value("agent", "output") - tokens["output"] == 3
+    assert metrics.LLM_TOKENS.value("agent", "cache_read") - tokens["cache_read"] == 4
+
+    # A backend without updates gets single replies, never a partial one
+    supported = False
+    _Tools.REPLY_UPDATES = None
+    posted.clear()
+    asyncio.run(run("not-streamed"))
+    assert posted == [{"text": "Hello, world"}, {"text": "Hello, world"}]
@@ -0,0 +1,54 @@
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+
+from app.context import TRIMMED_TOOL_RESULT, count_tokens, fit_budget, message_tokens, split_window
+
+def _turn(i, text = "x" * 300):
+    return [
+        HumanMessage(content=f"find {i}", id=f"h{i}"),
+        AIMessage(content="", tool_calls=[{"name": "search_in_chats", "args": {"text": str(i)}, "id": f"c{i}"}], id=f"a{i}"),
+        ToolMessage(content=text, tool_call_id=f"c{i}", name="search_in_chats", id=f"t{i}"),
+        AIMessage(content=f"found {i}", id=f"r{i}"),
+    ]
+
+def test_tool_calls_are_counted():
+    plain = AIMessage(content="")
+    with_call = AIMessage(content="", tool_calls=[{"name": "search_in_chats", "args": {"text": "a" * 90}, "id": "c"}])
+    assert message_tokens(with_call) > message_tokens(plain) + 30
+
+def test_window_keeps_whole_recent_turns():
+    messages = _turn(1) + _turn(2) + _turn(3)
+    turn_tokens = count_tokens(_turn(3))
+    evicted, window = split_window(messages, keep_tokens = 2 * turn_tokens)
+    assert [m.id for m in evicted] == [m.id for m in _turn(1)]
+    assert [m.id for m in window] == [m.id for m in _turn(2) + _turn(3)]
+
+def test_window_never_splits_tool_call_and_result():
+    messages = _turn(1) + _turn(2, text = "x" * 3000)
+    evicted, window = split_window(messages, keep_tokens = 10)
+    # The latest turn is kept even if it doesn't fit
+    assert [m.id for m in window] == [m.id for m in _turn(2)]
+    assert isinstance(window[0], HumanMessage)
+    assert evicted == messages[:4]
+
+def test_nothing_to_evict():
+    messages = _turn(1)
+    assert split_window(messages, keep_tokens = 1) == ([], messages)
+    assert split_window([], keep_tokens = 1) == ([], [])
+
+def test_older_tool_results_are_trimmed_to_fit():
+    messages = _turn(1) + _turn(2) + _turn(3)[:3]
+    budget = count_tokens(messages) - 50
+    prompt = fit_budget(messages, budget)
+    assert count_tokens(prompt) <= budget
+    assert [m.id for m in prompt] == [m.id for m in messages]
+    # Oldest first, the result the model is about to read is kept
+    assert [m.content for m in prompt if isinstance(m, ToolMessage)] == [TRIMMED_TOOL_RESULT, "x" * 300, "x" * 300]
+    # The state messages are left as they are
+    assert messages[2].content == "x" * 300
+
+def test_older_turns_are_left_out_when_trimming_isnt_enough():
+    messages = _turn(1) + _turn(2) + _turn(3)[:3]
+    assert fit_budget(messages, count_tokens(messages)) == messages
+    prompt = fit_budget(messages, 10)
+    assert [m.id for m in prompt] == [m.id for m in _turn(3)[:3]]
+    assert prompt[-1].content == "x" * 300
@@ -0,0 +1,136 @@
+import asyncio
+import collections
+
+import httpx
+import jwt
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+from app import dispatcher as dispatcher_module
+from app.dispatcher import Dispatcher, HashRing, Worker, conversation_id, create_app
+
+def token(conversation: str) -> str:
+    return "Bearer " + jwt.encode({"ConversationId": conversation}, "not-the-key", algorithm = "HS256")
+
+class FakeWorker(Worker):
+    """Serves in process, answers with its index and generation."""
+
+    def __init__(self, index: int, generation: int, log: list, ready: bool = True):
+        self.index = index
+        self.generation = generation
+        self.log = log
+        self.inflight = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self.release = asyncio.Event()
+        self.release.set()
+        self.process = None
+        self.stopped = False
+
+        async def serve(request):
+            await self.release.wait()
+            return JSONResponse({"worker": self.index, "generation": self.generation})
+
+        async def readyz(request):
+            return JSONResponse({"ready": ready}, status_code = 200 if ready else 503)
+
+        app = Starlette(routes = [Route("/readyz", readyz), Route("/{path:path}", serve, methods = ["GET", "POST"])])
+        self.client = httpx.AsyncClient(transport = httpx.ASGITransport(app = app), base_url = "http://worker")
+
+    @property
+    def alive(self) -> bool:
+        return not self.stopped
+
+    def start(self):
+        self.log.append(("start", self.index, self.generation))
+
+    async def stop(self, timeout: float):
+        self.log.append(("stop", self.index, self.generation))
+        self.stopped = True
+
+def test_ring_is_stable_and_balanced():
+    keys = [f"conversation-{i}" for i in range(4000)]
+    four = HashRing([0, 1, 2, 3])
+    assert [four.node(key) for key in keys] == [HashRing([0, 1, 2, 3]).node(key) for key in keys]
+
+    shares = collections.Counter(four.node(key) for key in keys)
+    assert min(shares.values()) > 0.6 * len(keys) / 4
+
+    # Adding a worker moves only the keys it takes over
+    five = HashRing([0, 1, 2, 3, 4])
+    moved = [key for key in keys if four.node(key) != five.node(key)]
+    assert all(five.node(key) == 4 for key in moved)
+    assert len(moved) < 0.35 * len(keys)
+
+def test_conversation_id_is_read_without_verification():
+    assert conversation_id(token("abc")) == "abc"
+    assert conversation_id(None) is None
+    assert conversation_id("Bearer not-a-token") is None
+    assert conversation_id("Basic abc") is None
+
+def test_conversation_sticks_to_its_worker_across_restarts():
+    log = []
+    dispatcher = Dispatcher(3, worker_factory = lambda index, generation: FakeWorker(index, generation, log))
+
+    async def run():
+        await dispatcher.start()
+        async with httpx.AsyncClient(
+            transport = httpx.ASGITransport(app = create_app(dispatcher)), base_url = "http://bot"
+        ) as client:
+            for slot in dispatcher.slots:
+                await asyncio.wait_for(slot.open.wait(), 1)
+            headers = {"Authorization": token("conversation-1")}
+            first = (await client.post("/invoke_graph/invoke", headers = headers)).json()
+            assert (await client.post("/invoke_graph/invoke", headers = headers)).json() == first
+            pinned = (await client.get("/metrics", headers = {"X-Bot-Worker": "2"})).json()
+            assert pinned["worker"] == 2
+
+            # A request in flight on the old worker finishes before it's stopped,
+            # new requests wait for the new worker
+            old = dispatcher.slots[first["worker"]].worker
+            old.release.clear()
+            in_flight = asyncio.create_task(client.post("/invoke_graph/invoke", headers = headers))
+            await asyncio.sleep(0.05)
+            restart = asyncio.create_task(dispatcher.restart(first["worker"]))
+            await asyncio.sleep(0.05)
+            held = asyncio.create_task(client.post("/invoke_graph/invoke", headers = headers))
+            await asyncio.sleep(0.05)
+            assert not held.done()
+            assert ("stop", first["worker"], 0) not in log
+
+            old.release.set()
+            assert (await in_flight).json() == first
+            await restart
+            assert (await held).json() == {"worker": first["worker"], "generation": 1}
+            assert log.index(("start", first["worker"], 1)) < log.index(("stop", first["worker"], 0))
+
+            stats = (await client.get("/stats/workers")).json()
+            assert stats[first["worker"]]["restarts"] == 1
+            assert all(worker["inflight"] == 0 for worker in stats)
+        await dispatcher.stop()
+
+    asyncio.run(run())
+
+def test_worker_which_never_gets_ready_is_replaced(monkeypatch):
+    monkeypatch.setattr(dispatcher_module, "WORKER_START_TIMEOUT", 0.3)
+    log = []
+    dispatcher = Dispatcher(
+        1, worker_factory = lambda index, generation: FakeWorker(index, generation, log, ready = generation > 1)
+    )
+
+    async def run():
+        await dispatcher.start()
+        async with httpx.AsyncClient(
+            transport = httpx.ASGITransport(app = create_app(dispatcher)), base_url = "http://bot"
+        ) as client:
+            headers = {"Authorization": token("conversation-1")}
+            # Requests don't wait for the stuck worker forever
+            assert (await client.post("/invoke_graph/invoke", headers = headers)).status_code == 503
+            await asyncio.wait_for(dispatcher.slots[0].open.wait(), 2)
+            assert (await client.post("/invoke_graph/invoke", headers = headers)).json() == {"worker": 0, "generation": 2}
+            assert log == [("start", 0, 0), ("stop", 0, 0), ("start", 0, 1), ("stop", 0, 1), ("start", 0, 2)]
+            assert dispatcher.slots[0].restarts == 2
+        await dispatcher.stop()
+
+    asyncio.run(run())
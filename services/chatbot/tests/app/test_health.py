@@ -0,0 +1,92 @@
+import asyncio
+import threading
+import time
+
+from langchain_core.runnables import RunnableLambda
+
+from app.health import Readiness
+from app.runnables import LazyRunnable
+
+def test_failed_checks_are_retried_in_order():
+    calls = []
+    backend_up = False
+
+    async def build():
+        calls.append("build")
+
+    async def backend():
+        calls.append("backend")
+        if not backend_up:
+            raise ConnectionError("refused")
+
+    readiness = Readiness()
+    readiness.add("build", build)
+    readiness.add("backend", backend)
+
+    assert not asyncio.run(readiness.run())
+    report = readiness.report()
+    assert not report["ready"]
+    assert report["checks"]["build"]["status"] == "ok"
+    assert report["checks"]["backend"] == {"status": "failed", "error": "ConnectionError: refused"}
+
+    backend_up = True
+    assert asyncio.run(readiness.run())
+    assert readiness.ready
+    # Passed checks don't run again
+    assert calls == ["build", "backend", "backend"]
+
+def test_lazy_runnable_is_built_once_on_first_use():
+    built = []
+    def factory():
+        built.append(True)
+        return RunnableLambda(lambda text: {"answer": text})
+
+    runnable = LazyRunnable(factory, output_type = dict, name = "invoke_graph")
+    assert runnable.get_output_schema().model_json_schema()["type"] == "object"
+    assert not built
+
+    assert runnable.invoke("hi") == {"answer": "hi"}
+    assert asyncio.run(runnable.ainvoke("hello")) == {"answer": "hello"}
+    assert len(built) == 1
+
+def test_lazy_runnable_is_built_off_the_event_loop():
+    built = []
+    def factory():
+        built.append(threading.current_thread())
+        time.sleep(0.05)
+        return RunnableLambda(lambda text: {"answer": text})
+
+    runnable = LazyRunnable(factory, output_type = dict, name = "invoke_graph")
+
+    async def run():
+        ticks = 0
+        async def tick():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.005)
+        ticker = asyncio.create_task(tick())
+        answers = await asyncio.gather(*(runnable.ainvoke(text) for text in ("hi", "hello")))
+        ticker.cancel()
+        return answers, ticks
+
+    answers, ticks = asyncio.run(run())
+    assert answers == [{"answer": "hi"}, {"answer": "hello"}]
+    # Concurrent first callers share one build, the event loop keeps running meanwhile
+    assert len(built) == 1 and built[0] is not threading.main_thread()
+    assert ticks > 2
+
+def test_server_creates_dependencies_in_readiness_checks(monkeypatch):
+    from app import auth, server
+    assert server.token_verifier is None
+    assert server.checkpointer is None
+    assert server.llm_cache is None
+
+    # Missing keys fail the first check instead of the import
+    monkeypatch.setattr(auth, "KEYS_PATH", None)
+    monkeypatch.setattr(auth, "VERIFY", "true")
+    assert not asyncio.run(server.readiness.run())
+    checks = server.readiness.report()["checks"]
+    assert checks["auth"]["status"] == "failed"
+    assert checks["storage"]["status"] == "pending"
+    assert server.checkpointer is None
@@ -0,0 +1,121 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+from langchain_core.language_models import FakeListChatModel
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.runnables import RunnableLambda
+
+from app import metrics
+from app.cache import ModelCache
+from app.llm_scheduler import LlmScheduler, Priority, ScheduledModel, SchedulerRejected
+
+class RateLimited(Exception):
+    status_code = 429
+
+    def __init__(self, retry_after):
+        super().__init__("rate limited")
+        self.response = httpx.Response(429, headers = {"retry-after": str(retry_after)})
+
+def _pause(scheduler, seconds):
+    assert scheduler.should_retry(RateLimited(seconds), 0)
+
+def test_higher_priority_goes_first():
+    scheduler = LlmScheduler(requests_per_minute = 6000)
+    granted = []
+
+    async def call(priority):
+        await scheduler.aacquire(priority, 10)
+        granted.append(priority)
+
+    async def run():
+        _pause(scheduler, 0.05)
+        tasks = []
+        for priority in (Priority.Summarizer, Priority.Resolver, Priority.Agent):
+            tasks.append(asyncio.create_task(call(priority)))
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+
+    asyncio.run(run())
+    assert granted == [Priority.Agent, Priority.Resolver, Priority.Summarizer]
+
+def test_calls_which_would_wait_too_long_are_rejected():
+    scheduler = LlmScheduler(tokens_per_minute = 600, max_wait = {Priority.Summarizer: 1})
+    rejected = metrics.LLM_REJECTED.value("summarizer", "deadline")
+    scheduler.acquire(Priority.Agent, 600)
+    started = time.monotonic()
+    with pytest.raises(SchedulerRejected):
+        # Needs 10 seconds of refill
+        scheduler.acquire(Priority.Summarizer, 100)
+    # Rejected right away, not after the max wait
+    assert time.monotonic() - started < 0.5
+    assert metrics.LLM_REJECTED.value("summarizer", "deadline") - rejected == 1
+
+def test_full_queue_rejects():
+    scheduler = LlmScheduler(queue_size = 1)
+
+    async def run():
+        _pause(scheduler, 0.05)
+        waiting = asyncio.create_task(scheduler.aacquire(Priority.Agent, 1))
+        await asyncio.sleep(0)
+        with pytest.raises(SchedulerRejected):
+            await scheduler.aacquire(Priority.Agent, 1)
+        await waiting
+        assert metrics.LLM_QUEUE_DEPTH.value() == 0
+
+    asyncio.run(run())
+
+def test_rate_limited_calls_are_retried_after_retry_after():
+    scheduler = LlmScheduler()
+    calls = []
+    def call(input):
+        calls.append(time.monotonic())
+        if len(calls) == 1:
+            raise RateLimited(0.05)
+        return AIMessage(content = "ok")
+
+    model = ScheduledModel(RunnableLambda(call), scheduler, Priority.Agent)
+    assert model.invoke([HumanMessage(content = "hi")]).content == "ok"
+    assert calls[1] - calls[0] >= 0.05
+
+    scheduler.max_retries = 0
+    calls.clear()
+    with pytest.raises(RateLimited):
+        model.invoke([HumanMessage(content = "hi")])
+    # The call which gives up doesn't hold back the others
+    started = time.monotonic()
+    scheduler.acquire(Priority.Agent, 1).settle(0)
+    assert time.monotonic() - started < 0.04
+
+def test_token_usage_is_settled():
+    scheduler = LlmScheduler(tokens_per_minute = 6000)
+    model = ScheduledModel(
+        RunnableLambda(lambda input: AIMessage(
+            content = "ok",
+            usage_metadata = {"input_tokens": 3000, "output_tokens": 1000, "total_tokens": 4000}
+        )),
+        scheduler,
+        Priority.Agent
+    )
+    model.invoke([HumanMessage(content = "hi")])
+    # The estimate is replaced by the actual usage
+    assert 1900 < scheduler._tokens.level < 2100
+
+def test_cache_hits_skip_the_scheduler():
+    scheduler = LlmScheduler(requests_per_minute = 1, tokens_per_minute = 6000, max_wait = {Priority.Agent: 0.1})
+    model = ScheduledModel(
+        FakeListChatModel(responses = ["ok"], cache = ModelCache()).bind(stop = ["\n\n"]).with_config(run_name = "agent"),
+        scheduler,
+        Priority.Agent
+    )
+    prompt = [HumanMessage(content = "hi")]
+    assert model.invoke(prompt).content == "ok"
+    tokens = scheduler._tokens.level
+
+    # The only request of the minute is used, a call would be rejected
+    assert model.invoke(prompt).content == "ok"
+    assert asyncio.run(model.ainvoke(prompt)).content == "ok"
+    assert scheduler._tokens.level >= tokens
+    with pytest.raises(SchedulerRejected):
+        model.invoke([HumanMessage(content = "hello")])
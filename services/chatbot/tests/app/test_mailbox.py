@@ -0,0 +1,61 @@
+import asyncio
+
+import pytest
+
+from app.mailbox import Mailboxes
+
+def test_items_arriving_during_a_batch_are_coalesced():
+    batches = []
+    async def process(key, items):
+        batches.append((key, items))
+        number = len(batches)
+        await asyncio.sleep(0.01)
+        return number
+
+    async def run():
+        mailboxes = Mailboxes(process)
+        first = asyncio.create_task(mailboxes.submit("t1", "a"))
+        await asyncio.sleep(0)
+        rest = [asyncio.create_task(mailboxes.submit("t1", item)) for item in "bcd"]
+        other = asyncio.create_task(mailboxes.submit("t2", "x"))
+        results = await asyncio.gather(first, *rest, other)
+        assert not mailboxes.busy("t1")
+        return results
+
+    results = asyncio.run(run())
+    assert batches == [("t1", ["a"]), ("t2", ["x"]), ("t1", ["b", "c", "d"])]
+    assert results == [1, 3, 3, 3, 2]
+
+def test_failed_batch_fails_its_items_only():
+    async def process(key, items):
+        await asyncio.sleep(0.01)
+        if "bad" in items:
+            raise ValueError("bad")
+        return items
+
+    async def run():
+        mailboxes = Mailboxes(process)
+        first = asyncio.create_task(mailboxes.submit("t1", "bad"))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(mailboxes.submit("t1", "good"))
+        with pytest.raises(ValueError):
+            await first
+        return await second
+
+    assert asyncio.run(run()) == ["good"]
+
+def test_cancelled_submitter_item_is_processed():
+    processed = []
+    async def process(key, items):
+        await asyncio.sleep(0.01)
+        processed.extend(items)
+
+    async def run():
+        mailboxes = Mailboxes(process)
+        task = asyncio.create_task(mailboxes.submit("t1", "a"))
+        await asyncio.sleep(0)
+        task.cancel()
+        await mailboxes.submit("t1", "b")
+
+    asyncio.run(run())
+    assert processed == ["a", "b"]
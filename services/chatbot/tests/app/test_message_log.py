@@ -0,0 +1,77 @@
+from langchain_core.messages import AIMessage, HumanMessage, RemoveMessage, ToolMessage
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+
+from app.message_log import MessageLog
+from app.state import State, reduce_list
+
+def _tool(id, name = "search_in_chats", status = "success"):
+    return ToolMessage(content="[]", tool_call_id=f"call-{id}", name=name, status=status, id=id)
+
+def test_reducer_appends_replaces_and_removes():
+    log = reduce_list([], [HumanMessage(content="hi", id="h1"), AIMessage(content="hello", id="a1")])
+    assert isinstance(log, MessageLog)
+    assert [log.seq_of(m) for m in log] == [1, 2]
+
+    updated = reduce_list(log, [AIMessage(content="hello!", id="a1"), _tool("t1")])
+    # The previous value is not changed: LangGraph may still hold it
+    assert [m.id for m in log] == ["h1", "a1"]
+    assert [m.id for m in updated] == ["h1", "a1", "t1"]
+    assert updated.get_by_id("a1").content == "hello!"
+    assert updated.seq_of(updated.get_by_id("a1")) == 2
+
+    removed = reduce_list(updated, [RemoveMessage(id="a1")])
+    assert [m.id for m in removed] == ["h1", "t1"]
+    assert removed.get_by_id("a1") is None
+
+def test_added_messages_are_not_changed():
+    human, answer = HumanMessage(content="hi"), AIMessage(content="hello", id="a1")
+    log = reduce_list([], [human, answer])
+    log = reduce_list(log, [AIMessage(content="hello!", id="a1")])
+    # The caller may still hold them, e.g. a model output or another checkpoint
+    assert human.id is None and human.response_metadata == {}
+    assert answer.response_metadata == {}
+    assert log[0].id is not None
+    assert [log.seq_of(m) for m in log] == [1, 2]
+    # Messages which already have their number aren't copied
+    assert MessageLog(list(log)).get_by_id("a1") is log.get_by_id("a1")
+
+def test_cursor_survives_removal():
+    log = reduce_list([], [HumanMessage(content="hi", id="h1"), _tool("t1"), _tool("t2")])
+    cursor = log.seq_of(log.get_by_id("t1"))
+    log = reduce_list(log, [RemoveMessage(id="t1"), _tool("t3")])
+    assert [m.id for m in log.since(cursor)] == ["t2", "t3"]
+    assert [m.id for m in log.since(log.last_seq)] == []
+    assert [m.id for m in log.since(None)] == ["h1", "t2", "t3"]
+
+def test_tool_index():
+    log = reduce_list([], [_tool("t1"), _tool("r1", name = "reset"), _tool("t2", status = "error")])
+    assert [m.id for m in log.tool_messages("search_in_chats")] == ["t2", "t1"]
+    log = reduce_list(log, [RemoveMessage(id="t2")])
+    assert [m.id for m in log.tool_messages("search_in_chats")] == ["t1"]
+    assert list(log.tool_messages("unknown")) == []
+
+def test_empty_agent_message_is_removed():
+    log = reduce_list([], [HumanMessage(content="hi", id="h1"), AIMessage(content="", id="a1")])
+    log = reduce_list(log, HumanMessage(content="again", id="h2"))
+    assert [m.id for m in log] == ["h1", "h2"]
+
+def test_restored_log_keeps_sequence_numbers():
+    log = reduce_list([], [HumanMessage(content="hi", id="h1"), _tool("t1"), _tool("t2")])
+    log = reduce_list(log, [RemoveMessage(id="t1")])
+    serde = JsonPlusSerializer()
+    restored = State(messages=serde.loads_typed(serde.dumps_typed(list(log)))).messages
+    assert isinstance(restored, MessageLog)
+    assert [restored.seq_of(m) for m in restored] == [1, 3]
+    restored = reduce_list(restored, [_tool("t3")])
+    assert restored.seq_of(restored.get_by_id("t3")) == 4
+    # State validation keeps the log as is
+    assert State(messages=restored).messages is restored
+
+def test_list_appends_are_indexed():
+    state = State(messages=[])
+    state.messages.append(HumanMessage(content="hi", id="h1"))
+    state.messages.extend([_tool("t1")])
+    state.messages += [_tool("t2")]
+    assert [m.id for m in state.messages.tool_messages("search_in_chats")] == ["t2", "t1"]
+    assert state.messages.get_by_id("h1").content == "hi"
+    assert state.messages.last_seq == 3
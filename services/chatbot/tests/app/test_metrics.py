@@ -0,0 +1,88 @@
+from app import metrics
+from app.metrics import Counter, Histogram
+
+def test_prometheus_text_format():
+    histogram = Histogram("test_duration_seconds", "Test durations.", ["node"], buckets = (0.1, 1))
+    histogram.observe(0.05, "agent")
+    histogram.observe(0.5, "agent")
+    histogram.observe(5, "agent")
+    counter = Counter("test_tokens_total", "Test tokens.", ["caller"])
+    counter.inc('a"b', amount = 3)
+
+    lines = histogram.render() + counter.render()
+    assert lines == [
+        "# HELP test_duration_seconds Test durations.",
+        "# TYPE test_duration_seconds histogram",
+        'test_duration_seconds_bucket{node="agent",le="0.1"} 1',
+        'test_duration_seconds_bucket{node="agent",le="1"} 2',
+        'test_duration_seconds_bucket{node="agent",le="+Inf"} 3',
+        'test_duration_seconds_sum{node="agent"} 5.55',
+        'test_duration_seconds_count{node="agent"} 3',
+        "# HELP test_tokens_total Test tokens.",
+        "# TYPE test_tokens_total counter",
+        'test_tokens_total{caller="a\\"b"} 3',
+    ]
+    assert "test_tokens_total" in metrics.render()
+
+def test_chain_metrics(monkeypatch):
+    import asyncio
+    import httpx
+    from langchain_core.language_models.fake_chat_models import FakeMessagesListChatModel
+    from langchain_core.messages import AIMessage
+    from app import chain, checkpoint
+    from app.tools import _Tools
+
+    class FakeModel(FakeMessagesListChatModel):
+        def bind_tools(self, tools, **kwargs):
+            return self
+
+    def backend(request):
+        return httpx.Response(200, json = [])
+    monkeypatch.setattr(_Tools, "async_client", httpx.AsyncClient(transport = httpx.MockTransport(backend)))
+    monkeypatch.setattr(_Tools, "SEARCH_IN_CHATS", "http://backend/api/bot/search/chats")
+    monkeypatch.setattr(_Tools, "REPLY", "http://backend/api/bot/conversation/reply")
+
+    usage = {"usage": {"input_tokens": 10, "output_tokens": 2}}
+    responses = [
+        AIMessage(
+            content = "",
+            tool_calls = [{"name": "search_in_chats", "args": {"text": "cats", "search_type": "PUBLIC"}, "id": "c1"}],
+            response_metadata = usage
+        ),
+        AIMessage(content = "answer", response_metadata = usage),
+    ]
+    the_chain = chain.create(
+        claude_api_key = "fake",
+        checkpointer = checkpoint.create(),
+        chat_model = lambda **kwargs: FakeModel(responses = responses),
+        background_summarization = False
+    )
+    nodes = metrics.NODE_SECONDS.count("agent")
+    tools = metrics.TOOL_SECONDS.count("search_in_chats", "success")
+    steps = metrics.GRAPH_STEPS.count()
+    tokens = metrics.LLM_TOKENS.value("agent", "input")
+    searches = metrics.BACKEND_SECONDS.count("/api/bot/search/chats", "200")
+
+    asyncio.run(the_chain.ainvoke("find cats", {"configurable": {"thread_id": "metrics"}}))
+
+    assert metrics.NODE_SECONDS.count("agent") - nodes == 2
+    assert metrics.TOOL_SECONDS.count("search_in_chats", "success") - tools == 1
+    assert metrics.GRAPH_STEPS.count() - steps == 1
+    assert metrics.LLM_TOKENS.value("agent", "input") - tokens == 20
+    assert metrics.BACKEND_SECONDS.count("/api/bot/search/chats", "200") - searches == 1
+
+def test_checkpoint_stats_are_read_off_the_event_loop(monkeypatch):
+    import asyncio
+    import threading
+    from app import checkpoint, server
+
+    threads = []
+    class Checkpointer:
+        def stats(self):
+            threads.append(threading.current_thread())
+            return checkpoint.CheckpointStats(threads = 3, bytes = 1024)
+    monkeypatch.setattr(server, "checkpointer", Checkpointer())
+
+    response = asyncio.run(server.prometheus_metrics())
+    assert threads and threads[0] is not threading.main_thread()
+    assert "chatbot_checkpoint_threads 3" in response.body.decode()
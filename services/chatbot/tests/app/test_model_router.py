@@ -0,0 +1,129 @@
+import asyncio
+import time
+
+import pytest
+from langchain_core.runnables import Runnable
+
+from app import metrics, model_router
+from app.llm_scheduler import LlmScheduler, Priority, ScheduledModel
+from app.model_router import HedgedModel, LatencyTracker
+
+class ApiError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"Error code: {status_code}")
+        self.status_code = status_code
+
+class FakeModel(Runnable):
+    def __init__(self, answer, delay = 0.0, error = None):
+        self.answer = answer
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+        self.cancelled = 0
+
+    def invoke(self, input, config = None, **kwargs):
+        self.calls += 1
+        if self.error is not None:
+            raise self.error
+        return self.answer
+
+    async def ainvoke(self, input, config = None, **kwargs):
+        self.calls += 1
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if self.error is not None:
+            raise self.error
+        return self.answer
+
+    async def astream(self, input, config = None, **kwargs):
+        await self.ainvoke(input, config)
+        for chunk in self.answer.split():
+            yield chunk
+
+def _hedged(primary, alternate):
+    latency = LatencyTracker(min_samples = 5)
+    first_chunk_latency = LatencyTracker(min_samples = 5)
+    for _ in range(5):
+        latency.observe(0.01)
+        first_chunk_latency.observe(0.01)
+    return HedgedModel(
+        primary = primary,
+        alternate = alternate,
+        caller = "agent",
+        min_delay = 0.05,
+        latency = latency,
+        first_chunk_latency = first_chunk_latency
+    )
+
+def test_slow_calls_are_hedged():
+    primary, alternate = FakeModel("slow", delay = 1), FakeModel("fast")
+    model = _hedged(primary, alternate)
+    hedged = metrics.LLM_HEDGED.value("agent", "alternate")
+
+    started = time.monotonic()
+    assert asyncio.run(model.ainvoke("hi")) == "fast"
+    assert time.monotonic() - started < 0.5
+    assert primary.cancelled == 1
+    assert metrics.LLM_HEDGED.value("agent", "alternate") - hedged == 1
+
+    # Calls within the usual latency aren't hedged
+    primary.delay = 0
+    assert asyncio.run(model.ainvoke("hi")) == "slow"
+    assert alternate.calls == 1
+
+def test_streams_are_hedged_on_the_first_chunk():
+    model = _hedged(FakeModel("slow answer", delay = 1), FakeModel("fast answer"))
+
+    async def stream():
+        return [chunk async for chunk in model.astream("hi")]
+
+    assert asyncio.run(stream()) == ["fast", "answer"]
+
+def test_failed_calls_fail_over():
+    model = _hedged(FakeModel("primary", error = ApiError(529)), FakeModel("alternate"))
+    failovers = metrics.LLM_FAILOVERS.value("agent")
+    assert asyncio.run(model.ainvoke("hi")) == "alternate"
+    assert model.invoke("hi") == "alternate"
+    assert metrics.LLM_FAILOVERS.value("agent") - failovers == 2
+
+    # Invalid requests would fail on the alternate too
+    model.primary.error = ApiError(400)
+    with pytest.raises(ApiError):
+        asyncio.run(model.ainvoke("hi"))
+
+def test_model_is_chosen_per_call_site_by_config():
+    built = []
+    def build(name, api_url):
+        built.append(name)
+        return FakeModel(name)
+
+    router = model_router.create("resolver", build, model = "default", selectable_models = ["other"])
+    assert router.invoke("hi") == "default"
+    assert router.invoke("hi", {"configurable": {"resolver_model": "other"}}) == "other"
+    assert router.invoke("hi", {"configurable": {"resolver_model": "other"}}) == "other"
+    # Alternatives are created once, on first use
+    assert built.count("other") == 1
+
+def test_waiting_for_the_scheduler_doesnt_trigger_hedging():
+    scheduler = LlmScheduler()
+    # Paused by a rate limited response
+    scheduler._paused_until = time.monotonic() + 0.3
+    alternate = FakeModel("alternate")
+    model = _hedged(ScheduledModel(FakeModel("primary"), scheduler, Priority.Agent), alternate)
+    assert asyncio.run(model.ainvoke("hi")) == "primary"
+    assert alternate.calls == 0
+    # The queue wait isn't counted as latency either
+    assert model.latency.quantile(1) < 0.1
+
+def test_calls_are_hedged_only_with_an_alternate():
+    primary = FakeModel("primary", error = ApiError(529))
+    model = model_router.create("agent", lambda name, api_url: primary, model = "default", selectable_models = [])
+    hedged = model.default
+    assert hedged.quantile == 0
+    # Failed calls are still repeated on the same endpoint
+    with pytest.raises(ApiError):
+        asyncio.run(hedged.ainvoke("hi"))
+    assert primary.calls == 2
@@ -0,0 +1,79 @@
+import asyncio
+
+from langchain_core.language_models.fake_chat_models import FakeMessagesListChatModel
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+from app import chain, checkpoint, metrics
+from app.prompt_cache import EPHEMERAL
+from app.state import State
+from app.tools.resolver import SearchTypeResolver
+
+class RecordingModel(FakeMessagesListChatModel):
+    inputs: list = []
+    tools: list = []
+
+    def bind_tools(self, tools, **kwargs):
+        self.tools = tools
+        return self
+
+    def _generate(self, messages, *args, **kwargs):
+        self.inputs.append(messages)
+        return super()._generate(messages, *args, **kwargs)
+
+def _cache_reads():
+    return sum(metrics.LLM_TOKENS.value(caller, "cache_read") for caller in ("agent", "resolver", "summarizer"))
+
+def _cache_controls(message):
+    if isinstance(message.content, str):
+        return []
+    return [block.get("cache_control") for block in message.content]
+
+def test_stable_prefixes_are_marked(monkeypatch):
+    async def areply(message, config, **kwargs):
+        pass
+    monkeypatch.setattr(chain, "call_areply", areply)
+    monkeypatch.setattr(chain, "PROMPT_CACHING", True)
+    monkeypatch.setattr(chain, "BACKGROUND_SUMMARIZATION", False)
+    monkeypatch.setattr(chain, "MAX_CONTEXT_TOKENS", 1)
+    monkeypatch.setattr(chain, "KEEP_CONTEXT_TOKENS", 1)
+
+    usage = {"input_tokens": 10, "cache_creation_input_tokens": 0, "cache_read_input_tokens": 2000}
+    models = []
+    def chat_model(*, callbacks = None, **kwargs):
+        content = "answer" if models else "summary"
+        responses = [AIMessage(content=content, response_metadata={"usage": usage}) for _ in range(10)]
+        models.append(RecordingModel(responses=responses, callbacks=callbacks))
+        return models[-1]
+
+    the_chain = chain.create(
+        claude_api_key = "fake",
+        checkpointer = checkpoint.create(),
+        chat_model = chat_model
+    )
+    cache_reads = _cache_reads()
+    config = {"configurable": {"thread_id": "prompt-cache"}}
+    asyncio.run(the_chain.ainvoke("first", config))
+    asyncio.run(the_chain.ainvoke("second", config))
+    asyncio.run(the_chain.ainvoke("third", config))
+
+    # Summarizer, resolver and agent models
+    _, _, agent = models
+    # Breakpoint after the last tool covers all tool schemas
+    assert [tool.get("cache_control") for tool in agent.tools] == [None] * (len(agent.tools) - 1) + [EPHEMERAL]
+    first_turn, _, third_turn = agent.inputs
+    assert not isinstance(first_turn[0], SystemMessage)
+    assert _cache_controls(third_turn[0]) == [EPHEMERAL]
+    assert "summary" in third_turn[0].content[0]["text"]
+    # Only the system prompt is marked
+    assert all(_cache_controls(message) in ([], [None]) for message in third_turn[1:])
+    assert _cache_reads() - cache_reads == 2000 * 5
+
+def test_resolver_prompt_is_marked():
+    model = RecordingModel(responses=[AIMessage(content="PUBLIC")], inputs=[])
+    resolver = SearchTypeResolver(model, "resolvesearchtype", prompt_caching = True)
+    state = State(messages=[HumanMessage(content="find cats", id="1")])
+    assert resolver.process(state) == "PUBLIC"
+    system, human = model.inputs[0]
+    assert _cache_controls(system) == [EPHEMERAL]
+    assert system.content[0]["text"] == SearchTypeResolver.type_of_search_prompt
+    assert human.content == "find cats"
@@ -0,0 +1,77 @@
+import threading
+
+from app import metrics, prompts
+from app.prompts import FileSource, PromptRegistry
+
+def _write(tmp_path, text):
+    (tmp_path / "main.txt").write_text(text)
+
+def _registry(tmp_path, **kwargs):
+    return PromptRegistry(
+        FileSource(str(tmp_path)),
+        ["main"],
+        partial_variables = {"main": {"chat_history": "none"}},
+        **kwargs
+    )
+
+def test_versions_are_compiled_once_and_bounded(tmp_path):
+    _write(tmp_path, "v0 {input} {chat_history}")
+    registry = _registry(tmp_path, max_versions = 2)
+    first = registry.current_versions()["main"]
+    assert registry.get("main") is registry.get("main")
+    assert registry.get("main").invoke({"input": "hi"}).to_string() == "Human: v0 hi none"
+
+    assert not registry.refresh()
+    for i in range(1, 4):
+        _write(tmp_path, f"v{i} {{input}}")
+        assert registry.refresh()
+    assert len(registry.versions("main")) == 2
+    assert first not in registry.versions("main")
+    assert registry.get("main").invoke({"input": "hi"}).to_string() == "Human: v3 hi"
+
+def test_failed_refresh_keeps_the_prompt(tmp_path):
+    _write(tmp_path, "v0 {input}")
+    registry = _registry(tmp_path)
+    errors = metrics.PROMPT_REFRESHES.value("error")
+    (tmp_path / "main.txt").unlink()
+    assert not registry.refresh()
+    assert metrics.PROMPT_REFRESHES.value("error") - errors == 1
+    assert registry.get("main").invoke({"input": "hi"}).to_string() == "Human: v0 hi"
+
+def test_requests_are_pinned_to_a_version(tmp_path):
+    _write(tmp_path, "v0 {input}")
+    registry = _registry(tmp_path)
+    route = registry.route("main")
+    config = prompts.set_per_request(registry)({}, None)
+
+    _write(tmp_path, "v1 {input}")
+    registry.refresh()
+    # A request which started before the refresh keeps its version
+    assert route.invoke({"input": "hi"}, config).to_string() == "Human: v0 hi"
+    assert route.invoke({"input": "hi"}).to_string() == "Human: v1 hi"
+
+def test_route_sees_a_version_with_its_template(tmp_path):
+    _write(tmp_path, "v0 {input}")
+    registry = _registry(tmp_path)
+    route = registry.route("main")
+    stop = threading.Event()
+
+    def refresh():
+        i = 0
+        while not stop.is_set():
+            i += 1
+            _write(tmp_path, f"v{i % 2} {{input}}")
+            registry.refresh()
+
+    refresher = threading.Thread(target = refresh)
+    refresher.start()
+    try:
+        for _ in range(300):
+            # Pinned to the current version while it is being replaced
+            config = prompts.set_per_request(registry)({}, None)
+            pinned = registry.get("main", config["configurable"]["main_prompt"])
+            assert route.invoke({"input": "hi"}, config).to_string() == pinned.invoke({"input": "hi"}).to_string()
+            assert route.invoke({"input": "hi"}).to_string() in ("Human: v0 hi", "Human: v1 hi")
+    finally:
+        stop.set()
+        refresher.join()
@@ -0,0 +1,86 @@
+import asyncio
+
+import pytest
+from langchain_core.messages import AIMessageChunk
+
+from app import streaming
+from app.streaming import ReplyStreamer, into_message
+
+@pytest.fixture
+def replies(monkeypatch):
+    sent = []
+    async def areply(message, config, *, entry_local_id = None):
+        sent.append((message, entry_local_id))
+        return {"entryLocalId": 42}
+    async def aremove_reply(entry_local_id, config):
+        sent.append(("<removed>", entry_local_id))
+        return {}
+    monkeypatch.setattr(streaming, "_areply", areply)
+    monkeypatch.setattr(streaming, "_aremove_reply", aremove_reply)
+    return sent
+
+def _stream(chunks, **kwargs):
+    streamer = ReplyStreamer({}, **kwargs)
+    async def run():
+        aggregate = None
+        for chunk in chunks:
+            aggregate = chunk if aggregate is None else aggregate + chunk
+            await streamer.feed(chunk)
+        message = into_message(aggregate)
+        return message, await streamer.finish(message)
+    return asyncio.run(run())
+
+def _text_chunks(*texts):
+    return [AIMessageChunk(content=[{"type": "text", "text": text, "index": 0}]) for text in texts]
+
+def test_streams_text_as_updates_of_one_reply(replies):
+    message, delivered = _stream(
+        _text_chunks("Hello", ", ", "world", "!"),
+        flush_interval = 60,
+        flush_size = 5
+    )
+    assert delivered
+    assert message.content == "Hello, world!"
+    assert replies == [("Hello", None), ("Hello, world", 42), ("Hello, world!", 42)]
+
+def test_short_answer_is_left_to_final_answer(replies):
+    message, delivered = _stream(_text_chunks("Hi"), flush_interval = 60, flush_size = 100)
+    assert not delivered
+    assert message.content == "Hi"
+    assert replies == []
+
+def _tool_call():
+    return AIMessageChunk(
+        content=[{"type": "tool_use", "id": "c1", "name": "reset", "input": {}, "index": 1}],
+        tool_call_chunks=[{"index": 1, "id": "c1", "name": "reset", "args": ""}]
+    )
+
+def test_text_before_tool_call_is_not_shown(replies):
+    message, delivered = _stream(
+        _text_chunks("Let me ", "search") + [_tool_call()],
+        flush_interval = 0,
+        flush_size = 100
+    )
+    assert not delivered
+    assert message.tool_calls[0]["name"] == "reset"
+    assert replies == []
+
+def test_reply_sent_before_tool_call_is_removed(replies):
+    message, delivered = _stream(
+        _text_chunks("Let me ") + [_tool_call()] + _text_chunks("ignored"),
+        flush_interval = 60,
+        flush_size = 1
+    )
+    assert not delivered
+    assert message.tool_calls[0]["name"] == "reset"
+    assert replies == [("Let me ", None), ("<removed>", 42)]
+
+def test_multi_block_answer_is_delivered_once(replies):
+    chunks = [
+        AIMessageChunk(content=[{"type": "text", "text": "First part. ", "index": 0}]),
+        AIMessageChunk(content=[{"type": "text", "text": "Second part.", "index": 1}]),
+    ]
+    message, delivered = _stream(chunks, flush_interval = 60, flush_size = 5)
+    assert isinstance(message.content, list)
+    assert delivered
+    assert replies == [("First part. ", None), ("First part. Second part.", 42)]
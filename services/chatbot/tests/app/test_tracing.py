@@ -0,0 +1,116 @@
+import json
+
+import pytest
+
+from app import metrics, tracing
+from app.tracing import JsonlExporter, Tracer
+
+class ListExporter:
+    def __init__(self):
+        self.traces = []
+
+    def export(self, traces):
+        self.traces += traces
+
+def test_errors_are_sampled(monkeypatch):
+    exporter = ListExporter()
+    tracer = Tracer(exporter, sample_rate = 0)
+    monkeypatch.setattr(tracing, "tracer", tracer)
+    with tracing.trace("turn", thread_id = "t1"):
+        with tracing.span("backend"):
+            pass
+    with pytest.raises(ValueError):
+        with tracing.trace("turn", thread_id = "t1"):
+            with tracing.span("backend"):
+                raise ValueError("failed")
+    tracer.start()
+    tracer.stop()
+
+    assert len(exporter.traces) == 1
+    trace = exporter.traces[0]
+    assert [span.name for span in trace.spans] == ["turn", "backend"]
+    assert trace.spans[1].parent_id == trace.root.span_id
+    assert trace.spans[1].error == "ValueError: failed"
+
+def test_unsampled_traces_record_light_spans_until_an_error(monkeypatch):
+    exporter = ListExporter()
+    tracer = Tracer(exporter, sample_rate = 0)
+    monkeypatch.setattr(tracing, "tracer", tracer)
+    with tracing.trace("turn", thread_id = "t1") as trace:
+        with tracing.span("resolve", query = "cats"):
+            tracing.annotate(level = "WARNING")
+        with pytest.raises(ValueError):
+            with tracing.span("backend", endpoint = "search"):
+                raise ValueError("failed")
+        with tracing.span("retry", endpoint = "search"):
+            pass
+    assert not trace.sampled
+    tracer.start()
+    tracer.stop()
+
+    spans = {span.name: span for span in exporter.traces[0].spans}
+    assert spans["turn"].attributes == {"thread_id": "t1"}
+    # Timings and errors only, until the error
+    assert spans["resolve"].attributes == {} and spans["resolve"].duration is not None
+    assert spans["backend"].error == "ValueError: failed"
+    assert spans["retry"].attributes == {"endpoint": "search"}
+
+def test_full_queue_drops_spans():
+    tracer = Tracer(ListExporter(), queue_size = 1)
+    dropped = metrics.TRACE_SPANS.value("dropped")
+    for _ in range(3):
+        with tracer.trace("turn"):
+            pass
+    assert metrics.TRACE_SPANS.value("dropped") - dropped == 2
+
+def test_disabled_tracer_records_nothing():
+    tracer = Tracer(None)
+    with tracer.trace("turn") as trace:
+        assert trace is None
+        with tracing.span("backend") as span:
+            assert span is None
+
+def test_jsonl_exporter(tmp_path):
+    path = tmp_path / "traces.jsonl"
+    tracer = Tracer(JsonlExporter(str(path)), batch_size = 2, flush_interval = 0.01)
+    tracer.start()
+    for i in range(3):
+        with tracer.trace("turn", thread_id = f"t{i}"):
+            pass
+    tracer.stop()
+    spans = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [span["attributes"]["thread_id"] for span in spans] == ["t0", "t1", "t2"]
+    assert all(span["duration_ms"] >= 0 for span in spans)
+
+def test_chain_nodes_are_traced(monkeypatch):
+    import asyncio
+    from langchain_core.language_models.fake_chat_models import FakeMessagesListChatModel
+    from langchain_core.messages import AIMessage
+    from app import chain, checkpoint
+
+    class FakeModel(FakeMessagesListChatModel):
+        def bind_tools(self, tools, **kwargs):
+            return self
+
+    async def areply(message, config, **kwargs):
+        pass
+    monkeypatch.setattr(chain, "call_areply", areply)
+    exporter = ListExporter()
+    monkeypatch.setattr(tracing, "tracer", Tracer(exporter))
+
+    the_chain = chain.create(
+        claude_api_key = "fake",
+        checkpointer = checkpoint.create(),
+        chat_model = lambda **kwargs: FakeModel(responses = [AIMessage(content = "answer")]),
+        background_summarization = False
+    )
+    asyncio.run(the_chain.ainvoke("hi", {"configurable": {"thread_id": "traced"}}))
+    tracing.tracer.start()
+    tracing.tracer.stop()
+
+    trace = exporter.traces[0]
+    spans = {span.name: span for span in trace.spans}
+    assert trace.root.attributes == {"thread_id": "traced", "messages": 1}
+    assert list(spans) == ["turn", "agent", "model", "finalanswer"]
+    assert spans["model"].parent_id == spans["agent"].span_id
+    assert spans["finalanswer"].parent_id == trace.root.span_id
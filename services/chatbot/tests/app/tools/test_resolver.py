@@ -1,7 +1,9 @@
 import os
 import uuid
+import asyncio
 from langchain_core.messages import ToolMessage, HumanMessage
 from langchain_anthropic import ChatAnthropic
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
 import pytest
 
 from app.state import State
@@ -45,3 +47,62 @@ def test_resolved_types(classifier_model, batch_size, expected_types):
             assert result == next(expected_iter)
             state.messages.append(ToolMessage(result, name=RESOLVE_TOOL, status="success", tool_call_id=str(uuid.uuid1())))
 
+
+@pytest.mark.parametrize("batch_size, expected_types", [(1, OUTPUTS_1), (2, OUTPUTS_2), (3, OUTPUTS_3)])
+def test_resolved_types_async(classifier_model, batch_size, expected_types):
+    resolver = SearchTypeResolver(classifier_model, RESOLVE_TOOL)
+    state = State(messages = [])
+    count = 0
+    expected_iter = iter(expected_types)
+    for text in USER_INPUTS:
+        state.messages.append(HumanMessage(content=text))
+        count += 1
+        if (count % batch_size) == 0:
+            result = asyncio.run(resolver.aprocess(state))
+            assert result == next(expected_iter)
+            state.messages.append(ToolMessage(result, name=RESOLVE_TOOL, status="success", tool_call_id=str(uuid.uuid1())))
+
+@pytest.mark.parametrize("batch_size, expected_types", [(1, OUTPUTS_1), (2, OUTPUTS_2), (3, OUTPUTS_3)])
+def test_resolved_types_batched(classifier_model, batch_size, expected_types):
+    resolver = SearchTypeResolver(classifier_model, RESOLVE_TOOL, batched = True)
+    state = State(messages = [])
+    count = 0
+    expected_iter = iter(expected_types)
+    for text in USER_INPUTS:
+        state.messages.append(HumanMessage(content=text))
+        count += 1
+        if (count % batch_size) == 0:
+            result = resolver.process(state)
+            assert result == next(expected_iter)
+            state.messages.append(ToolMessage(result, name=RESOLVE_TOOL, status="success", tool_call_id=str(uuid.uuid1())))
+
+@pytest.mark.parametrize("responses, expected_type, expected_calls", [
+    (['{"1": "PUBLIC", "2": "UNCERTAIN", "3": "PRIVATE"}'], "PRIVATE", 1),
+    (['Result: {"1": "PRIVATE", "2": "UNCERTAIN", "3": "UNCERTAIN"}'], "PRIVATE", 1),
+    (['{"1": "UNCERTAIN", "2": "UNCERTAIN", "3": "UNCERTAIN"}'], "GENERAL", 1),
+    # Unparsable, truncated or incomplete responses, mismatched ids and invalid values
+    # fall back to a call per message, in order
+    (["PUBLIC", "PRIVATE", "UNCERTAIN", "PUBLIC"], "PUBLIC", 4),
+    (['{"1": "UNCERTAIN", "2": "PUB', "PUBLIC", "PRIVATE", "UNCERTAIN"], "PRIVATE", 4),
+    (['{"1": "PUBLIC"}', "PUBLIC", "PRIVATE", "UNCERTAIN"], "PRIVATE", 4),
+    (['{"1": "PUBLIC", "2": "PUBLIC", "4": "PUBLIC"}', "PUBLIC", "PRIVATE", "UNCERTAIN"], "PRIVATE", 4),
+    (['{"1": "PUBLIC", "2": "PUBLIC", "3": "CHATS"}', "PUBLIC", "PRIVATE", "UNCERTAIN"], "PRIVATE", 4),
+    (['["PUBLIC", "UNCERTAIN", "PUBLIC"]', "PUBLIC", "PRIVATE", "UNCERTAIN"], "PRIVATE", 4),
+])
+def test_batched_response_parsing(responses, expected_type, expected_calls):
+    # The sentinel response is never consumed if the call count is right
+    model = FakeListChatModel(responses = responses + ["UNEXPECTED"])
+    resolver = SearchTypeResolver(model, RESOLVE_TOOL, batched = True)
+    state = State(messages = [HumanMessage(content=text) for text in USER_INPUTS[:3]])
+    assert resolver.process(state) == expected_type
+    assert model.i == expected_calls
+
+    model.i = 0
+    assert asyncio.run(resolver.aprocess(state)) == expected_type
+    assert model.i == expected_calls
+
+def test_single_message_isnt_batched():
+    model = FakeListChatModel(responses = ["PUBLIC", "UNEXPECTED"])
+    resolver = SearchTypeResolver(model, RESOLVE_TOOL, batched = True)
+    assert resolver.process(State(messages = [HumanMessage(content = "London")])) == "PUBLIC"
+    assert model.i == 1
@@ -0,0 +1,57 @@
+import pytest
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.messages import HumanMessage
+
+from app import metrics
+from app.state import State
+from app.tools.resolver import SearchTypeResolver
+from app.tools.resolver_rules import SearchTypeRules
+
+RESOLVE_TOOL = "search_type_resolve_tool"
+
+@pytest.mark.parametrize("text, expected", [
+    ("Search in public chats", "PUBLIC"),
+    ("search in all chats", "GENERAL"),
+    ("search everywhere", "GENERAL"),
+    ("please start over", "GENERAL"),
+    ("search in my chats", "PRIVATE"),
+    ("look in private chats", "PRIVATE"),
+    ("Поищи в публичных чатах", "PUBLIC"),
+    ("поищи в моих чатах", "PRIVATE"),
+    ("ищи везде", "GENERAL"),
+    ("давай начнем заново", "GENERAL"),
+    # Deferred to the model
+    ("London is the capital of the Great Britain", None),
+    ("not in public chats", None),
+    ("search public chats and my chats", None),
+    ("не в публичных чатах", None),
+])
+def test_default_rules(text, expected):
+    assert SearchTypeRules().classify(text) == expected
+
+def test_custom_rules_file(tmp_path):
+    path = tmp_path / "rules.json"
+    path.write_text('{"PUBLIC": ["\\\\bopen\\\\s+chats\\\\b"]}', encoding="utf-8")
+    rules = SearchTypeRules.from_file(str(path))
+    assert rules.classify("search in open chats") == "PUBLIC"
+    assert rules.classify("search in public chats") is None
+
+@pytest.mark.parametrize("texts, responses, expected_type, expected_calls", [
+    # The last message is explicit: no model calls
+    (["London is the capital", "search in my chats"], [], "PRIVATE", 0),
+    # Only the messages after the last explicit one go to the model
+    (["search in my chats", "London is the capital", "Paris"], ["UNCERTAIN", "PUBLIC"], "PUBLIC", 2),
+    (["search in my chats", "London is the capital"], ["UNCERTAIN"], "PRIVATE", 1),
+    (["London is the capital"], ["UNCERTAIN"], "GENERAL", 1),
+])
+def test_fast_path(texts, responses, expected_type, expected_calls):
+    # The sentinel response is never consumed if the call count is right
+    model = FakeListChatModel(responses = responses + ["UNEXPECTED"])
+    resolver = SearchTypeResolver(model, RESOLVE_TOOL, rules = SearchTypeRules())
+    state = State(messages = [HumanMessage(content=text) for text in texts])
+    hits, fallbacks = metrics.SEARCH_TYPE_RESOLUTIONS.value("fast_path"), metrics.SEARCH_TYPE_RESOLUTIONS.value("model")
+
+    assert resolver.process(state) == expected_type
+    assert model.i == expected_calls
+    assert metrics.SEARCH_TYPE_RESOLUTIONS.value("model") - fallbacks == expected_calls
+    assert metrics.SEARCH_TYPE_RESOLUTIONS.value("fast_path") - hits == len(texts) - expected_calls
@@ -0,0 +1,126 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from app.tools.search_cache import SearchCache
+
+def _key(text, thread_id = "t1", user_id = "u1"):
+    return SearchCache.key(user_id, thread_id, text, "PUBLIC")
+
+def test_normalized_text_hits():
+    cache = SearchCache(max_entries = 10, ttl = 60)
+    calls = []
+    fetch = lambda: calls.append(1) or [{"link": "l1"}]
+    assert cache.get_or_fetch(_key("Cats  and dogs"), fetch) == [{"link": "l1"}]
+    assert cache.get_or_fetch(_key(" cats and DOGS "), fetch) == [{"link": "l1"}]
+    assert len(calls) == 1
+    # Other principals and search types are not shared
+    cache.get_or_fetch(_key("cats and dogs", user_id = "u2"), fetch)
+    cache.get_or_fetch(SearchCache.key("u1", "t1", "cats and dogs", "PRIVATE"), fetch)
+    assert len(calls) == 3
+
+def test_expired_results_are_fetched_again():
+    cache = SearchCache(max_entries = 10, ttl = 0.01)
+    calls = []
+    fetch = lambda: calls.append(1) or []
+    cache.get_or_fetch(_key("cats"), fetch)
+    time.sleep(0.02)
+    cache.get_or_fetch(_key("cats"), fetch)
+    assert len(calls) == 2
+
+def test_invalidate_drops_conversation_results():
+    cache = SearchCache(max_entries = 10, ttl = 60)
+    calls = []
+    fetch = lambda: calls.append(1) or []
+    cache.get_or_fetch(_key("cats", "t1"), fetch)
+    cache.get_or_fetch(_key("cats", "t2"), fetch)
+    assert cache.invalidate("t1") == 1
+    cache.get_or_fetch(_key("cats", "t1"), fetch)
+    cache.get_or_fetch(_key("cats", "t2"), fetch)
+    assert len(calls) == 3
+
+def test_concurrent_async_requests_share_one_call():
+    cache = SearchCache(max_entries = 10, ttl = 60)
+    calls = []
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return [{"link": "l1"}]
+
+    async def run():
+        return await asyncio.gather(*(cache.aget_or_fetch(_key("cats"), fetch) for _ in range(5)))
+
+    assert asyncio.run(run()) == [[{"link": "l1"}]] * 5
+    assert len(calls) == 1
+
+def test_concurrent_sync_requests_share_one_call():
+    cache = SearchCache(max_entries = 10, ttl = 60)
+    calls = []
+    started = threading.Event()
+    def fetch():
+        calls.append(1)
+        started.set()
+        time.sleep(0.05)
+        return ["result"]
+
+    results = []
+    def request():
+        results.append(cache.get_or_fetch(_key("cats"), fetch))
+    leader = threading.Thread(target = request)
+    leader.start()
+    started.wait()
+    followers = [threading.Thread(target = request) for _ in range(3)]
+    for thread in followers:
+        thread.start()
+    for thread in [leader] + followers:
+        thread.join()
+    assert results == [["result"]] * 4
+    assert len(calls) == 1
+
+def test_failures_are_not_cached():
+    cache = SearchCache(max_entries = 10, ttl = 60)
+    async def fail():
+        raise ValueError("backend is down")
+    async def succeed():
+        return ["result"]
+
+    async def run():
+        with pytest.raises(ValueError):
+            await cache.aget_or_fetch(_key("cats"), fail)
+        return await cache.aget_or_fetch(_key("cats"), succeed)
+
+    assert asyncio.run(run()) == ["result"]
+
+def test_new_tokens_with_the_same_claims_hit(monkeypatch):
+    import httpx
+    import jwt
+    from starlette.requests import Request
+    from app import server, tools
+    from app.auth import TokenVerifier
+    from app.tools import _Tools
+
+    calls = []
+    def backend(request):
+        calls.append(request.headers["Authorization"])
+        return httpx.Response(200, json = [{"link": "l1"}])
+    monkeypatch.setattr(_Tools, "async_client", httpx.AsyncClient(transport = httpx.MockTransport(backend)))
+    monkeypatch.setattr(_Tools, "SEARCH_IN_CHATS", "http://backend/api/bot/search/chats")
+    monkeypatch.setattr(_Tools, "search_cache", SearchCache(max_entries = 10, ttl = 60))
+    monkeypatch.setattr(server, "token_verifier", TokenVerifier(None, algorithms = ["HS256"]))
+
+    def config(expires):
+        # The backend signs a new token with a new expiration for every turn
+        token = jwt.encode({"ConversationId": "c1", "UserId": "u1", "exp": expires}, "secret", algorithm = "HS256")
+        headers = [(b"authorization", f"Bearer {token}".encode())]
+        request = Request({"type": "http", "headers": headers})
+        return server._extract_thread_id(server._add_tools_auth_context({}, request), request)
+
+    async def run():
+        now = int(time.time())
+        for expires in (now + 300, now + 310):
+            assert await tools.search_in_chats.coroutine("cats", "PUBLIC", config(expires)) == [{"link": "l1"}]
+
+    asyncio.run(run())
+    assert len(calls) == 1
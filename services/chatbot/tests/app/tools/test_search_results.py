@@ -0,0 +1,48 @@
+import json
+
+from langchain_core.messages import ToolMessage
+
+from app.state import SearchResult, State
+from app.tools import _forward_search_results_request, save_tool_results_to_state
+from app.tools.search_results import MAX_SNIPPET_LENGTH, parse_search_results
+
+RESULTS = [
+    {
+        "link": "/chat/c1#10",
+        "document": {
+            "rank": 0.75,
+            "document": {
+                "metadata": {"chatEntries": [{"id": "c1:0:10", "version": 1}]},
+                "text": "x" * 1000
+            }
+        }
+    },
+    {"link": "/chat/c2#5"},
+    {"document": {}},
+]
+
+def _tool_message(content, status = "success", id = "t1"):
+    return ToolMessage(content=content, tool_call_id="c", name="search_in_chats", status=status, id=id)
+
+def test_parse_backend_results():
+    results = parse_search_results(json.dumps(RESULTS))
+    assert results == [
+        SearchResult(link="/chat/c1#10", id="c1:0:10", score=0.75, snippet="x" * MAX_SNIPPET_LENGTH),
+        SearchResult(link="/chat/c2#5"),
+    ]
+    assert parse_search_results([]) == []
+    assert parse_search_results("not json") == []
+
+def test_results_are_saved_once_and_forwarded():
+    state = State(messages=[_tool_message(json.dumps(RESULTS))])
+    save_tool_results_to_state(state)
+    assert [result.link for result in state.last_search_results] == ["/chat/c1#10", "/chat/c2#5"]
+    assert _forward_search_results_request("here", state) == {
+        "comment": "here",
+        "links": ["/chat/c1#10", "/chat/c2#5"]
+    }
+
+    # A failed search drops the previous results
+    state.messages.apply([_tool_message("Error", status="error", id="t2")])
+    save_tool_results_to_state(state)
+    assert state.last_search_results == []
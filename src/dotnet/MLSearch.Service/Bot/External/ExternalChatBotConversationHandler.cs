@@ -75,6 +75,8 @@ internal class ExternalChatBotConversationHandler(
                 input = lastUpdatedDocument.Content,
             }),
         };
+        // Replies come back through the bot tools API, so only the turn status is requested.
+        requestMessage.Headers.Add("X-Bot-Response-Mode", "status");
         botToolsContextHandler.SetContext(requestMessage, conversationId: chatId, userId: userId);
         var response = await client.SendAsync(requestMessage, cancellationToken).ConfigureAwait(false);
         var resultContent = await response.Content.ReadAsStringAsync(cancellationToken).ConfigureAwait(false);
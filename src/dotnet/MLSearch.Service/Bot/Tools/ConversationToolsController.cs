@@ -8,10 +8,25 @@ namespace ActualChat.MLSearch.Bot.Tools;
 [ApiController]
 [Route("api/bot/conversation")]
 [Produces("application/json")]
-public sealed class ConversationToolsController(ICommander commander, IBotToolsContextHandler botToolsContext, UrlMapper urlMapper): ControllerBase
+public sealed class ConversationToolsController(
+    ICommander commander,
+    IChatsBackend chatsBackend,
+    IBotToolsContextHandler botToolsContext,
+    UrlMapper urlMapper
+): ControllerBase
 {
     public sealed class Reply {
         public required string Text { get; init; }
+        // Set to update a previously sent reply, e.g. while it is being streamed
+        public long? EntryLocalId { get; init; }
+    }
+
+    public sealed class ReplyResult {
+        public required long EntryLocalId { get; init; }
+    }
+
+    public sealed class RemoveReply {
+        public required long EntryLocalId { get; init; }
     }
 
     public sealed class ForwardLocalLinks {
@@ -23,7 +38,7 @@ public sealed class ForwardLocalLinks {
     }
 
     [HttpPost("reply")]
-    public async Task ReplyAction([FromBody]Reply reply, CancellationToken cancellationToken) {
+    public async Task<ReplyResult> ReplyAction([FromBody]Reply reply, CancellationToken cancellationToken) {
         var context = botToolsContext.GetContext(Request);
         if (!context.IsValid) {
             throw new UnauthorizedAccessException();
@@ -34,16 +49,38 @@ public sealed class ForwardLocalLinks {
         }
         var chatId = ChatId.Parse(conversationId);
         AuthorId botId = new(chatId, Constants.User.Sherlock.AuthorLocalId, AssumeValid.Option);
-        var textEntryId = new TextEntryId(chatId, 0, AssumeValid.Option);
-        var upsertCommand = new ChatsBackend_ChangeEntry(
-            textEntryId,
-            null,
-            Change.Create(new ChatEntryDiff {
+        var textEntryId = new TextEntryId(chatId, reply.EntryLocalId ?? 0, AssumeValid.Option);
+        if (reply.EntryLocalId.HasValue)
+            await RequireOwnReply(textEntryId, botId, cancellationToken).ConfigureAwait(false);
+        var change = reply.EntryLocalId.HasValue
+            ? Change.Update(new ChatEntryDiff {
+                Content = reply.Text,
+            })
+            : Change.Create(new ChatEntryDiff {
                 AuthorId = botId,
                 Content = reply.Text,
-            }));
-        await commander.Call(upsertCommand, true, cancellationToken).ConfigureAwait(false);
-        return;
+            });
+        var upsertCommand = new ChatsBackend_ChangeEntry(textEntryId, null, change);
+        var entry = await commander.Call(upsertCommand, true, cancellationToken).ConfigureAwait(false);
+        return new ReplyResult { EntryLocalId = entry.LocalId };
+    }
+
+    [HttpPost("remove-reply")]
+    public async Task RemoveReplyAction([FromBody]RemoveReply reply, CancellationToken cancellationToken) {
+        var context = botToolsContext.GetContext(Request);
+        if (!context.IsValid) {
+            throw new UnauthorizedAccessException();
+        }
+        string? conversationId = context.ConversationId;
+        if (conversationId.IsNullOrEmpty()){
+            throw new UnauthorizedAccessException();
+        }
+        var chatId = ChatId.Parse(conversationId);
+        AuthorId botId = new(chatId, Constants.User.Sherlock.AuthorLocalId, AssumeValid.Option);
+        var textEntryId = new TextEntryId(chatId, reply.EntryLocalId, AssumeValid.Option);
+        await RequireOwnReply(textEntryId, botId, cancellationToken).ConfigureAwait(false);
+        var removeCommand = new ChatsBackend_ChangeEntry(textEntryId, null, Change.Remove<ChatEntryDiff>());
+        await commander.Call(removeCommand, true, cancellationToken).ConfigureAwait(false);
     }
 
     [HttpPost("forward-chat-links")]
@@ -69,4 +106,15 @@ public sealed class ForwardLocalLinks {
         await commander.Call(upsertCommand, true, cancellationToken).ConfigureAwait(false);
         return;
     }
+
+    // Only the bot's own replies can be changed
+    private async Task RequireOwnReply(TextEntryId textEntryId, AuthorId botId, CancellationToken cancellationToken) {
+        var entry = await chatsBackend.GetEntry(textEntryId, cancellationToken).ConfigureAwait(false);
+        if (entry is not { IsRemoved: false })
+            throw StandardError.NotFound<ChatEntry>("The reply is not found.");
+        if (entry.AuthorId != botId)
+            throw StandardError.Unauthorized("You can edit only your own messages.");
+        if (entry.Kind != ChatEntryKind.Text)
+            throw StandardError.Constraint("Only text messages can be edited.");
+    }
 }